@@ -2,17 +2,26 @@
 # ========================================================================================
 
 import os
+import time
 import base64
+import tempfile
 from datetime import datetime, date
 from typing import List, Tuple
 
 import streamlit as st
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
-from fpdf import FPDF
 from dateutil.relativedelta import relativedelta
 
+from pdfs import GeneradorPdf, exportar_pdf_unico, exportar_zip
+from sheets import (
+    limpiar_caches, precargar_datos, metricas_cuota, load_productos_df, load_compras_df, buscador_productos,
+    save_productos_df, productos_append_row,
+    resumen_sync, pedidos_sync_recientes, estado_sync, stock_comprometido, sincronizar_ahora,
+    estado_conexion, reintentar_conexion, conflictos_stock, marcar_conflictos_revisados,
+    guardar_pedido, editar_pedido, duplicar_pedido, registrar_compra, StockInsuficiente, stock_en,
+    historial_pagina, historial_pedido, historial_estatus, historial_pedidos_pdf, celdas_invalidas,
+)
+
 # ---- Compatibilidad Streamlit (experimental_rerun -> rerun) ----
 if not hasattr(st, "experimental_rerun") and hasattr(st, "rerun"):
     st.experimental_rerun = st.rerun
@@ -32,17 +41,6 @@ st.set_page_config(page_title="H DECANTS — Gestión de Pedidos", layout="wide"
 LOGO_URL   = "https://raw.githubusercontent.com/HarimEG/app-decants/main/hdecants_logo.jpg"
 LOGO_LOCAL = "hdecants_logo.jpg"
 
-SHEET_URL            = "https://docs.google.com/spreadsheets/d/1bjV4EaDNNbJfN4huzbNpTFmj-vfCr7A2474jhO81-bE/edit?gid=1318862509#gid=1318862509"
-SHEET_TAB_PRODUCTOS  = "Productos"
-SHEET_TAB_PEDIDOS    = "Pedidos"
-SHEET_TAB_ENVIOS     = "Envios"
-SHEET_TAB_COMPRAS    = "Compras"
-
-COMPRAS_COLS = [
-    "Producto", "Pzs", "Costo", "Status", "Mes", "Fecha", "Año",
-    "De quien", "Status de Pago", "Decants", "Vendedor"
-]
-
 ESTATUS_LIST = ["Cotizacion", "Pendiente", "Pagado", "En Proceso", "Entregado"]
 MESES = ["Enero","Febrero","Marzo","Abril","Mayo","Junio",
          "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
@@ -62,8 +60,7 @@ col_r, _ = st.columns([1, 5])
 with col_r:
     if st.button("🔄 Reconectar"):
         # limpia caches y re-ejecuta
-        get_client_and_ws.clear()
-        load_productos_df.clear(); load_pedidos_df.clear(); load_compras_df.clear()
+        limpiar_caches()
         st.experimental_rerun()
 
 # refresco suave: SOLO cuando hay conexión (para no “churnear” en el arranque)
@@ -81,78 +78,73 @@ with st.sidebar:
             st.session_state.connected = True
             st.experimental_rerun()
     else:
-        st.success("Conectado a Google Sheets")
+        red = estado_conexion()
+        if red["offline"]:
+            desde_txt = datetime.fromtimestamp(red["desde"]).strftime("%H:%M")
+            st.warning(f"📴 Sheets no responde desde las {desde_txt}: trabajando con la copia local. "
+                       "Los pedidos y compras se guardan y se sincronizan al volver la conexión.")
+            if red["error"]:
+                st.caption(red["error"])
+            if st.button("🔌 Reintentar conexión", use_container_width=True):
+                reintentar_conexion()
+                st.experimental_rerun()
+        else:
+            st.success("Conectado a Google Sheets")
+        m = metricas_cuota()
+        if m["calls"]:
+            st.caption(f"Sheets: {m['calls']} llamadas · espera por cuota {m['wait_s']:.1f}s · "
+                       f"reintentos {m['retries']} · lecturas compartidas {m['coalesced']}")
+
+        # Pedidos guardados localmente que el hilo de fondo aún no escribe en Sheets
+        sync = resumen_sync()
+        if sync["pedidos"]:
+            msg = f"⏳ {sync['pedidos']} pedido(s) pendientes de sincronizar"
+            if sync["con_error"]:
+                st.warning(msg + " (reintentando tras error)")
+            else:
+                st.info(msg)
+            if st.button("🔁 Sincronizar ahora", use_container_width=True):
+                sincronizar_ahora()
+                st.experimental_rerun()
+        recientes = pedidos_sync_recientes(8)
+        if recientes:
+            with st.expander("Sincronización de pedidos", expanded=False):
+                iconos = {"sincronizado": "✅", "pendiente": "⏳", "error": "⚠️"}
+                for r in recientes:
+                    linea = f"{iconos[r['estado']]} #{r['pedido_id']} — {r['estado']}"
+                    if r["renumerado_de"]:
+                        linea += f" (era #{r['renumerado_de']} sin conexión)"
+                    if r["error"]:
+                        linea += f" ({r['error']})"
+                    st.caption(linea)
+
+        # Ventas hechas sin conexión que, al sincronizar, no alcanzaron el stock de la hoja
+        conflictos = conflictos_stock()
+        if conflictos:
+            with st.expander(f"⚠️ {len(conflictos)} conflicto(s) de stock", expanded=True):
+                for c in conflictos:
+                    pedidos_txt = ", ".join(f"#{p}" for p in c["pedidos"])
+                    st.caption(f"**{c['producto']}** — {c['detalle']}" + (f" Pedidos: {pedidos_txt}" if pedidos_txt else ""))
+                if st.button("Marcar como revisados", use_container_width=True):
+                    marcar_conflictos_revisados()
+                    st.experimental_rerun()
+        # Celdas que no tienen el formato esperado: se cargaron con 0 / vacío en su lugar
+        invalidas = celdas_invalidas()
+        if invalidas:
+            total_inv = sum(n for n, _ in invalidas.values())
+            with st.expander(f"⚠️ {total_inv} celda(s) con formato inválido", expanded=False):
+                for hoja, (n, lista) in invalidas.items():
+                    st.caption(f"**{hoja}** — {n} celda(s):")
+                    for p in lista[:20]:
+                        st.caption(f"Fila {p.fila}, {p.columna}: {p.motivo} ({p.valor!r})")
         if st.button("Desconectar", use_container_width=True):
             st.session_state.connected = False
-            get_client_and_ws.clear()
-            load_productos_df.clear(); load_pedidos_df.clear(); load_compras_df.clear()
+            limpiar_caches()
             st.experimental_rerun()
 
 # =====================
-# CLIENTE GSHEETS (lazy)
-# =====================
-def _get_or_create_ws(sheet, title: str, rows: int = 200, cols: int = 20):
-    try:
-        return sheet.worksheet(title)
-    except Exception:
-        return sheet.add_worksheet(title=title, rows=rows, cols=cols)
-
-@st.cache_resource(show_spinner=False)
-def get_client_and_ws():
-    """Crea cliente y devuelve worksheets. Cachea el recurso."""
-    scope = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = Credentials.from_service_account_info(st.secrets["GOOGLE_SERVICE_ACCOUNT"], scopes=scope)
-    client = gspread.authorize(creds)
-    sheet = client.open_by_url(SHEET_URL)
-
-    productos_ws = _get_or_create_ws(sheet, SHEET_TAB_PRODUCTOS)
-    pedidos_ws   = _get_or_create_ws(sheet, SHEET_TAB_PEDIDOS)
-    envios_ws    = _get_or_create_ws(sheet, SHEET_TAB_ENVIOS)
-    compras_ws   = _get_or_create_ws(sheet, SHEET_TAB_COMPRAS)
-
-    # Asegura encabezados básicos
-    try:
-        if not productos_ws.row_values(1):
-            productos_ws.update("A1", [["Producto","Costo x ml","Stock disponible"]])
-    except Exception:
-        pass
-    try:
-        if not pedidos_ws.row_values(1):
-            pedidos_ws.update("A1", [["# Pedido","Nombre Cliente","Fecha","Producto","Mililitros","Costo x ml","Total","Estatus"]])
-    except Exception:
-        pass
-    try:
-        if not compras_ws.row_values(1):
-            compras_ws.update("A1", [COMPRAS_COLS])
-    except Exception:
-        pass
-
-    return client, sheet, productos_ws, pedidos_ws, envios_ws, compras_ws
-
-# --- Modo seguro: no hacemos st.stop() cuando no hay conexión ---
-class NotConnected(Exception):
-    pass
-
-def get_ws():
-    """Devuelve worksheets si hay conexión; si no, levanta NotConnected (no detiene el render)."""
-    if not st.session_state.get("connected", False):
-        raise NotConnected("Aún no conectado a Google Sheets.")
-    try:
-        return get_client_and_ws()
-    except Exception as e:
-        st.error(f"No hay conexión con Google Sheets: {e}")
-        raise
-
-# =====================
-# HELPERS (Latin-1 / descarga)
+# HELPERS (formato / descarga)
 # =====================
-def _latin1(s) -> str:
-    if s is None:
-        return ""
-    if not isinstance(s, str):
-        s = str(s)
-    return s.encode("latin-1", "ignore").decode("latin-1")
-
 def _fmt_money(x) -> str:
     try:
         return f"${float(x):,.2f}"
@@ -163,230 +155,10 @@ def link_descarga_pdf(pdf_bytes: bytes, filename: str) -> str:
     b64 = base64.b64encode(pdf_bytes).decode("utf-8")
     return f'<a href="data:application/pdf;base64,{b64}" download="{filename}">📥 Descargar PDF</a>'
 
-# =====================
-# CARGA RÁPIDA POR RANGO (Productos/Pedidos/Compras)
-# =====================
-@st.cache_data(ttl=600, show_spinner=False)
-def load_productos_df() -> pd.DataFrame:
-    try:
-        _, _, productos_ws, *_ = get_ws()
-    except NotConnected:
-        return pd.DataFrame(columns=["Producto", "Costo x ml", "Stock disponible"])
-
-    vals = productos_ws.get_values("A1:C20000")
-    if not vals:
-        return pd.DataFrame(columns=["Producto", "Costo x ml", "Stock disponible"])
-    headers = (vals[0] + ["","",""])[:3]
-    rows = [r for r in vals[1:] if any(str(c).strip() for c in r)]
-    if not rows:
-        return pd.DataFrame(columns=["Producto", "Costo x ml", "Stock disponible"])
-    df = pd.DataFrame(rows, columns=headers)
-    for c in ["Costo x ml","Stock disponible"]:
-        if c in df:
-            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0)
-    if "Producto" not in df:
-        df["Producto"] = ""
-    return df[["Producto","Costo x ml","Stock disponible"]].copy()
-
-@st.cache_data(ttl=600, show_spinner=False)
-def load_pedidos_df() -> pd.DataFrame:
-    try:
-        _, _, _, pedidos_ws, *_ = get_ws()
-    except NotConnected:
-        return pd.DataFrame(columns=["# Pedido","Nombre Cliente","Fecha","Producto","Mililitros","Costo x ml","Total","Estatus"])
-
-    vals = pedidos_ws.get_values("A1:H200000")
-    cols = ["# Pedido","Nombre Cliente","Fecha","Producto","Mililitros","Costo x ml","Total","Estatus"]
-    if not vals:
-        return pd.DataFrame(columns=cols)
-    headers = (vals[0] + [""]*8)[:8]
-    rows = [r for r in vals[1:] if any(str(c).strip() for c in r)]
-    if not rows:
-        return pd.DataFrame(columns=cols)
-    df = pd.DataFrame(rows, columns=headers)
-    for c in ["# Pedido","Mililitros"]:
-        if c in df: df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
-    for c in ["Costo x ml","Total"]:
-        if c in df: df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0)
-    return df[cols].copy()
-
-@st.cache_data(ttl=300, show_spinner=False)
-def load_compras_df() -> pd.DataFrame:
-    try:
-        _, _, _, _, _, compras_ws = get_ws()
-    except NotConnected:
-        return pd.DataFrame(columns=COMPRAS_COLS)
-
-    raw = compras_ws.get_values("A1:K10000")
-    if not raw:
-        return pd.DataFrame(columns=COMPRAS_COLS)
-    headers = (raw[0] + [""] * 11)[:11]
-    rows = [ (r + [""]*11)[:11] for r in raw[1:] if any(str(c).strip() for c in r) ]
-    if not rows:
-        return pd.DataFrame(columns=COMPRAS_COLS)
-    df = pd.DataFrame(rows, columns=headers)
-    for col in COMPRAS_COLS:
-        if col not in df: df[col] = ""
-    df = df[COMPRAS_COLS].copy()
-    df["Pzs"]   = pd.to_numeric(df["Pzs"], errors="coerce").fillna(0).astype(int)
-    df["Costo"] = pd.to_numeric(df["Costo"], errors="coerce").fillna(0.0)
-    df["Año"]   = pd.to_numeric(df["Año"], errors="coerce").fillna(0).astype(int)
-    return df
-
-# =====================
-# GUARDADOS (con manejo NotConnected)
-# =====================
-def save_productos_df(df: pd.DataFrame):
-    try:
-        _, _, productos_ws, *_ = get_ws()
-    except NotConnected:
-        st.error("Conéctate a Google Sheets para guardar Productos.")
-        return
-    productos_ws.clear()
-    productos_ws.update([df.columns.tolist()] + df.fillna("").values.tolist())
-    load_productos_df.clear()
-
-def append_envio_row(data: List):
-    try:
-        _, _, _, _, envios_ws, _ = get_ws()
-    except NotConnected:
-        st.error("Conéctate a Google Sheets para guardar el envío.")
-        return
-    envios_ws.append_row(data)
-
-def append_compra_row(row: List[str]):
-    try:
-        _, _, _, _, _, compras_ws = get_ws()
-    except NotConnected:
-        st.error("Conéctate a Google Sheets para guardar la compra.")
-        return
-    compras_ws.append_row(row, value_input_option="USER_ENTERED")
-    load_compras_df.clear()
-
-def productos_append_row(nombre: str, costo_ml: float = 0.0, stock: float = 0.0):
-    try:
-        _, _, productos_ws, *_ = get_ws()
-    except NotConnected:
-        st.error("Conéctate a Google Sheets para agregar productos.")
-        return
-    productos_ws.append_row([nombre, float(costo_ml), float(stock)], value_input_option="USER_ENTERED")
-    load_productos_df.clear()
 
-# =====================
-# HELPERS GSHEETS (parciales)
-# =====================
-def _productos_index_map():
-    try:
-        _, _, productos_ws, *_ = get_ws()
-    except NotConnected:
-        return {}
-    nombres = productos_ws.get_values("A2:A20000")
-    costos  = productos_ws.get_values("B2:B20000")
-    stocks  = productos_ws.get_values("C2:C20000")
-    out = {}
-    n = max(len(nombres), len(costos), len(stocks))
-    for i in range(n):
-        nom = (nombres[i][0] if i < len(nombres) and nombres[i] else "").strip()
-        if not nom:
-            continue
-        try:
-            costo = float(costos[i][0]) if (i < len(costos) and costos[i] and str(costos[i][0]).strip()) else 0.0
-        except Exception:
-            costo = 0.0
-        try:
-            stk   = float(stocks[i][0]) if (i < len(stocks) and stocks[i] and str(stocks[i][0]).strip()) else 0.0
-        except Exception:
-            stk = 0.0
-        out[nom] = (i+2, costo, stk)  # +2 por header
-    return out
-
-def productos_update_stock(nombre: str, nuevo_stock: float):
-    """Actualiza solo la celda de stock para un producto (seguro, Worksheet.batch_update)."""
-    mapa = _productos_index_map()
-    idx = mapa.get(nombre)
-    if not idx:
-        st.warning(f"'{nombre}' no existe en Productos.")
-        return
-    row = idx[0]
-    try:
-        _, _, productos_ws, *_ = get_ws()
-        productos_ws.batch_update(
-            [{"range": f"C{row}:C{row}", "values": [[round(max(0.0, float(nuevo_stock)), 3)]]}],
-            value_input_option="USER_ENTERED",
-        )
-        load_productos_df.clear()
-    except Exception as e:
-        st.warning(f"No se pudo actualizar stock de '{nombre}': {e}")
-
-def pedidos_next_id_fast() -> int:
-    try:
-        _, _, _, pedidos_ws, *_ = get_ws()
-    except NotConnected:
-        return 1
-    col = pedidos_ws.col_values(1)  # incluye header
-    nums = []
-    for v in col[1:]:
-        try: nums.append(int(float(v)))
-        except: pass
-    return (max(nums)+1) if nums else 1
-
-def pedidos_append_rows(rows: List[List]):
-    try:
-        _, _, _, pedidos_ws, *_ = get_ws()
-    except NotConnected:
-        st.error("Conéctate a Google Sheets para guardar pedidos.")
-        return
-    pedidos_ws.append_rows(rows, value_input_option="USER_ENTERED")
-    load_pedidos_df.clear()
-
-def pedidos_update_parcial(pedido_id: int, cambios_ml_por_producto: List[Tuple[str, float]], nuevo_estatus: str = None):
-    """Actualiza ML/Total por producto y estatus del pedido sin reescribir toda la hoja."""
-    if not cambios_ml_por_producto and not nuevo_estatus:
-        return
-    try:
-        _, _, _, pedidos_ws, *_ = get_ws()
-    except NotConnected:
-        st.error("Conéctate a Google Sheets para actualizar pedidos.")
-        return
-
-    col_ids = pedidos_ws.get_values("A2:A200000")
-    col_pro = pedidos_ws.get_values("D2:D200000")
-    col_cml = pedidos_ws.get_values("F2:F200000")
-
-    mapa = {}
-    pid_str = str(int(pedido_id))
-    n = max(len(col_ids), len(col_pro), len(col_cml))
-    for i in range(n):
-        _id = (col_ids[i][0] if i < len(col_ids) and col_ids[i] else "").strip()
-        if _id != pid_str:
-            continue
-        pro = (col_pro[i][0] if i < len(col_pro) and col_pro[i] else "").strip()
-        try:
-            cml = float(col_cml[i][0]) if (i < len(col_cml) and col_cml[i] and str(col_cml[i][0]).strip()) else 0.0
-        except Exception:
-            cml = 0.0
-        mapa[pro] = (i+2, cml)
-
-    data_ranges = []
-    for pro, ml_new in (cambios_ml_por_producto or []):
-        if pro not in mapa:
-            st.warning(f"Producto '{pro}' no aparece en pedido #{pedido_id} (omite).")
-            continue
-        row, cml = mapa[pro]
-        total = round(float(ml_new) * float(cml), 2)
-        data_ranges.append({"range": f"E{row}:E{row}", "values": [[float(ml_new)]]})
-        data_ranges.append({"range": f"G{row}:G{row}", "values": [[total]]})
-
-    if nuevo_estatus:
-        for _, (row, _) in mapa.items():
-            data_ranges.append({"range": f"H{row}:H{row}", "values": [[nuevo_estatus]]})
-
-    if data_ranges:
-        try:
-            pedidos_ws.batch_update(data_ranges, value_input_option="USER_ENTERED")
-            load_pedidos_df.clear()
-        except Exception as e:
-            st.warning(f"No se pudo actualizar el pedido #{pedido_id}: {e}")
+# Primera carga: las tres pestañas en una sola lectura por lote
+if st.session_state.connected:
+    precargar_datos()
 
 # =====================
 # SESIÓN
@@ -398,89 +170,66 @@ def ensure_session_keys():
 ensure_session_keys()
 
 # =====================
-# PDF (Latin-1 blindado + bytearray safe)
+# PDF (plantilla pre-renderizada + caché por contenido del pedido, ver pdfs.py)
 # =====================
+@st.cache_resource(show_spinner=False)
+def pdfs_pedidos() -> GeneradorPdf:
+    return GeneradorPdf(LOGO_LOCAL)
+
 def generar_pdf(pedido_id: int, cliente: str, fecha: str, estatus: str,
                 productos: List[Tuple[str, float, float, float]]) -> bytes:
-    s_pedido  = _latin1(f"Pedido #{pedido_id}")
-    s_cliente = _latin1(f"Cliente: {cliente}")
-    s_fecha   = _latin1(f"Fecha: {fecha}")
-    s_status  = _latin1(f"Estatus: {estatus}")
-
-    filas = []
-    total_general = 0.0
-    for fila in productos or []:
-        try:
-            nombre, ml, costo, total = fila
-        except Exception:
-            continue
-        filas.append((_latin1(str(nombre))[:60], _latin1(f"{float(ml):g}"),
-                      _latin1(_fmt_money(costo)), _latin1(_fmt_money(total))))
+    return pdfs_pedidos().pdf(pedido_id, cliente, fecha, estatus, productos)
+
+# Las exportaciones van a un directorio del proceso (TemporaryDirectory lo borra al salir).
+# Streamlit no avisa cuando una sesión termina: cada exportación nueva barre las que llevan
+# más de EXPORT_TTL_S sin tocarse
+EXPORT_TTL_S = 3600
+
+@st.cache_resource(show_spinner=False)
+def dir_exportaciones() -> tempfile.TemporaryDirectory:
+    return tempfile.TemporaryDirectory(prefix="hdecants_export_")
+
+def borrar_exportacion(exp):
+    if exp:
         try:
-            total_general += float(total or 0.0)
-        except Exception:
+            os.remove(exp["ruta"])
+        except OSError:
             pass
 
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
+def _barrer_exportaciones(directorio: str):
+    limite = time.time() - EXPORT_TTL_S
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
 
+def exportar_pdfs(cliente: str, desde: date, hasta: date, estatus: List[str], formato: str) -> Tuple[str, int]:
+    """Todos los pedidos del filtro a un archivo temporal (ZIP en paralelo o un solo PDF), con
+    barra de progreso. Devuelve (ruta, número de pedidos); borra el archivo de la exportación
+    anterior de la sesión, y el nuevo si la exportación falla."""
+    borrar_exportacion(st.session_state.pop("export_pdf", None))
+    directorio = dir_exportaciones().name
+    _barrer_exportaciones(directorio)
+    total, pedidos = historial_pedidos_pdf(cliente, desde, hasta, estatus)
+    barra = st.progress(0.0, text=f"Generando PDFs de {total} pedido(s)...")
+    progreso = lambda hechos, total: barra.progress(min(1.0, hechos / max(total, 1)),
+                                                    text=f"{hechos} de {total} PDF(s)")
+    fd, ruta = tempfile.mkstemp(prefix="pedidos_", suffix=".zip" if formato == "ZIP" else ".pdf", dir=directorio)
     try:
-        if os.path.exists(LOGO_LOCAL):
-            pdf.image(LOGO_LOCAL, x=160, y=8, w=30)
-    except Exception:
-        pass
-
-    pdf.set_font("Arial", "B", 15); pdf.cell(0, 10, s_pedido, ln=True)
-    pdf.set_font("Arial", "", 12)
-    pdf.cell(0, 8, s_cliente, ln=True)
-    pdf.cell(0, 8, s_fecha, ln=True)
-    pdf.cell(0, 8, s_status, ln=True); pdf.ln(4)
-
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(90, 9, _latin1("Producto"), 1)
-    pdf.cell(25, 9, _latin1("ML"), 1, 0, "C")
-    pdf.cell(35, 9, _latin1("Costo/ml"), 1, 0, "C")
-    pdf.cell(35, 9, _latin1("Total"), 1, 1, "C")
-
-    pdf.set_font("Arial", "", 11)
-    for nombre_s, ml_s, costo_s, total_s in filas:
-        pdf.cell(90, 8, nombre_s, 1)
-        pdf.cell(25, 8, ml_s, 1, 0, "C")
-        pdf.cell(35, 8, costo_s, 1, 0, "C")
-        pdf.cell(35, 8, total_s, 1, 1, "C")
-
-    pdf.set_font("Arial", "B", 12)
-    pdf.cell(150, 9, _latin1("TOTAL GENERAL"), 1, 0, "C")
-    pdf.cell(35, 9, _latin1(_fmt_money(total_general)), 1, 1, "R")
-    pdf.ln(6)
-
-    pdf.set_draw_color(210, 210, 210)
-    x1, y1 = 10, pdf.get_y()
-    pdf.line(x1, y1, 200, y1)
-    pdf.ln(6)
-    pdf.set_font("Arial", "", 11)
-    leyenda = (
-        "Forma de pago\n"
-        "Banco: Mercado Pago W\n"
-        "Titular: Harim Escalona\n"
-        "Cuenta/Tarjeta: 722969040233441268\n\n"
-        "- Si la cotizacion es correcta, realiza el pago y comparte el comprobante.\n"
-        "- Una vez confirmado el pago, tu pedido se prepara y se envia."
-    )
-    pdf.multi_cell(0, 6, _latin1(leyenda))
-
-    raw = pdf.output(dest="S")
-    # Soporta str, bytes y bytearray
-    if isinstance(raw, (bytes, bytearray)):
-        return bytes(raw)
-    elif isinstance(raw, str):
-        return raw.encode("latin-1", "ignore")
-    else:
-        try:
-            return bytes(raw)
-        except Exception:
-            return b""
+        with os.fdopen(fd, "wb") as f:
+            if formato == "ZIP":
+                hechos = exportar_zip(LOGO_LOCAL, pedidos, f, total=total, progreso=progreso)
+            else:
+                hechos = exportar_pdf_unico(LOGO_LOCAL, pedidos, f, total=total, progreso=progreso)
+    except BaseException:
+        borrar_exportacion({"ruta": ruta})
+        raise
+    finally:
+        barra.empty()
+    return ruta, hechos
 
 # =====================
 # TABS
@@ -497,9 +246,10 @@ with tab1:
 
     if not st.session_state.connected:
         st.info("Pulsa **“Conectar a Google Sheets”** en la barra lateral para cargar Productos.")
-        productos_df = pd.DataFrame(columns=["Producto","Costo x ml","Stock disponible"])
+        buscador = None
     else:
-        productos_df = load_productos_df()
+        # Índice de nombres armado una vez por versión de Productos (no se filtra el frame en cada tecla)
+        buscador = buscador_productos()
 
     with st.form("form_pedido", clear_on_submit=False):
         col_a, col_b, col_c = st.columns([3,1.5,1.5])
@@ -514,24 +264,16 @@ with tab1:
         c1, c2, c3, c4 = st.columns([3,1.2,1.2,0.9])
         with c1:
             search = st.text_input("Buscar producto", placeholder="Escribe parte del nombre", key="buscador_prod")
-            if not productos_df.empty:
-                base_opts = productos_df["Producto"].astype(str)
-                opciones = base_opts[base_opts.str.contains(search, case=False, na=False)] if search else base_opts
-                opts_list = opciones.dropna().tolist()
-            else:
-                opts_list = []
+            opts_list, n_coinciden = buscador.buscar(search) if buscador is not None else ([], 0)
+            if n_coinciden > len(opts_list):
+                st.caption(f"Mostrando {len(opts_list)} de {n_coinciden}: escribe más para acotar.")
             prod_pick = st.multiselect("Producto", options=opts_list, default=opts_list[:1], key="picker_producto")
             prod_sel = prod_pick[0] if prod_pick else "—"
         with c2:
             ml = st.number_input("ML", min_value=0.0, step=1.0, value=0.0)
         with c3:
-            if (not productos_df.empty) and (prod_sel in productos_df["Producto"].values):
-                try:
-                    costo_actual = float(productos_df.loc[productos_df["Producto"] == prod_sel, "Costo x ml"].iloc[0])
-                except Exception:
-                    costo_actual = 0.0
-            else:
-                costo_actual = 0.0
+            datos_sel = buscador.datos(prod_sel) if buscador is not None else None
+            costo_actual = datos_sel[0] if datos_sel else 0.0
             st.number_input("Costo/ml (ref)", value=float(costo_actual), disabled=True, key="costo_ref")
         with c4:
             st.write("")
@@ -545,10 +287,9 @@ with tab1:
             elif ml <= 0:
                 st.warning("Indique mililitros > 0.")
             else:
-                try:
-                    stock_disp = float(productos_df.loc[productos_df["Producto"] == prod_sel, "Stock disponible"].iloc[0])
-                except Exception:
-                    stock_disp = 0.0
+                stock_disp = datos_sel[1] if datos_sel else 0.0
+                # Descuenta lo vendido en pedidos que aún no llegan a la hoja
+                stock_disp = max(0.0, stock_disp + stock_comprometido().get(prod_sel, 0.0))
                 if ml > stock_disp:
                     st.error(f"Stock insuficiente. Disponible: {stock_disp:g} ml")
                 else:
@@ -590,43 +331,31 @@ with tab1:
             elif not cart_items:
                 st.error("El carrito está vacío. Agregue al menos un producto.")
             else:
-                pedido_id = pedidos_next_id_fast()
-                filas_pedidos = []
-                for prod, ml_val, costo_val, total_val in cart_items:
-                    filas_pedidos.append([
-                        pedido_id,
-                        cliente.strip(),
-                        fecha.strftime("%Y-%m-%d"),
-                        prod,
-                        float(ml_val),
-                        float(costo_val),
-                        round(float(total_val), 2),
-                        estatus
-                    ])
-                pedidos_append_rows(filas_pedidos)
-                mapa = _productos_index_map()
-                for prod, ml_val, *_ in cart_items:
-                    if prod in mapa:
-                        _, costo_ml, stk = mapa[prod]
-                        nuevo = max(0.0, float(stk) - float(ml_val))
-                        productos_update_stock(prod, nuevo)
-                    else:
-                        st.warning(f"'{prod}' no existe en Productos (no se ajustó stock).")
-
-                if requiere_envio and datos_envio:
-                    datos_envio[0] = pedido_id
-                    datos_envio[1] = cliente.strip()
-                    append_envio_row(datos_envio)
-
-                st.success(f"Pedido #{pedido_id} guardado.")
-                pdf_bytes = generar_pdf(pedido_id, cliente.strip(), fecha.strftime("%Y-%m-%d"), estatus, cart_items)
-                filename = f"Pedido_{pedido_id}_{cliente.replace(' ','')}.pdf"
-                st.markdown(link_descarga_pdf(pdf_bytes, filename), unsafe_allow_html=True)
-
-                if st.button("🧹 Finalizar y limpiar"):
-                    st.session_state.pedido_items = []
-                    st.session_state.nueva_sesion = True
-                    st.experimental_rerun()
+                # En línea el guardado espera el folio y la reserva verificada de stock (para que dos
+                # equipos no vendan el mismo stock); sin conexión queda en la bandeja al instante
+                espera = ("Reservando stock en Google Sheets…" if not estado_conexion()["offline"]
+                          else "Guardando sin conexión (se sincroniza al volver la red)…")
+                try:
+                    with st.spinner(espera):
+                        pedido_id = guardar_pedido(cliente.strip(), fecha.strftime("%Y-%m-%d"), estatus, cart_items,
+                                                   envio=datos_envio if requiere_envio else None)
+                except StockInsuficiente as e:
+                    pedido_id = None
+                    for prod, disponible in e.faltantes.items():
+                        st.error(f"Stock insuficiente para '{prod}'. Disponible: {disponible:g} ml")
+
+                if pedido_id is not None:
+                    st.success(f"Pedido #{pedido_id} guardado.")
+                    if estado_sync(pedido_id) != "sincronizado":
+                        st.caption("⏳ Se está sincronizando con Google Sheets en segundo plano.")
+                    pdf_bytes = generar_pdf(pedido_id, cliente.strip(), fecha.strftime("%Y-%m-%d"), estatus, cart_items)
+                    filename = f"Pedido_{pedido_id}_{cliente.replace(' ','')}.pdf"
+                    st.markdown(link_descarga_pdf(pdf_bytes, filename), unsafe_allow_html=True)
+
+                    if st.button("🧹 Finalizar y limpiar"):
+                        st.session_state.pedido_items = []
+                        st.session_state.nueva_sesion = True
+                        st.experimental_rerun()
 
 # =====================
 # TAB 2: HISTORIAL
@@ -636,34 +365,67 @@ with tab2:
     if not st.session_state.connected:
         st.info("Conéctate para consultar el historial (barra lateral).")
     else:
-        pedidos_df = load_pedidos_df()
-
-        colf1, colf2, colf3 = st.columns([2,1,1])
+        colf1, colf2, colf3, colf4 = st.columns([2,1,1,2])
         with colf1:
             filtro_cli = st.text_input("🔍 Cliente (contiene)", placeholder="Ej. Ana")
         with colf2:
             desde = st.date_input("Desde", value=datetime.today().date() - relativedelta(months=6))
         with colf3:
             hasta = st.date_input("Hasta", value=datetime.today().date())
-
-        df_hist = pedidos_df.copy()
-        if not df_hist.empty:
-            if filtro_cli:
-                df_hist = df_hist[df_hist["Nombre Cliente"].str.contains(filtro_cli, case=False, na=False)]
-            if "Fecha" in df_hist.columns:
-                df_hist["Fecha_dt"] = pd.to_datetime(df_hist["Fecha"], errors="coerce")
-                df_hist = df_hist[(df_hist["Fecha_dt"] >= pd.to_datetime(desde)) & (df_hist["Fecha_dt"] <= pd.to_datetime(hasta))]
-                df_hist = df_hist.drop(columns=["Fecha_dt"], errors="ignore")
-
-        if df_hist.empty:
+        with colf4:
+            filtro_est = st.multiselect("📌 Estatus", historial_estatus(), placeholder="Todos")
+
+        # Al cambiar el filtro se vuelve a la primera página
+        filtros = (filtro_cli, desde, hasta, tuple(filtro_est))
+        if st.session_state.get("hist_filtros") != filtros:
+            st.session_state.hist_filtros = filtros
+            st.session_state.hist_pagina = 1
+
+        # Sólo viaja al navegador la página visible (más reciente primero), no todo el historial
+        hist = historial_pagina(filtro_cli, desde, hasta, st.session_state.get("hist_pagina", 1),
+                                estatus=filtro_est)
+        if not hist["pedidos"]:
             st.info("No hay pedidos para el rango/cliente seleccionados.")
         else:
-            st.dataframe(df_hist.sort_values(["# Pedido","Fecha"]), use_container_width=True, height=420)
-
-            pedidos_ids = sorted(pd.to_numeric(df_hist["# Pedido"], errors="coerce").dropna().astype(int).unique().tolist())
-            pedido_sel = st.selectbox("🧾 Selecciona un pedido para editar / PDF", pedidos_ids)
-
-            pedido_rows = pedidos_df[pedidos_df["# Pedido"] == pedido_sel].copy()
+            st.session_state.hist_pagina = hist["pagina"]
+            colp1, colp2 = st.columns([1, 3])
+            with colp1:
+                st.number_input(f"Página (de {hist['paginas']})", min_value=1, max_value=hist["paginas"],
+                                step=1, key="hist_pagina")
+            with colp2:
+                st.caption(f"{hist['pedidos']} pedido(s) · {hist['renglones']} renglón(es) · "
+                           f"total {_fmt_money(hist['total'])}")
+            st.dataframe(hist["filas"], use_container_width=True, height=420)
+
+            with st.expander(f"📦 Exportar los {hist['pedidos']} pedido(s) del filtro a PDF", expanded=False):
+                cole1, cole2 = st.columns([1, 1])
+                with cole1:
+                    formato = st.radio("Formato", ["ZIP", "PDF único"], horizontal=True,
+                                       help="ZIP: un PDF por pedido, generados en paralelo. "
+                                            "PDF único: todos los pedidos en un documento, uno por página.")
+                with cole2:
+                    exportar = st.button("📦 Generar exportación", key="export_pdfs")
+                if exportar:
+                    try:
+                        ruta, n = exportar_pdfs(filtro_cli, desde, hasta, filtro_est, formato)
+                        st.session_state.export_pdf = {"ruta": ruta, "n": n, "filtros": filtros, "formato": formato}
+                    except Exception as e:
+                        st.error(f"No se pudo generar la exportación: {e}")
+                exp = st.session_state.get("export_pdf")
+                if exp and exp["filtros"] != filtros:
+                    # Cambió el filtro: esa exportación ya no se ofrece, no hay por qué guardarla
+                    borrar_exportacion(st.session_state.pop("export_pdf"))
+                elif exp and os.path.exists(exp["ruta"]):
+                    zip_ = exp["formato"] == "ZIP"
+                    with open(exp["ruta"], "rb") as f:
+                        st.download_button(f"📥 Descargar {exp['n']} pedido(s) ({os.path.getsize(exp['ruta']) / 1e6:.1f} MB)",
+                                           f, file_name=f"pedidos_{desde}_{hasta}.{'zip' if zip_ else 'pdf'}",
+                                           mime="application/zip" if zip_ else "application/pdf",
+                                           on_click="ignore", key="export_pdfs_descarga")
+
+            pedido_sel = st.selectbox("🧾 Selecciona un pedido de esta página para editar / PDF", hist["ids"])
+
+            pedido_rows = historial_pedido(pedido_sel)
             if not pedido_rows.empty:
                 cliente_sel = pedido_rows["Nombre Cliente"].iloc[0]
                 estatus_actual = pedido_rows["Estatus"].iloc[-1]
@@ -695,53 +457,21 @@ with tab2:
                     dup = st.button("🧬 Duplicar pedido", key=f"dup_{pedido_sel}")
 
                 if apply_changes:
-                    cambios = edited.merge(
-                        pedido_rows[["Producto","Mililitros"]],
-                        on="Producto",
-                        how="left",
-                        suffixes=("_new","_old")
-                    )
-
-                    cambios_ml = []
-                    mapa_prod = _productos_index_map()
-                    for _, r in cambios.iterrows():
-                        ml_old = float(r["Mililitros_old"])
-                        ml_new = float(r["Mililitros_new"])
-                        if ml_new == ml_old:
-                            continue
-                        pro = r["Producto"]
-                        diff = ml_new - ml_old
-                        if pro not in mapa_prod:
-                            st.warning(f"⚠️ '{pro}' no existe en Productos. No se ajustó stock.")
-                        else:
-                            row, costo_ml, stk = mapa_prod[pro]
-                            if diff > 0 and diff > stk:
-                                st.error(f"Stock insuficiente para '{pro}'. Disponible: {stk:g} ml")
-                                st.experimental_rerun()
-                            nuevo_stk = stk - diff
-                            productos_update_stock(pro, nuevo_stk)
-                        cambios_ml.append((pro, ml_new))
-
-                    pedidos_update_parcial(pedido_sel, cambios_ml, nuevo_estatus)
-                    st.success("Cambios guardados.")
+                    if editar_pedido(pedido_sel, pedido_rows, edited, nuevo_estatus):
+                        st.success("Cambios guardados.")
                     st.experimental_rerun()
 
                 if gen_pdf:
                     productos_pdf = pedido_rows[["Producto","Mililitros","Costo x ml","Total"]].values.tolist()
                     fecha_pdf = pedido_rows["Fecha"].iloc[0]
+                    fecha_pdf = fecha_pdf.strftime("%Y-%m-%d") if pd.notna(fecha_pdf) else ""
                     estatus_pdf = pedido_rows["Estatus"].iloc[-1]
                     pdf_bytes = generar_pdf(pedido_sel, cliente_sel, fecha_pdf, estatus_pdf, productos_pdf)
                     filename_hist = f"Pedido_{pedido_sel}_{cliente_sel.replace(' ','')}.pdf"
                     st.markdown(link_descarga_pdf(pdf_bytes, filename_hist), unsafe_allow_html=True)
 
                 if dup:
-                    base = pedido_rows.copy()
-                    new_id = pedidos_next_id_fast()
-                    base["# Pedido"] = new_id
-                    base["Fecha"] = datetime.today().strftime("%Y-%m-%d")
-                    base["Estatus"] = "Cotizacion"
-                    filas = base[["# Pedido","Nombre Cliente","Fecha","Producto","Mililitros","Costo x ml","Total","Estatus"]].values.tolist()
-                    pedidos_append_rows(filas)
+                    new_id = duplicar_pedido(pedido_rows)
                     st.success(f"Pedido #{new_id} duplicado.")
                     st.experimental_rerun()
 
@@ -778,7 +508,7 @@ with tab3:
     if not st.session_state.connected:
         st.info("Conéctate para ver la tabla de productos.")
     else:
-        productos_df_local = load_productos_df().copy()
+        productos_df_local = load_productos_df()
         if productos_df_local.empty:
             st.info("Aún no hay productos en la hoja **Productos**. Agrega el primero arriba.")
         else:
@@ -792,9 +522,23 @@ with tab3:
                 if edited_prod["Costo x ml"].lt(0).any() or edited_prod["Stock disponible"].lt(0).any():
                     st.error("Costo y stock deben ser ≥ 0.")
                 else:
-                    save_productos_df(edited_prod)
-                    st.success("Cambios guardados.")
-                    st.experimental_rerun()
+                    res = save_productos_df(edited_prod, productos_df_local)
+                    if res is not None and res["conflictos"]:
+                        st.warning("Se guardó lo demás, pero hubo conflictos de stock:\n\n- " + "\n- ".join(res["conflictos"]))
+                    elif res is not None:
+                        st.success("Cambios guardados.")
+                        st.experimental_rerun()
+
+        with st.expander("📜 Stock a una fecha (libro de movimientos)"):
+            fecha_stock = st.date_input("Al cierre del día", value=date.today(), key="stock_en_fecha")
+            if st.button("Calcular", key="stock_en_btn"):
+                try:
+                    historico = stock_en(datetime.combine(fecha_stock, datetime.max.time()))
+                except Exception as e:
+                    st.error(f"No se pudo reconstruir el stock: {e}")
+                else:
+                    st.dataframe(pd.DataFrame(sorted(historico.items()), columns=["Producto", "Stock (ml)"]),
+                                 use_container_width=True, height=320)
 
 # =====================
 # TAB 4: COMPRAS
@@ -821,6 +565,8 @@ with tab4:
     col4, col5 = st.columns(2)
     with col4:
         decants_flag_c = st.selectbox("Decants", ["No","Sí"], key="compr_decants")
+        ml_c = st.number_input("ML a sumar al stock", min_value=0.0, step=5.0, key="compr_ml",
+                               disabled=(decants_flag_c != "Sí"))
     with col5:
         vendedor_c = st.text_input("Vendedor", key="compr_vendedor")
 
@@ -845,19 +591,17 @@ with tab4:
                     decants_flag_c,
                     vendedor_c.strip() if vendedor_c else ""
                 ]
-                append_compra_row(fila)
+                agregado = registrar_compra(fila, agregar_a_productos=(decants_flag_c == "Sí"),
+                                            ml_stock=float(ml_c or 0) if decants_flag_c == "Sí" else 0.0)
                 st.success("Compra guardada en la hoja **Compras**.")
-
-                prods_local = load_productos_df()
-                if decants_flag_c == "Sí" and producto_c.strip() not in prods_local["Producto"].values:
-                    productos_append_row(producto_c.strip(), 0.0, 0.0)
-                    st.info("También se agregó a **Productos** (costo/stock en 0).")
+                if agregado:
+                    st.info("También se agregó a **Productos** (costo en 0).")
 
                 st.experimental_rerun()
 
     def limpiar_solo_compras():
         keys = [
-            "compr_prod", "compr_pzs", "compr_costo",
+            "compr_prod", "compr_pzs", "compr_costo", "compr_ml",
             "compr_status", "compr_mes", "compr_fecha", "compr_anio",
             "compr_dequien", "compr_status_pago",
             "compr_decants", "compr_vendedor",
@@ -876,7 +620,7 @@ with tab4:
     if not st.session_state.connected:
         st.info("Conéctate para ver el historial de compras.")
     else:
-        compras_df = load_compras_df().copy()
+        compras_df = load_compras_df()
         st.dataframe(compras_df, use_container_width=True, height=420)
 
 # =====================
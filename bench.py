@@ -0,0 +1,378 @@
+# bench.py — H DECANTS (benchmark de llamadas a Sheets, celdas y tiempo por acción de usuario)
+# ========================================================================================
+#
+# Corre cada acción de la app contra el backend local simulado (storage.LocalSpreadsheet),
+# sin red, y reporta por acción y tamaño de hoja: llamadas a la API, celdas leídas/escritas
+# y tiempo de pared. Uso:
+#
+#   python bench.py                                   # tamaños 1k, 20k y 200k
+#   python bench.py --sizes 1000 --items 10 --latency-ms 150 --out bench.json
+#   python bench.py --compare bench_base.json         # falla si alguna acción hace más llamadas
+#
+# El tamaño se aplica a Pedidos (filas); Productos y Compras usan tamaño/10 (mínimo 100).
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List
+
+os.environ["HD_STORAGE_BACKEND"] = "local"
+# La bandeja de salida se vacía a mano dentro de cada acción (sin hilo de fondo)
+OUTBOX_PATH = os.path.join(tempfile.gettempdir(), "hd_bench_outbox.sqlite")
+MIRROR_PATH = os.path.join(tempfile.gettempdir(), "hd_bench_mirror.sqlite")
+os.environ["HD_OUTBOX_PATH"] = OUTBOX_PATH
+os.environ["HD_MIRROR_PATH"] = MIRROR_PATH
+SNAPSHOT_DIR = os.path.join(tempfile.gettempdir(), "hd_bench_snapshots")
+os.environ["HD_SNAPSHOT_DIR"] = SNAPSHOT_DIR
+os.environ["HD_OUTBOX_WORKER"] = "0"
+# Silencia los avisos de "bare mode" que emite Streamlit fuera de `streamlit run`
+logging.disable(logging.WARNING)
+
+import pandas as pd
+import streamlit as st
+
+import sheets
+from pdfs import GeneradorPdf, exportar_zip
+from sheets import (COMPRAS_COLS, MOVIMIENTOS_COLS, PEDIDOS_COLS, SHEET_TAB_COMPRAS, SHEET_TAB_MOVIMIENTOS,
+                    SHEET_TAB_PEDIDOS, SHEET_TAB_PRODUCTOS)
+
+DEFAULT_SIZES = [1_000, 20_000, 200_000]
+CLIENTES = ["Ana López", "Bruno Díaz", "Carla Ruiz", "Diego Mora", "Elena Paz", "Fer Soto"]
+ESTATUS = ["Cotizacion", "Pendiente", "Pagado", "En Proceso", "Entregado"]
+
+# =====================
+# DATOS SINTÉTICOS
+# =====================
+def _productos_rows(n: int) -> List[List[Any]]:
+    return [["Producto", "Costo x ml", "Stock disponible"]] + [
+        [f"Perfume {i:05d}", round(5 + (i % 40) * 0.5, 2), 10_000] for i in range(n)
+    ]
+
+def _pedidos_rows(n: int, n_productos: int, rng: random.Random) -> List[List[Any]]:
+    rows = [PEDIDOS_COLS]
+    pid, hoy = 0, date.today()
+    while len(rows) <= n:
+        pid += 1
+        cliente = rng.choice(CLIENTES)
+        fecha = (hoy - timedelta(days=rng.randrange(365))).strftime("%Y-%m-%d")
+        estatus = rng.choice(ESTATUS)
+        for j in rng.sample(range(n_productos), k=min(n_productos, rng.randint(1, 5))):
+            ml, cml = rng.choice([3, 5, 10]), round(5 + (j % 40) * 0.5, 2)
+            rows.append([pid, cliente, fecha, f"Perfume {j:05d}", ml, cml, round(ml * cml, 2), estatus])
+            if len(rows) > n:
+                break
+    return rows
+
+def _compras_rows(n: int) -> List[List[Any]]:
+    return [COMPRAS_COLS] + [
+        [f"Perfume {i:05d}", 1, 1500.0, "Recibido", "Enero", "2024-01-15", 2024, "Harim", "Pagado", "Sí", "Proveedor"]
+        for i in range(n)
+    ]
+
+def preparar(size: int, seed: int = 7):
+    """Backend local nuevo con hojas sembradas; limpia todas las caches de Streamlit."""
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    for path in (OUTBOX_PATH, MIRROR_PATH):
+        for suf in ("", "-wal", "-shm"):
+            if os.path.exists(path + suf):
+                os.remove(path + suf)
+    shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+    st.session_state["connected"] = True
+    sp = sheets.get_backend().spreadsheet
+    n_prod = max(100, size // 10)
+    sp.seed(SHEET_TAB_PRODUCTOS, _productos_rows(n_prod))
+    sp.seed(SHEET_TAB_PEDIDOS, _pedidos_rows(size, n_prod, random.Random(seed)))
+    sp.seed(SHEET_TAB_COMPRAS, _compras_rows(max(100, size // 10)))
+    sp.seed("Envios", [["# Pedido", "Cliente"]])
+    sp.seed(SHEET_TAB_MOVIMIENTOS, [MOVIMIENTOS_COLS])
+    return sp, n_prod
+
+# =====================
+# ACCIONES
+# =====================
+def _ultimo_pedido() -> pd.DataFrame:
+    df = sheets.load_pedidos_df()
+    return df[df["# Pedido"] == df["# Pedido"].max()].copy()
+
+class _SinLecturaPorLote:
+    """El libro local sin values_batch_get, como un backend que no lee varios rangos por lote."""
+
+    def __init__(self, spreadsheet):
+        self._sp = spreadsheet
+
+    def __getattr__(self, name: str):
+        if name == "values_batch_get":
+            raise AttributeError(name)
+        return getattr(self._sp, name)
+
+def acciones(items: int, n_prod: int) -> Dict[str, Callable[[], Any]]:
+    """Cada acción reproduce lo que hace la UI; las lecturas previas cacheadas no cuentan."""
+    cart = [(f"Perfume {i:05d}", 5.0, 5.0, 25.0) for i in range(min(items, n_prod))]
+
+    def connect():
+        sheets.get_client_and_ws.clear()
+        sheets.get_client_and_ws()
+
+    def first_load():
+        # Primer render con caches frías y sin snapshot en disco: Productos, Pedidos y Compras juntos
+        sheets.get_snapshots().esperar()
+        shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+        sheets.limpiar_caches()
+        sheets.get_client_and_ws()
+        return sheets.precargar_datos
+
+    def first_load_sin_lote():
+        # Igual que first_load contra un backend sin lecturas por lote: tres lecturas en paralelo
+        sheets.get_snapshots().esperar()
+        shutil.rmtree(SNAPSHOT_DIR, ignore_errors=True)
+        backend = sheets.get_backend()
+        sp = backend.spreadsheet
+        backend.spreadsheet = _SinLecturaPorLote(sp)
+        sheets.limpiar_caches()
+        sheets.get_client_and_ws()
+
+        def run():
+            try:
+                sheets.precargar_datos()
+            finally:
+                # La acción siguiente vuelve a conectar (limpiar_caches) contra el libro normal
+                backend.spreadsheet = sp
+        return run
+
+    def warm_start_sin_cambios():
+        # Reinicio del proceso con el snapshot de Pedidos en disco y la hoja igual: sólo la cola
+        sheets.get_snapshots().esperar()
+        sheets.limpiar_caches()
+        sheets.get_client_and_ws()
+        return sheets.precargar_datos
+
+    def warm_start():
+        # Reinicio con el snapshot y 3 pedidos nuevos en la hoja: la huella ya no es la del
+        # snapshot (pudo editarse una fila mientras tanto) y Pedidos se lee completo
+        sheets.get_snapshots().esperar()
+        nuevos = [[999_999, "Otro Equipo", date.today().strftime("%Y-%m-%d"), f"Perfume {i:05d}", 5, 5.0, 25.0, "Pagado"]
+                  for i in range(3)]
+        sheets.get_backend().spreadsheet.worksheet(SHEET_TAB_PEDIDOS).append_rows(nuevos)
+        sheets.limpiar_caches()
+        sheets.get_client_and_ws()
+        return sheets.precargar_datos
+
+    def first_load_offline():
+        # Sheets caído: las tres pestañas salen del espejo local (sin llamadas que lleguen a la hoja)
+        sheets.get_espejo().esperar()
+        sp = sheets.get_backend().spreadsheet
+        sheets.versiones().bump()
+        sp.sin_red = True
+        try:
+            sheets.load_productos_df(); sheets.load_pedidos_df(); sheets.load_compras_df()
+        finally:
+            sp.sin_red = False
+            sheets.estado_red.clear()
+            sheets.versiones().bump()
+
+    def load_nuevo_pedido():
+        sheets.versiones().bump(SHEET_TAB_PRODUCTOS)
+        sheets.load_productos_df()
+
+    def productos_tras_venta():
+        # Productos ya cargado y una venta anota su movimiento: sólo se lee la cola del libro
+        sheets.load_productos_df()
+        sheets._anotar_movimientos([(cart[0][0], -cart[0][1], "venta", 1)])
+        return sheets.load_productos_df
+
+    def reload_pedidos():
+        # Lo que pasa tras una escritura en Pedidos (sube su versión) con Pedidos ya cargado
+        sheets.load_pedidos_df()
+        sheets.versiones().bump(SHEET_TAB_PEDIDOS)
+        return sheets.load_pedidos_df
+
+    def search_products():
+        # Primera tecla en "Buscar producto" tras cargar Productos: arma el índice y busca
+        sheets.load_productos_df()
+        return lambda: sheets.buscador_productos().buscar("perfme 0001")
+
+    def pdf_repeat():
+        # "Generar PDF" otra vez sobre el mismo pedido (o un rerun tras guardar): sale del LRU
+        gen = GeneradorPdf(os.path.join(os.path.dirname(os.path.abspath(__file__)), "hdecants_logo.jpg"))
+        args = (1, "Cliente", date.today().isoformat(), "Pendiente", [p[:4] for p in cart])
+        gen.pdf(*args)
+        return lambda: gen.pdf(*args)
+
+    def pdf_bulk():
+        # "Exportar PDFs" de los pedidos pagados de la última semana a un ZIP (en paralelo si hay núcleos)
+        sheets.load_pedidos_df()
+        logo = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hdecants_logo.jpg")
+        destino = os.path.join(tempfile.gettempdir(), "hd_bench_pedidos.zip")
+
+        def run():
+            total, pedidos = sheets.historial_pedidos_pdf("", date.today() - timedelta(days=7), date.today(), ["Pagado"])
+            exportar_zip(logo, pedidos, destino, total=total)
+        return run
+
+    def historial_page():
+        # Primera consulta del Historial tras cargar Pedidos: arma la vista y entrega una página
+        sheets.load_pedidos_df()
+        return lambda: sheets.historial_pagina("", date.today() - timedelta(days=180), date.today(), 2)
+
+    def _autorefresh():
+        # Rerun del autorefresh con la sonda vencida: una llamada y, si nada cambió, cero lecturas
+        sheets.versiones().sondear(forzar=True)
+        sheets.load_productos_df(); sheets.load_pedidos_df(); sheets.load_compras_df()
+
+    def autorefresh_sin_cambios():
+        sheets.load_productos_df(); sheets.load_pedidos_df(); sheets.load_compras_df()
+        sheets.versiones().sondear(forzar=True)
+        return _autorefresh
+
+    def autorefresh_otro_vendedor():
+        # Otro proceso anexó un pedido: sólo se relee la cola de Pedidos
+        sheets.load_productos_df(); sheets.load_pedidos_df(); sheets.load_compras_df()
+        sheets.versiones().sondear(forzar=True)
+        nuevo = [[999_998, "Otro Vendedor", date.today().strftime("%Y-%m-%d"), "Perfume 00000", 5, 5.0, 25.0, "Pagado"]]
+        sheets.get_backend().spreadsheet.worksheet(SHEET_TAB_PEDIDOS).append_rows(nuevo)
+        return _autorefresh
+
+    def save_order():
+        # Incluye el vaciado de la bandeja: lo que termina escribiéndose en Sheets por pedido
+        sheets.guardar_pedido("Cliente Bench", date.today().strftime("%Y-%m-%d"), "Pendiente", cart)
+        sheets.sincronizar_ahora()
+
+    def save_5_orders():
+        # Pedidos que se juntan en la bandeja antes de una vuelta del hilo: un solo lote
+        for _ in range(5):
+            sheets.guardar_pedido("Cliente Bench", date.today().strftime("%Y-%m-%d"), "Pendiente", cart)
+        sheets.sincronizar_ahora()
+
+    def edit_order():
+        rows = _ultimo_pedido()
+        edited = rows[["Producto","Mililitros","Costo x ml","Total"]].copy()
+        edited["Mililitros"] = pd.to_numeric(edited["Mililitros"]) + 1
+        return lambda: sheets.editar_pedido(int(rows["# Pedido"].iloc[0]), rows, edited, "Pagado")
+
+    def duplicate_order():
+        rows = _ultimo_pedido()
+        return lambda: sheets.duplicar_pedido(rows)
+
+    def save_productos():
+        original = sheets.load_productos_df()
+        df = original.copy()
+        df.loc[df.index[0], "Costo x ml"] = float(df["Costo x ml"].iloc[0]) + 1
+        return lambda: sheets.save_productos_df(df, original)
+
+    def compact_ledger():
+        # 500 movimientos sin compactar (ventas de otros procesos) que se pasan a Productos
+        movs = [[date.today().isoformat(), f"Perfume {i % n_prod:05d}", -1, "venta", 1, "bench"] for i in range(500)]
+        sheets.get_backend().spreadsheet.worksheet(SHEET_TAB_MOVIMIENTOS).append_rows(movs)
+        return sheets.compactar_libro
+
+    def add_compra():
+        fila = ["Perfume Nuevo", 1, 1800.0, "Pendiente", "Enero", date.today().strftime("%Y-%m-%d"),
+                date.today().year, "Harim", "Pendiente", "Sí", "Proveedor"]
+        sheets.registrar_compra(fila, agregar_a_productos=True)
+
+    # Las que devuelven una función separan la preparación (datos ya en pantalla) de la medición
+    return {
+        "connect": connect,
+        "first_load": first_load,
+        "first_load_sin_lote": first_load_sin_lote,
+        "warm_start_sin_cambios": warm_start_sin_cambios,
+        "warm_start": warm_start,
+        "first_load_offline": first_load_offline,
+        "load_nuevo_pedido": load_nuevo_pedido,
+        "productos_tras_venta": productos_tras_venta,
+        "reload_pedidos": reload_pedidos,
+        "historial_page": historial_page,
+        "pdf_repeat": pdf_repeat,
+        "pdf_bulk": pdf_bulk,
+        "search_products": search_products,
+        "autorefresh_sin_cambios": autorefresh_sin_cambios,
+        "autorefresh_otro_vendedor": autorefresh_otro_vendedor,
+        "save_order": save_order,
+        "save_5_orders": save_5_orders,
+        "edit_order": edit_order,
+        "duplicate_order": duplicate_order,
+        "save_productos": save_productos,
+        "compact_ledger": compact_ledger,
+        "add_compra": add_compra,
+    }
+
+def medir(sp, fn: Callable[[], Any]) -> Dict[str, Any]:
+    sp.stats.reset()
+    t0 = time.perf_counter()
+    run = fn()
+    if callable(run):
+        sp.stats.reset()
+        t0 = time.perf_counter()
+        run()
+    wall = time.perf_counter() - t0
+    snap = sp.stats.snapshot()
+    snap["cells"] = snap["cells_read"] + snap["cells_written"]
+    snap["wall_ms"] = round(wall * 1000, 2)
+    return snap
+
+def correr(sizes: List[int], items: int, latency_ms: float) -> Dict[str, Any]:
+    results = []
+    for size in sizes:
+        sp, n_prod = preparar(size)
+        sp.latency = latency_ms / 1000.0
+        sheets.get_client_and_ws()
+        for name, fn in acciones(items, n_prod).items():
+            r = medir(sp, fn)
+            r.update({"size": size, "action": name})
+            results.append(r)
+            print(f"{size:>8} {name:<18} calls={r['calls']:>4} cells={r['cells']:>9} wall={r['wall_ms']:>9.2f} ms",
+                  file=sys.stderr)
+    return {
+        "meta": {
+            "sizes": sizes, "items": items, "latency_ms": latency_ms,
+            "python": platform.python_version(), "pandas": pd.__version__,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+def comparar(actual: Dict[str, Any], base: Dict[str, Any]) -> List[str]:
+    """Regresiones: acciones que ahora hacen más llamadas o transfieren más celdas."""
+    prev = {(r["size"], r["action"]): r for r in base.get("results", [])}
+    out = []
+    for r in actual["results"]:
+        b = prev.get((r["size"], r["action"]))
+        if not b:
+            continue
+        for k in ("calls", "cells"):
+            if r[k] > b[k]:
+                out.append(f"{r['action']}@{r['size']}: {k} {b[k]} -> {r[k]}")
+    return out
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark de acciones de H DECANTS sobre un backend simulado.")
+    ap.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    ap.add_argument("--items", type=int, default=10, help="productos en el carrito al guardar pedido")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="latencia simulada por llamada")
+    ap.add_argument("--out", default="bench.json")
+    ap.add_argument("--compare", help="JSON de una corrida anterior para detectar regresiones")
+    args = ap.parse_args(argv)
+
+    report = correr(args.sizes, args.items, args.latency_ms)
+    with open(args.out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            regresiones = comparar(report, json.load(fh))
+        for line in regresiones:
+            print(f"REGRESIÓN {line}", file=sys.stderr)
+        return 1 if regresiones else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
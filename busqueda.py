@@ -0,0 +1,84 @@
+# busqueda.py — H DECANTS (búsqueda de texto sin acentos ni mayúsculas, por n-gramas)
+# ========================================================================================
+#
+# Los filtros por cliente o producto eran un str.contains(case=False) sobre todas las filas
+# en cada rerun, y "jose" no encontraba a "José". Aquí los textos se normalizan una vez
+# (minúsculas, sin acentos, espacios simples) y se indexan por trigramas: una búsqueda de
+# subcadena intersecta unas pocas listas cortas en lugar de recorrer todo. Para tolerar
+# errores de dedo ("suavage") se cuentan además los trigramas compartidos por palabra.
+
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+def normalizar(texto) -> str:
+    """Minúsculas, sin acentos y con espacios simples: ' José  ÑÚÑEZ' -> 'jose nunez'."""
+    s = unicodedata.normalize("NFKD", str(texto))
+    return " ".join("".join(c for c in s if not unicodedata.combining(c)).casefold().split())
+
+def trigramas_palabras(texto: str) -> Set[str]:
+    """Trigramas de cada palabra con dos espacios delante y uno detrás (como pg_trgm)."""
+    out: Set[str] = set()
+    for w in texto.split():
+        w = f"  {w} "
+        out.update(w[j:j + 3] for j in range(len(w) - 2))
+    return out
+
+class IndiceNgramas:
+    """Subcadenas sobre una lista de textos ya normalizados.
+
+    Cada n-grama apunta (en orden) a los textos que lo contienen. Una consulta intersecta
+    las listas de sus n-gramas, la más corta primero, y sólo confirma con `in` a los
+    candidatos que quedan. Las consultas más cortas que `n` recorren los textos.
+
+    similares() es la búsqueda tolerante: puntúa cada texto por la fracción de trigramas de
+    palabra de la consulta que comparte; su índice se arma la primera vez que se usa.
+    """
+
+    def __init__(self, textos: List[str], n: int = 3):
+        self.textos = textos
+        self.n = n
+        listas: Dict[str, List[int]] = {}
+        for i, t in enumerate(textos):
+            for g in {t[j:j + n] for j in range(len(t) - n + 1)}:
+                listas.setdefault(g, []).append(i)
+        self._listas = {g: np.array(v, dtype=np.int32) for g, v in listas.items()}
+        self._palabras: Optional[Dict[str, np.ndarray]] = None
+
+    def buscar(self, consulta: str) -> np.ndarray:
+        """Posiciones (ascendentes) de los textos que contienen `consulta` (ya normalizada)."""
+        q = consulta
+        if not q:
+            return np.arange(len(self.textos), dtype=np.int32)
+        if len(q) < self.n:
+            return np.array([i for i, t in enumerate(self.textos) if q in t], dtype=np.int32)
+        listas = [self._listas.get(q[j:j + self.n]) for j in range(len(q) - self.n + 1)]
+        if any(l is None for l in listas):
+            return np.empty(0, dtype=np.int32)
+        listas.sort(key=len)
+        cand = listas[0]
+        for l in listas[1:]:
+            if not len(cand):
+                break
+            cand = np.intersect1d(cand, l, assume_unique=True)
+        if len(q) == self.n:
+            return cand
+        return np.array([i for i in cand if q in self.textos[i]], dtype=np.int32)
+
+    def similares(self, consulta: str, minimo: float = 0.4) -> Tuple[np.ndarray, np.ndarray]:
+        """(posiciones, puntaje 0..1) de los textos que comparten al menos `minimo` de los
+        trigramas de palabra de `consulta` (ya normalizada)."""
+        if self._palabras is None:
+            listas: Dict[str, List[int]] = {}
+            for i, t in enumerate(self.textos):
+                for g in trigramas_palabras(t):
+                    listas.setdefault(g, []).append(i)
+            self._palabras = {g: np.array(v, dtype=np.int32) for g, v in listas.items()}
+        grams = trigramas_palabras(consulta)
+        hits = [self._palabras[g] for g in grams if g in self._palabras]
+        if not hits:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        puntaje = np.bincount(np.concatenate(hits), minlength=len(self.textos)) / len(grams)
+        pos = np.flatnonzero(puntaje >= minimo)
+        return pos, puntaje[pos]
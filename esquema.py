@@ -0,0 +1,208 @@
+# esquema.py — H DECANTS (esquema declarado de cada pestaña y parseo vectorizado)
+# ========================================================================================
+#
+# Productos, Pedidos y Compras se leían cada una con su propio relleno de encabezados, su
+# filtro de filas vacías renglón por renglón y su pd.to_numeric(errors="coerce").fillna(0):
+# un "5 ml" o una fecha mal escrita se volvía 0 o NaT sin que nadie se enterara. Aquí cada
+# pestaña declara sus columnas (tipo, valor por defecto y validación) y un solo motor
+# convierte la rejilla de valores en un DataFrame tipado columna por columna, sin bucles
+# por renglón, y devuelve aparte las celdas que no se pudieron interpretar.
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    _HAS_ARROW = True
+except Exception:
+    _HAS_ARROW = False
+
+# Tipos de columna: nombre -> dtype de pandas
+TIPOS = {
+    "texto": "str",
+    "categoria": "category",
+    "int16": "int16",
+    "int32": "int32",
+    "float32": "float32",
+    "float64": "float64",
+    "fecha": "datetime64[ns]",
+}
+
+def _como_texto(a: np.ndarray) -> np.ndarray:
+    """Columna de la rejilla como arreglo object de str ("" en huecos de renglones cortos y
+    en celdas sin valor).
+
+    Sheets entrega texto; el backend local y el espejo pueden traer números tal cual.
+    """
+    if pd.api.types.infer_dtype(a, skipna=False) == "string":
+        return a
+    return pd.Series(a, dtype=object).fillna("").astype(str).to_numpy(dtype=object)
+
+def _sin_espacios(a: np.ndarray):
+    """Texto sin espacios al inicio ni al final. Con Arrow, un kernel sobre toda la columna y
+    el resultado se queda en Arrow (vacías, cast a número y fechas se resuelven ahí); sin
+    Arrow, .str.strip de pandas."""
+    if _HAS_ARROW:
+        return pc.utf8_trim_whitespace(pa.array(a, type=pa.string()))
+    return pd.Series(a, dtype=object).str.strip().to_numpy(dtype=object)
+
+def _vacias(limpio) -> np.ndarray:
+    if isinstance(limpio, np.ndarray):
+        return limpio == ""
+    return pc.equal(limpio, "").to_numpy(zero_copy_only=False)
+
+def _tomar(limpio, idx: np.ndarray):
+    return limpio[idx] if isinstance(limpio, np.ndarray) else limpio.take(pa.array(idx))
+
+def _factorizar(limpio) -> Tuple[np.ndarray, np.ndarray]:
+    """(código por celda, valores distintos), para interpretar cada valor distinto una vez."""
+    if isinstance(limpio, np.ndarray):
+        return pd.factorize(limpio)
+    dic = pc.dictionary_encode(limpio)
+    return dic.indices.to_numpy(zero_copy_only=False), dic.dictionary.to_numpy(zero_copy_only=False)
+
+def _a_numero(limpio, vacia: np.ndarray) -> np.ndarray:
+    """Texto -> float64 (NaN si vacía o no numérica). Todo válido: un cast de Arrow; si hay
+    algo que no es número, pd.to_numeric celda por celda para ubicarlo."""
+    if _HAS_ARROW:
+        try:
+            if isinstance(limpio, np.ndarray):
+                texto = pa.array(limpio, type=pa.string(), mask=vacia)
+            else:
+                texto = pc.if_else(pa.array(vacia), pa.scalar(None, pa.string()), limpio)
+            return pc.cast(texto, pa.float64()).to_numpy(zero_copy_only=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    if not isinstance(limpio, np.ndarray):
+        limpio = limpio.to_numpy(zero_copy_only=False)
+    return pd.to_numeric(pd.Series(limpio).where(~vacia), errors="coerce").to_numpy(dtype=float)
+
+class Columna:
+    """Una columna de la pestaña: tipo, valor para celdas vacías o inválidas y validación.
+
+    `requerida`: una celda vacía en una fila con datos se reporta. `minimo`: los números
+    menores se reportan (y se conservan). Los enteros con decimales también se reportan, y
+    los que no caben en el tipo se reportan y toman el valor por defecto.
+    """
+
+    def __init__(self, nombre: str, tipo: str = "texto", defecto=None,
+                 requerida: bool = False, minimo: Optional[float] = None):
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo de columna desconocido: {tipo}")
+        self.nombre = nombre
+        self.tipo = tipo
+        self.defecto = defecto if defecto is not None else ("" if tipo in ("texto", "categoria") else
+                                                           pd.NaT if tipo == "fecha" else 0)
+        self.requerida = requerida
+        self.minimo = minimo
+
+class Problema:
+    """Celda que no se pudo interpretar según el esquema (se usó el valor por defecto)."""
+
+    __slots__ = ("hoja", "fila", "columna", "valor", "motivo")
+
+    def __init__(self, hoja: str, fila: int, columna: str, valor: str, motivo: str):
+        self.hoja, self.fila, self.columna, self.valor, self.motivo = hoja, fila, columna, valor, motivo
+
+    def __repr__(self):
+        return f"{self.hoja}!{self.columna} fila {self.fila}: {self.motivo} ({self.valor!r})"
+
+class Esquema:
+    """Columnas declaradas de una pestaña y el parseo de su rejilla de valores."""
+
+    def __init__(self, hoja: str, columnas: Sequence[Columna]):
+        self.hoja = hoja
+        self.columnas = list(columnas)
+        self.nombres = [c.nombre for c in self.columnas]
+
+    def vacio(self) -> pd.DataFrame:
+        """DataFrame sin filas pero con los tipos del esquema."""
+        return pd.DataFrame({c.nombre: pd.Series(dtype=TIPOS[c.tipo]) for c in self.columnas},
+                            index=pd.Index([], dtype="int64", name="fila"))
+
+    def _posiciones(self, encabezado: Sequence) -> Dict[str, int]:
+        """Columna -> posición en la rejilla: por nombre de encabezado; si no aparece y esa
+        posición del encabezado está vacía (encabezado ausente), la posición declarada."""
+        enc = [str(h).strip() for h in encabezado]
+        pos = {}
+        for i, c in enumerate(self.columnas):
+            if c.nombre in enc:
+                pos[c.nombre] = enc.index(c.nombre)
+            elif i >= len(enc) or not enc[i]:
+                pos[c.nombre] = i
+        return pos
+
+    def parsear(self, vals: List[List], primera_fila: int,
+                encabezado: Optional[Sequence] = None) -> Tuple[pd.DataFrame, List[Problema]]:
+        """Rejilla cruda (renglones desde `primera_fila` de la hoja, sin encabezado) ->
+        (DataFrame tipado indexado por la fila real de la hoja, celdas con problemas).
+
+        Las filas sin ningún valor se descartan, igual que antes.
+        """
+        if not vals:
+            return self.vacio(), []
+        # dtype=object: sin inferencia de tipos por columna (la hace el esquema)
+        crudo = pd.DataFrame(vals, dtype=object)
+        originales = {j: _como_texto(crudo[j].to_numpy()) for j in crudo.columns}
+        limpios = {j: _sin_espacios(a) for j, a in originales.items()}
+        vacias = {j: _vacias(a) for j, a in limpios.items()}
+        con_datos = np.zeros(len(crudo), dtype=bool)
+        for v in vacias.values():
+            con_datos |= ~v
+        idx = None if con_datos.all() else np.flatnonzero(con_datos)
+        filas = pd.Index(primera_fila + (np.arange(len(crudo)) if idx is None else idx), dtype="int64", name="fila")
+        pos = self._posiciones(encabezado if encabezado is not None else self.nombres)
+
+        out: Dict[str, pd.Series] = {}
+        problemas: List[Problema] = []
+        for c in self.columnas:
+            j = pos.get(c.nombre)
+            if j is None or j not in limpios:
+                original = limpio = np.full(len(filas), "", dtype=object)
+                vacia = np.ones(len(filas), dtype=bool)
+            else:
+                original, limpio, vacia = originales[j], limpios[j], vacias[j]
+                if idx is not None:
+                    original, limpio, vacia = original[idx], _tomar(limpio, idx), vacia[idx]
+            malas = np.zeros(len(filas), dtype=bool)
+            motivo = ""
+            if c.tipo in ("texto", "categoria"):
+                serie = pd.Series(original, index=filas).astype(TIPOS[c.tipo])
+            elif c.tipo == "fecha":
+                cod, unicos = _factorizar(limpio)
+                fechas = pd.to_datetime(pd.Series(unicos, dtype=object), errors="coerce",
+                                        format="mixed").to_numpy("datetime64[ns]")
+                serie = pd.Series(fechas[cod], index=filas)
+                malas = serie.isna().to_numpy() & ~vacia
+                motivo = "no es una fecha"
+            else:
+                num = pd.Series(_a_numero(limpio, vacia), index=filas)
+                malas = num.isna().to_numpy() & ~vacia
+                motivo = "no es un número"
+                if c.tipo.startswith("int"):
+                    decimales = (num % 1 != 0).to_numpy() & ~num.isna().to_numpy()
+                    problemas += self._reportar(c, filas, original, decimales, "tiene decimales")
+                    num = num.round()
+                    # Fuera del rango del tipo el cast daría basura: se reporta y va el defecto
+                    rango = np.iinfo(TIPOS[c.tipo])
+                    fuera = ((num < rango.min) | (num > rango.max)).to_numpy()
+                    problemas += self._reportar(c, filas, original, fuera, f"fuera de rango para {c.tipo}")
+                    num = num.mask(fuera)
+                if c.minimo is not None:
+                    bajo = (num < c.minimo).to_numpy()
+                    problemas += self._reportar(c, filas, original, bajo, f"menor que {c.minimo:g}")
+                serie = num.fillna(c.defecto).astype(TIPOS[c.tipo])
+            out[c.nombre] = serie
+            problemas += self._reportar(c, filas, original, malas, motivo)
+            if c.requerida:
+                problemas += self._reportar(c, filas, original, vacia, "vacía")
+        return pd.DataFrame(out, index=filas), sorted(problemas, key=lambda p: p.fila)
+
+    def _reportar(self, c: Columna, filas: pd.Index, original: np.ndarray, mask: np.ndarray,
+                  motivo: str) -> List[Problema]:
+        if not mask.any():
+            return []
+        return [Problema(self.hoja, int(f), c.nombre, v, motivo) for f, v in zip(filas[mask], original[mask])]
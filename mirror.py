@@ -0,0 +1,160 @@
+# mirror.py — H DECANTS (espejo local de las pestañas para trabajar sin Google Sheets)
+# ========================================================================================
+#
+# Copia en SQLite de cada pestaña tal como está en la hoja, con los números de fila reales
+# (así los índices por fila siguen valiendo). Se actualiza con cada lectura a Sheets y con
+# nuestras propias escrituras, en un hilo aparte para no sumar la escritura a disco al render;
+# cuando Sheets no responde, los loaders leen de aquí y los pedidos/compras nuevos se anexan
+# aquí mientras esperan en la bandeja de salida (outbox.py).
+
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Filas por bloque: se guarda un JSON por bloque (leer 200k filas son 200 json.loads, no 200k)
+BLOQUE = 1000
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS bloques (
+    hoja    TEXT NOT NULL,
+    bloque  INTEGER NOT NULL,
+    filas   TEXT NOT NULL,
+    PRIMARY KEY (hoja, bloque)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hojas (
+    hoja        TEXT PRIMARY KEY,
+    actualizado REAL NOT NULL,
+    locales     INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+class Espejo:
+    """Rejillas por pestaña en un archivo SQLite; seguro entre hilos (una conexión por operación).
+
+    Las filas anexadas sin conexión (anexar_local) aún no existen en la hoja: la siguiente
+    lectura o escritura real desde esas posiciones las reemplaza.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # Un solo hilo: las escrituras se aplican en el orden en que llegaron
+        self._cola = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hd-espejo")
+        with self._db() as db:
+            db.executescript(_ESQUEMA)
+
+    def esperar(self):
+        """Bloquea hasta que se apliquen las escrituras encoladas."""
+        self._cola.submit(lambda: None).result()
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _bloque(db, hoja: str, b: int) -> List[List]:
+        r = db.execute("SELECT filas FROM bloques WHERE hoja = ? AND bloque = ?", (hoja, b)).fetchone()
+        return json.loads(r[0]) if r else []
+
+    def _escribir(self, hoja: str, desde: int, vals: List[List], local: bool = False):
+        """Escribe `vals` desde la fila `desde` y descarta todo lo que seguía."""
+        b0, off = divmod(desde - 1, BLOQUE)
+        with self._lock, self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            previo = self._bloque(db, hoja, b0)[:off]
+            previo += [[] for _ in range(off - len(previo))]
+            filas = previo + [list(r) for r in vals]
+            db.execute("DELETE FROM bloques WHERE hoja = ? AND bloque >= ?", (hoja, b0))
+            db.executemany(
+                "INSERT INTO bloques (hoja, bloque, filas) VALUES (?, ?, ?)",
+                [(hoja, b0 + i // BLOQUE, json.dumps(filas[i:i + BLOQUE], ensure_ascii=False))
+                 for i in range(0, len(filas), BLOQUE)],
+            )
+            if local:
+                db.execute("UPDATE hojas SET locales = locales + ? WHERE hoja = ?", (len(vals), hoja))
+            else:
+                db.execute("INSERT OR REPLACE INTO hojas (hoja, actualizado, locales) VALUES (?, ?, 0)",
+                           (hoja, time.time()))
+            db.execute("COMMIT")
+
+    # ---- desde Sheets ----
+    def reemplazar(self, hoja: str, vals: List[List]):
+        """La pestaña completa (desde la fila 1) recién leída de la hoja."""
+        self._cola.submit(self._escribir, hoja, 1, vals)
+
+    def desde_fila(self, hoja: str, fila: Optional[int], vals: List[List]):
+        """Filas leídas o escritas desde `fila` hasta el final de la hoja (lo que seguía se descarta)."""
+        if fila:
+            self._cola.submit(self._escribir, hoja, fila, vals)
+
+    def celdas(self, hoja: str, cambios: Dict[int, Dict[int, object]]):
+        """Celdas sueltas ya escritas en la hoja: {fila: {columna (0 = A): valor}}."""
+        if cambios:
+            self._cola.submit(self._celdas, hoja, cambios)
+
+    def _celdas(self, hoja: str, cambios: Dict[int, Dict[int, object]]):
+        por_bloque: Dict[int, Dict[int, Dict[int, object]]] = {}
+        for fila, cols in cambios.items():
+            b, off = divmod(int(fila) - 1, BLOQUE)
+            por_bloque.setdefault(b, {})[off] = cols
+        with self._lock, self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for b, filas in por_bloque.items():
+                bloque = self._bloque(db, hoja, b)
+                for off, cols in filas.items():
+                    if off >= len(bloque):
+                        continue
+                    fila = bloque[off]
+                    for c, v in cols.items():
+                        fila += [""] * (c + 1 - len(fila))
+                        fila[c] = v
+                db.execute("UPDATE bloques SET filas = ? WHERE hoja = ? AND bloque = ?",
+                           (json.dumps(bloque, ensure_ascii=False), hoja, b))
+            db.execute("COMMIT")
+
+    # ---- sin conexión ----
+    def anexar_local(self, hoja: str, vals: List[List]) -> int:
+        """Anexa al final filas que aún no están en la hoja; devuelve la primera fila usada."""
+        return self._cola.submit(self._anexar_local, hoja, vals).result()
+
+    def _anexar_local(self, hoja: str, vals: List[List]) -> int:
+        with self._db() as db:
+            r = db.execute("SELECT bloque, filas FROM bloques WHERE hoja = ? ORDER BY bloque DESC LIMIT 1",
+                           (hoja,)).fetchone()
+        desde = (r[0] * BLOQUE + len(json.loads(r[1])) + 1) if r else 1
+        self._escribir(hoja, desde, vals, local=True)
+        return desde
+
+    # ---- lecturas ----
+    def leer(self, hoja: str) -> List[List]:
+        """La pestaña como rejilla desde la fila 1 (huecos como filas vacías)."""
+        self.esperar()
+        with self._db() as db:
+            rows = db.execute("SELECT bloque, filas FROM bloques WHERE hoja = ? ORDER BY bloque", (hoja,)).fetchall()
+        out: List[List] = []
+        for b, filas in rows:
+            out += [[] for _ in range(b * BLOQUE - len(out))]
+            out += json.loads(filas)
+        return out
+
+    def actualizado(self, hoja: str) -> Optional[float]:
+        self.esperar()
+        with self._db() as db:
+            r = db.execute("SELECT actualizado FROM hojas WHERE hoja = ?", (hoja,)).fetchone()
+        return r[0] if r else None
+
+    def filas_locales(self, hoja: str) -> int:
+        self.esperar()
+        with self._db() as db:
+            r = db.execute("SELECT locales FROM hojas WHERE hoja = ?", (hoja,)).fetchone()
+        return r[0] if r else 0
@@ -0,0 +1,314 @@
+# outbox.py — H DECANTS (bandeja de salida local: escrituras diferidas a Sheets)
+# ========================================================================================
+#
+# Guardar un pedido ya no espera a Sheets: se registra en una bandeja SQLite (sobrevive a
+# reinicios) y un hilo de fondo la vacía por lotes. Las entradas del mismo tipo que estén
+# pendientes se escriben juntas: varios pedidos = un append_rows y un batch_update de stock.
+#
+# Cada entrada tiene un tipo ("pedido", "stock", "envio", ...) y un payload JSON; quien crea la
+# Outbox registra un manejador por tipo que recibe la lista de entradas pendientes y las
+# escribe o levanta una excepción (se reintentan en la siguiente vuelta, con espera creciente).
+# Los tipos se vacían en el orden en que se registraron los manejadores.
+#
+# Sin conexión las entradas se marcan `offline`; un pedido así lleva un # provisional
+# (`confirmado` = 0) hasta que el manejador le asigna el definitivo con renumerar().
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    pedido_id INTEGER,
+    tipo      TEXT NOT NULL,
+    payload   TEXT NOT NULL,
+    estado    TEXT NOT NULL DEFAULT 'pendiente',
+    intentos  INTEGER NOT NULL DEFAULT 0,
+    error     TEXT,
+    creado    REAL NOT NULL,
+    enviado   REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_estado ON outbox (estado, tipo, id);
+CREATE INDEX IF NOT EXISTS outbox_pedido ON outbox (pedido_id);
+CREATE TABLE IF NOT EXISTS conflictos (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    producto  TEXT NOT NULL,
+    detalle   TEXT NOT NULL,
+    pedidos   TEXT,
+    creado    REAL NOT NULL,
+    revisado  INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS bandeja (
+    clave     TEXT PRIMARY KEY,
+    valor     TEXT NOT NULL
+);
+"""
+
+# Columnas agregadas después de la primera versión de la bandeja (archivos ya existentes)
+_COLUMNAS_NUEVAS = {
+    "offline": "INTEGER NOT NULL DEFAULT 0",
+    "confirmado": "INTEGER NOT NULL DEFAULT 1",
+    "renumerado_de": "INTEGER",
+    "clave": "TEXT",
+}
+
+Manejador = Callable[[List[Dict[str, Any]]], None]
+
+def _json(v: Any) -> str:
+    # Filas que vienen de DataFrames traen escalares de numpy
+    return json.dumps(v, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+
+# Un candado por archivo: si la Outbox se recrea (caches limpiadas) mientras el hilo de la
+# anterior sigue vivo, nunca vacían la misma bandeja a la vez
+_CANDADOS: Dict[str, threading.Lock] = {}
+_candados_lock = threading.Lock()
+
+def _candado(path: str) -> threading.Lock:
+    with _candados_lock:
+        return _CANDADOS.setdefault(os.path.abspath(path), threading.Lock())
+
+class Outbox:
+    """Bandeja persistente + hilo que la vacía.
+
+    `manejadores` mapea tipo -> función(entradas); cada entrada es un dict con id, pedido_id,
+    payload (ya decodificado) e intentos, más `clave`: el id con el origen de esta bandeja
+    (al azar, uno por archivo), única entre equipos para marcar en la hoja lo ya escrito. `espera` es cuánto se deja juntar pedidos después
+    del primer aviso antes de escribir; `intervalo` la revisión periódica sin avisos.
+    """
+
+    def __init__(self, path: str, manejadores: Dict[str, Manejador], espera: float = 1.0,
+                 intervalo: float = 15.0, lote: int = 500, conservar_s: float = 86_400):
+        self.path = path
+        self.manejadores = manejadores
+        self.espera = espera
+        self.intervalo = intervalo
+        self.lote = lote
+        self.conservar_s = conservar_s
+        self._lock = _candado(path)            # un solo vaciado a la vez
+        self._aviso = threading.Event()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._fallos = 0
+        with self._db() as db:
+            db.executescript(_ESQUEMA)
+            existentes = {r["name"] for r in db.execute("PRAGMA table_info(outbox)")}
+            for col, tipo in _COLUMNAS_NUEVAS.items():
+                if col not in existentes:
+                    db.execute(f"ALTER TABLE outbox ADD COLUMN {col} {tipo}")
+            db.execute("INSERT OR IGNORE INTO bandeja (clave, valor) VALUES ('origen', ?)", (uuid.uuid4().hex[:8],))
+            self.origen = db.execute("SELECT valor FROM bandeja WHERE clave = 'origen'").fetchone()["valor"]
+
+    @contextmanager
+    def _db(self):
+        # Una conexión por operación: se usa desde los hilos de Streamlit y desde el worker
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.row_factory = sqlite3.Row
+            yield db
+        finally:
+            db.close()
+
+    # ---- encolar ----
+    def encolar(self, pedido_id: Optional[int], entradas: Dict[str, Any], offline: bool = False,
+                provisional: bool = False, claves: Optional[Dict[str, str]] = None):
+        """Registra varias entradas ({tipo: payload}) de un pedido en una sola transacción.
+
+        `provisional`: el # Pedido se asignó sin conexión y el manejador debe confirmarlo.
+        `claves`: {tipo: clave} para entradas cuya clave ya puede estar en la hoja (un
+        intento directo que no se sabe si llegó); las demás usan origen-id.
+        """
+        ahora = time.time()
+        claves = claves or {}
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT INTO outbox (pedido_id, tipo, payload, creado, offline, confirmado, clave) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(pedido_id, tipo, _json(payload), ahora, int(offline), int(not provisional), claves.get(tipo))
+                 for tipo, payload in entradas.items() if payload],
+            )
+            db.execute("COMMIT")
+        self._aviso.set()
+
+    def renumerar(self, viejo: int, nuevo: int):
+        """Confirma el # definitivo de un pedido provisional en todas sus entradas.
+
+        Las filas del pedido y del envío llevan el # en la primera columna: se corrige ahí también.
+        """
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute("SELECT id, tipo, payload FROM outbox WHERE pedido_id = ? AND confirmado = 0",
+                              (int(viejo),)).fetchall()
+            for r in rows:
+                payload = json.loads(r["payload"])
+                if r["tipo"] == "pedido":
+                    payload = [[nuevo] + list(f[1:]) for f in payload]
+                elif r["tipo"] == "envio":
+                    payload = [nuevo] + list(payload[1:])
+                db.execute(
+                    "UPDATE outbox SET pedido_id = ?, payload = ?, confirmado = 1, renumerado_de = ? WHERE id = ?",
+                    (int(nuevo), _json(payload), int(viejo) if nuevo != viejo else None, r["id"]),
+                )
+            db.execute("COMMIT")
+
+    def max_pedido_id(self) -> int:
+        with self._db() as db:
+            return db.execute("SELECT COALESCE(MAX(pedido_id), 0) FROM outbox").fetchone()[0]
+
+    # ---- conflictos de stock ----
+    def registrar_conflictos(self, conflictos: List[Dict[str, Any]]):
+        """[{producto, detalle, pedidos}] detectados al aplicar stock diferido."""
+        if not conflictos:
+            return
+        ahora = time.time()
+        with self._db() as db:
+            db.executemany(
+                "INSERT INTO conflictos (producto, detalle, pedidos, creado) VALUES (?, ?, ?, ?)",
+                [(c["producto"], c["detalle"], json.dumps(c.get("pedidos") or []), ahora) for c in conflictos],
+            )
+
+    def conflictos(self) -> List[Dict[str, Any]]:
+        with self._db() as db:
+            rows = db.execute("SELECT id, producto, detalle, pedidos, creado FROM conflictos "
+                              "WHERE revisado = 0 ORDER BY id").fetchall()
+        return [{"id": r["id"], "producto": r["producto"], "detalle": r["detalle"],
+                 "pedidos": json.loads(r["pedidos"] or "[]"), "creado": r["creado"]} for r in rows]
+
+    def marcar_conflictos_revisados(self):
+        with self._db() as db:
+            db.execute("UPDATE conflictos SET revisado = 1 WHERE revisado = 0")
+
+    # ---- consultas para la UI ----
+    def estado(self, pedido_id: int) -> Optional[str]:
+        """'pendiente', 'error' (pendiente con fallos), 'sincronizado' o None si no pasó por aquí."""
+        with self._db() as db:
+            r = db.execute(
+                "SELECT COUNT(*) n, SUM(estado = 'pendiente') p, MAX(CASE WHEN estado = 'pendiente' THEN intentos END) i "
+                "FROM outbox WHERE pedido_id = ?", (int(pedido_id),)
+            ).fetchone()
+        if not r["n"]:
+            return None
+        if r["p"]:
+            return "error" if r["i"] else "pendiente"
+        return "sincronizado"
+
+    def pedidos_recientes(self, limite: int = 10) -> List[Dict[str, Any]]:
+        """Últimos pedidos que pasaron por la bandeja, con su estado y el último error."""
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT pedido_id, MAX(creado) creado, SUM(estado = 'pendiente') p, "
+                "MAX(CASE WHEN estado = 'pendiente' THEN intentos END) i, MAX(error) error, "
+                "MAX(offline) offline, MAX(renumerado_de) renumerado_de "
+                "FROM outbox WHERE pedido_id IS NOT NULL GROUP BY pedido_id ORDER BY creado DESC LIMIT ?",
+                (int(limite),)
+            ).fetchall()
+        return [
+            {"pedido_id": r["pedido_id"], "creado": r["creado"],
+             "estado": ("error" if r["i"] else "pendiente") if r["p"] else "sincronizado",
+             "error": r["error"] if r["p"] else None,
+             "offline": bool(r["offline"]), "renumerado_de": r["renumerado_de"]}
+            for r in rows
+        ]
+
+    def resumen(self) -> Dict[str, Any]:
+        with self._db() as db:
+            r = db.execute(
+                "SELECT COUNT(DISTINCT pedido_id) pedidos, COUNT(*) entradas, SUM(intentos > 0) con_error "
+                "FROM outbox WHERE estado = 'pendiente'"
+            ).fetchone()
+        return {"pedidos": r["pedidos"] or 0, "entradas": r["entradas"] or 0, "con_error": r["con_error"] or 0}
+
+    def pendientes(self, tipo: str) -> List[Dict[str, Any]]:
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT id, pedido_id, payload, intentos, offline, confirmado, clave FROM outbox "
+                "WHERE estado = 'pendiente' AND tipo = ? ORDER BY id LIMIT ?", (tipo, self.lote)
+            ).fetchall()
+        return [{"id": r["id"], "clave": r["clave"] or f"{self.origen}-{r['id']}", "pedido_id": r["pedido_id"],
+                 "payload": json.loads(r["payload"]),
+                 "intentos": r["intentos"], "offline": bool(r["offline"]), "confirmado": bool(r["confirmado"])}
+                for r in rows]
+
+    def stock_pendiente(self) -> Dict[str, float]:
+        """Suma de los ajustes de stock que aún no llegan a la hoja ({producto: ml})."""
+        total: Dict[str, float] = {}
+        with self._db() as db:
+            rows = db.execute("SELECT payload FROM outbox WHERE estado = 'pendiente' AND tipo = 'stock'").fetchall()
+        for r in rows:
+            for prod, d in json.loads(r["payload"]).items():
+                total[prod] = total.get(prod, 0.0) + float(d)
+        return total
+
+    # ---- vaciado ----
+    def procesar(self) -> int:
+        """Vacía lo pendiente (un lote por tipo). Devuelve cuántas entradas se escribieron.
+
+        Si un tipo falla se detiene la vuelta: lo que sigue (stock, envío) espera a que las
+        filas del pedido estén en la hoja.
+        """
+        with self._lock:
+            hechas = 0
+            for tipo, manejador in self.manejadores.items():
+                entradas = self.pendientes(tipo)
+                if not entradas:
+                    continue
+                ids = [(e["id"],) for e in entradas]
+                try:
+                    manejador(entradas)
+                except Exception as e:
+                    with self._db() as db:
+                        db.executemany(
+                            "UPDATE outbox SET intentos = intentos + 1, error = ? WHERE id = ?",
+                            [(f"{type(e).__name__}: {e}"[:500], i) for (i,) in ids],
+                        )
+                    self._fallos += 1
+                    break
+                with self._db() as db:
+                    db.executemany(
+                        "UPDATE outbox SET estado = 'hecho', error = NULL, enviado = ? WHERE id = ?",
+                        [(time.time(), i) for (i,) in ids],
+                    )
+                hechas += len(entradas)
+            else:
+                self._fallos = 0
+            with self._db() as db:
+                db.execute("DELETE FROM outbox WHERE estado = 'hecho' AND enviado < ?",
+                           (time.time() - self.conservar_s,))
+            return hechas
+
+    # ---- hilo de fondo ----
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="hd-outbox", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout: float = 5.0):
+        self._detener.set()
+        self._aviso.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            # Tras fallos seguidos se espera más (hasta 5 min) para no insistir contra la cuota
+            pausa = min(300.0, self.intervalo * (2 ** self._fallos)) if self._fallos else self.intervalo
+            if self._aviso.wait(pausa) and not self._fallos:
+                # Deja que lleguen otros pedidos para escribirlos juntos
+                self._detener.wait(self.espera)
+            self._aviso.clear()
+            if self._detener.is_set():
+                break
+            try:
+                self.procesar()
+            except Exception:
+                self._fallos += 1
@@ -0,0 +1,466 @@
+# pdfs.py — H DECANTS (PDF de pedidos: plantilla pre-renderizada y caché de documentos)
+# ========================================================================================
+#
+# Cada clic en "Generar PDF" armaba el documento desde cero: volvía a leer y procesar el
+# logo (150 KB) y a maquetar la leyenda de pago. Aquí la página base con el logo ya
+# incrustado se arma una vez y cada PDF parte de una copia; los PDFs terminados se guardan
+# en un LRU por huella del contenido del pedido, así pedir otra vez el mismo pedido es
+# inmediato y cualquier cambio (ML, estatus, cliente...) da otra huella y otro documento.
+#
+# La exportación masiva (todos los pedidos de un filtro) reparte los pedidos en lotes entre
+# procesos, cada uno con su propia plantilla, y va escribiendo un ZIP en disco conforme
+# terminan; nunca hay más de unos cuantos lotes en vuelo, así la memoria no crece con el
+# número de pedidos. El PDF único sale del mismo pool: los PDFs de cada pedido se van
+# anexando en orden a un solo documento en disco (el logo va una vez).
+
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from fpdf import FPDF
+
+# Cambia si cambia la maqueta: las huellas viejas dejan de coincidir
+VERSION = 1
+
+LEYENDA = (
+    "Forma de pago\n"
+    "Banco: Mercado Pago W\n"
+    "Titular: Harim Escalona\n"
+    "Cuenta/Tarjeta: 722969040233441268\n\n"
+    "- Si la cotizacion es correcta, realiza el pago y comparte el comprobante.\n"
+    "- Una vez confirmado el pago, tu pedido se prepara y se envia."
+)
+
+def _latin1(s) -> str:
+    if s is None:
+        return ""
+    if not isinstance(s, str):
+        s = str(s)
+    return s.encode("latin-1", "ignore").decode("latin-1")
+
+def _fmt_money(x) -> str:
+    try:
+        return f"${float(x):,.2f}"
+    except Exception:
+        return "$0.00"
+
+def _a_bytes(raw) -> bytes:
+    # Soporta str, bytes y bytearray
+    if isinstance(raw, (bytes, bytearray)):
+        return bytes(raw)
+    if isinstance(raw, str):
+        return raw.encode("latin-1", "ignore")
+    try:
+        return bytes(raw)
+    except Exception:
+        return b""
+
+class Plantilla:
+    """Página base del PDF (márgenes y logo ya incrustado), armada una vez y copiada por documento.
+
+    Si el archivo del logo cambia (otra fecha de modificación) se vuelve a armar.
+    """
+
+    def __init__(self, logo: str):
+        self.logo = logo
+        self._lock = threading.Lock()
+        self._base: Optional[FPDF] = None
+        self._logo_mtime: Optional[float] = None
+        self.leyenda = _latin1(LEYENDA)
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.logo)
+        except OSError:
+            return None
+
+    def pagina(self, pdf: FPDF):
+        """Agrega a `pdf` una página con el logo (en un mismo documento se incrusta una vez)."""
+        pdf.add_page()
+        try:
+            if os.path.exists(self.logo):
+                pdf.image(self.logo, x=160, y=8, w=30)
+        except Exception:
+            pass
+
+    def _armar(self) -> FPDF:
+        pdf = FPDF()
+        pdf.set_auto_page_break(auto=True, margin=15)
+        self.pagina(pdf)
+        return pdf
+
+    def nueva(self) -> FPDF:
+        with self._lock:
+            mtime = self._mtime()
+            if self._base is None or mtime != self._logo_mtime:
+                self._base, self._logo_mtime = self._armar(), mtime
+            return copy.deepcopy(self._base)
+
+    def huella_logo(self) -> str:
+        return f"{self.logo}:{self._mtime()}"
+
+def huella_pedido(pedido_id, cliente, fecha, estatus, productos: Sequence[Sequence]) -> str:
+    """Huella del contenido que se imprime: mismo pedido con los mismos datos, mismo PDF."""
+    filas = []
+    for fila in productos or []:
+        try:
+            nombre, ml, costo, total = fila
+            filas.append([str(nombre), float(ml), float(costo), float(total or 0.0)])
+        except Exception:
+            continue
+    datos = json.dumps([VERSION, str(pedido_id), str(cliente), str(fecha), str(estatus), filas],
+                       ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+def _dibujar(pdf: FPDF, leyenda: str, pedido_id: int, cliente: str, fecha: str, estatus: str,
+             productos: List[Tuple[str, float, float, float]]):
+    """Maqueta de un pedido desde la posición actual de `pdf` (Latin-1 blindado)."""
+    s_pedido  = _latin1(f"Pedido #{pedido_id}")
+    s_cliente = _latin1(f"Cliente: {cliente}")
+    s_fecha   = _latin1(f"Fecha: {fecha}")
+    s_status  = _latin1(f"Estatus: {estatus}")
+
+    filas = []
+    total_general = 0.0
+    for fila in productos or []:
+        try:
+            nombre, ml, costo, total = fila
+        except Exception:
+            continue
+        filas.append((_latin1(str(nombre))[:60], _latin1(f"{float(ml):g}"),
+                      _latin1(_fmt_money(costo)), _latin1(_fmt_money(total))))
+        try:
+            total_general += float(total or 0.0)
+        except Exception:
+            pass
+
+    pdf.set_font("Arial", "B", 15); pdf.cell(0, 10, s_pedido, ln=True)
+    pdf.set_font("Arial", "", 12)
+    pdf.cell(0, 8, s_cliente, ln=True)
+    pdf.cell(0, 8, s_fecha, ln=True)
+    pdf.cell(0, 8, s_status, ln=True); pdf.ln(4)
+
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(90, 9, "Producto", 1)
+    pdf.cell(25, 9, "ML", 1, 0, "C")
+    pdf.cell(35, 9, "Costo/ml", 1, 0, "C")
+    pdf.cell(35, 9, "Total", 1, 1, "C")
+
+    pdf.set_font("Arial", "", 11)
+    for nombre_s, ml_s, costo_s, total_s in filas:
+        pdf.cell(90, 8, nombre_s, 1)
+        pdf.cell(25, 8, ml_s, 1, 0, "C")
+        pdf.cell(35, 8, costo_s, 1, 0, "C")
+        pdf.cell(35, 8, total_s, 1, 1, "C")
+
+    pdf.set_font("Arial", "B", 12)
+    pdf.cell(150, 9, "TOTAL GENERAL", 1, 0, "C")
+    pdf.cell(35, 9, _latin1(_fmt_money(total_general)), 1, 1, "R")
+    pdf.ln(6)
+
+    pdf.set_draw_color(210, 210, 210)
+    x1, y1 = 10, pdf.get_y()
+    pdf.line(x1, y1, 200, y1)
+    pdf.ln(6)
+    pdf.set_font("Arial", "", 11)
+    pdf.multi_cell(0, 6, leyenda)
+
+def renderizar(plantilla: Plantilla, pedido_id: int, cliente: str, fecha: str, estatus: str,
+               productos: List[Tuple[str, float, float, float]]) -> bytes:
+    """El PDF del pedido sobre una copia de la plantilla."""
+    pdf = plantilla.nueva()
+    _dibujar(pdf, plantilla.leyenda, pedido_id, cliente, fecha, estatus, productos)
+    return _a_bytes(pdf.output(dest="S"))
+
+class GeneradorPdf:
+    """PDFs de pedidos con plantilla compartida y LRU de documentos terminados.
+
+    El LRU se limita por número de documentos y por bytes (cada PDF lleva el logo, ~150 KB).
+    Seguro entre hilos: dos sesiones que piden el mismo PDF a la vez pueden generarlo las
+    dos, pero el resultado es el mismo.
+    """
+
+    def __init__(self, logo: str, maximo: int = 64, max_bytes: int = 32 * 1024 * 1024):
+        self.plantilla = Plantilla(logo)
+        self.maximo = maximo
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._docs: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _clave(self, *args) -> str:
+        return f"{huella_pedido(*args)}:{self.plantilla.huella_logo()}"
+
+    def obtener(self, clave: str, generar: Callable[[], bytes]) -> bytes:
+        with self._lock:
+            doc = self._docs.get(clave)
+            if doc is not None:
+                self._docs.move_to_end(clave)
+                self.aciertos += 1
+                return doc
+            self.fallos += 1
+        doc = generar()
+        with self._lock:
+            if clave not in self._docs:
+                self._docs[clave] = doc
+                self._bytes += len(doc)
+            while self._docs and (len(self._docs) > self.maximo or self._bytes > self.max_bytes):
+                _, viejo = self._docs.popitem(last=False)
+                self._bytes -= len(viejo)
+        return doc
+
+    def pdf(self, pedido_id: int, cliente: str, fecha: str, estatus: str,
+            productos: List[Tuple[str, float, float, float]]) -> bytes:
+        args = (pedido_id, cliente, fecha, estatus, productos)
+        return self.obtener(self._clave(*args), lambda: renderizar(self.plantilla, *args))
+
+# =====================
+# EXPORTACIÓN MASIVA
+# =====================
+# Un pedido para exportar: (pedido_id, cliente, fecha, estatus, productos)
+PedidoPdf = Tuple[int, str, str, str, List[Tuple[str, float, float, float]]]
+
+EXPORTAR_LOTE = 8         # pedidos por tarea enviada a un proceso
+EXPORTAR_EN_VUELO = 2     # lotes pendientes por proceso antes de esperar resultados
+EXPORTAR_MIN_PARALELO = 64  # con menos pedidos arrancar los procesos cuesta más que renderizar
+
+_PLANTILLA_PROCESO: Optional[Plantilla] = None
+
+def nombre_pdf(pedido_id, cliente) -> str:
+    """Nombre del archivo, el mismo que el botón de descarga individual."""
+    return f"Pedido_{pedido_id}_{str(cliente).replace(' ', '')}.pdf"
+
+def _nucleos() -> int:
+    # En un contenedor cpu_count() puede dar los del host; la afinidad da los usables
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _iniciar_proceso(logo: str):
+    global _PLANTILLA_PROCESO
+    _PLANTILLA_PROCESO = Plantilla(logo)
+
+def _renderizar_lote(lote: List[PedidoPdf]) -> List[Tuple[str, bytes]]:
+    """Trabajo de cada proceso: (nombre de archivo, PDF) por pedido del lote."""
+    return [(nombre_pdf(p[0], p[1]), renderizar(_PLANTILLA_PROCESO, *p)) for p in lote]
+
+def _lotes(pedidos: Iterable[PedidoPdf], tam: int) -> Iterator[List[PedidoPdf]]:
+    it = iter(pedidos)
+    while True:
+        lote = list(itertools.islice(it, tam))
+        if not lote:
+            return
+        yield lote
+
+def _en_procesos(logo: str, pedidos: Iterable[PedidoPdf], total: int, procesos: Optional[int],
+                lote: int, en_orden: bool = False) -> Iterator[List[Tuple[str, bytes]]]:
+    """Los PDFs de `pedidos`, lote por lote ([(nombre de archivo, PDF)]), renderizados en un
+    pool de procesos conforme se liberan lugares; con `en_orden`, en el orden de `pedidos`.
+
+    `pedidos` puede ser un generador: se consume conforme se liberan lugares, así en memoria
+    sólo están los lotes en vuelo. Los procesos se crean con "spawn" (el servidor de
+    Streamlit tiene hilos y un fork podría heredar un lock tomado). Si no se pueden crear
+    procesos, son pocos pedidos (`total` < EXPORTAR_MIN_PARALELO) o el pool se cae a medias,
+    lo que falte se renderiza aquí mismo.
+    """
+    procesos = max(1, procesos or _nucleos())
+    lotes = _lotes(pedidos, lote)
+    pool = None
+    if procesos > 1 and (not total or total >= EXPORTAR_MIN_PARALELO):
+        try:
+            pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_iniciar_proceso, initargs=(logo,))
+        except (OSError, NotImplementedError):
+            pool = None
+
+    # Lotes enviados y aún sin entregar (en el orden en que se enviaron): si el pool se cae,
+    # se renderizan aquí
+    pendientes: Dict = {}
+    sin_enviar: List[List[PedidoPdf]] = []
+    if pool is not None:
+        with pool:
+            try:
+                for l in lotes:
+                    # Ya salió del generador: hasta que quede en `pendientes` es de `sin_enviar`
+                    sin_enviar = [l]
+                    if len(pendientes) >= procesos * EXPORTAR_EN_VUELO:
+                        # En orden se espera al más viejo: lo entregado siempre es un prefijo
+                        esperar = [next(iter(pendientes))] if en_orden else pendientes
+                        listos, _ = wait(esperar, return_when=FIRST_COMPLETED)
+                        for f in [f for f in pendientes if f in listos]:
+                            docs = f.result()
+                            del pendientes[f]
+                            yield docs
+                    pendientes[pool.submit(_renderizar_lote, l)] = l
+                    sin_enviar = []
+                for f in list(pendientes):
+                    docs = f.result()
+                    del pendientes[f]
+                    yield docs
+            except BrokenProcessPool:
+                pass
+            except BaseException:
+                for f in pendientes:
+                    f.cancel()
+                raise
+
+    _iniciar_proceso(logo)
+    for l in itertools.chain(list(pendientes.values()), sin_enviar, lotes):
+        yield _renderizar_lote(l)
+
+def exportar_zip(logo: str, pedidos: Iterable[PedidoPdf], destino, total: int = 0,
+                 procesos: Optional[int] = None, progreso: Optional[Callable[[int, int], None]] = None,
+                 lote: int = EXPORTAR_LOTE) -> int:
+    """Un PDF por pedido dentro de un ZIP escrito en `destino` (ruta o archivo binario),
+    conforme terminan los lotes (ver _en_procesos). Devuelve cuántos PDFs se escribieron."""
+    hechos = 0
+    # Los PDFs ya vienen comprimidos (y el logo es JPEG/PNG): deflate no gana casi nada
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED) as zf:
+        for docs in _en_procesos(logo, pedidos, total, procesos, lote):
+            for nombre, doc in docs:
+                zf.writestr(nombre, doc)
+            hechos += len(docs)
+            if progreso:
+                progreso(hechos, total)
+    return hechos
+
+# =====================
+# PDF ÚNICO (los PDFs individuales unidos página por página)
+# =====================
+_REF = re.compile(rb"(\d+) 0 R")
+_PARENT = re.compile(rb"/Parent \d+ 0 R")
+
+def _objetos_pdf(doc: bytes) -> Tuple[Dict[int, bytes], int]:
+    """Objetos de un PDF de fpdf2 ({número: lo que va entre `obj` y `endobj`}) y el número del
+    catálogo. Se leen por la tabla xref: cada objeto termina donde empieza el siguiente."""
+    xref = int(doc[doc.rindex(b"startxref") + len(b"startxref"):].split()[0])
+    tabla, trailer = doc[xref:].split(b"trailer", 1)
+    # "xref", "0 N" y una entrada por objeto
+    entradas = tabla.split(b"\n")[2:]
+    inicios = {n: int(e[:10]) for n, e in enumerate(entradas) if e.rstrip().endswith(b"n")}
+    limites = sorted(inicios.values()) + [xref]
+    siguiente = dict(zip(limites, limites[1:]))
+    objetos = {}
+    for n, inicio in inicios.items():
+        cuerpo = doc[inicio:siguiente[inicio]]
+        objetos[n] = cuerpo[cuerpo.index(b"obj") + 3:cuerpo.rindex(b"endobj")].strip(b"\n")
+    raiz = int(re.search(rb"/Root (\d+) 0 R", trailer).group(1))
+    return objetos, raiz
+
+class PdfUnido:
+    """Un PDF escrito en `destino` conforme llegan otros PDFs de fpdf2, con sus páginas una tras
+    otra. En memoria sólo queda la posición de cada objeto escrito.
+
+    Los objetos idénticos (el logo, las fuentes, los diccionarios de recursos) se escriben una
+    vez y los demás documentos apuntan a esa copia: el logo no se repite por pedido.
+    """
+
+    # Se escriben al cerrar, cuando ya se conocen todas las páginas
+    RAIZ, CATALOGO = 1, 2
+
+    def __init__(self, destino):
+        self.destino = destino
+        self._pos = 0
+        self._inicios: Dict[int, int] = {}
+        self._siguiente = 3
+        self._escritos: Dict[bytes, int] = {}
+        self._paginas: List[int] = []
+        self._media_box = b"[0 0 595.28 841.89]"
+
+    def _escribir(self, datos: bytes):
+        self.destino.write(datos)
+        self._pos += len(datos)
+
+    def _objeto(self, num: int, cuerpo: bytes):
+        self._inicios[num] = self._pos
+        self._escribir(b"%d 0 obj\n" % num + cuerpo + b"\nendobj\n")
+
+    def agregar(self, doc: bytes):
+        objetos, raiz = _objetos_pdf(doc)
+        if not self._inicios:
+            self._escribir(doc[:doc.index(b"\n") + 1] + b"%\xe2\xe3\xcf\xd3\n")
+        paginas_raiz = objetos[int(re.search(rb"/Pages (\d+) 0 R", objetos[raiz]).group(1))]
+        caja = re.search(rb"/MediaBox (\[[^\]]*\])", paginas_raiz)
+        if caja:
+            self._media_box = caja.group(1)
+        kids = [int(n) for n in _REF.findall(re.search(rb"/Kids \[([^\]]*)\]", paginas_raiz).group(1))]
+        nuevos: Dict[int, int] = {}
+
+        def copiar(n: int, pagina: bool = False) -> int:
+            if n in nuevos:
+                return nuevos[n]
+            cabeza, sep, resto = objetos[n].partition(b"stream")
+            # /Parent apunta a la raíz vieja (y haría un ciclo): se cambia por la nueva al final
+            cabeza = _PARENT.sub(b"/Parent \x00", cabeza)
+            cabeza = _REF.sub(lambda m: b"%d 0 R" % copiar(int(m.group(1))), cabeza)
+            cuerpo = cabeza.replace(b"/Parent \x00", b"/Parent %d 0 R" % self.RAIZ) + sep + resto
+            clave = None if pagina else hashlib.sha1(cuerpo).digest()
+            if clave in self._escritos:
+                nuevos[n] = self._escritos[clave]
+                return nuevos[n]
+            nuevos[n] = self._siguiente
+            self._siguiente += 1
+            self._objeto(nuevos[n], cuerpo)
+            if clave is not None:
+                self._escritos[clave] = nuevos[n]
+            return nuevos[n]
+
+        for n in kids:
+            self._paginas.append(copiar(n, pagina=True))
+
+    def cerrar(self):
+        """Raíz de páginas, catálogo, tabla xref y trailer."""
+        kids = b"\n".join(b"%d 0 R" % n for n in self._paginas)
+        self._objeto(self.RAIZ, b"<<\n/Count %d\n/Kids [%s]\n/MediaBox %s\n/Type /Pages\n>>"
+                     % (len(self._paginas), kids, self._media_box))
+        self._objeto(self.CATALOGO, b"<<\n/PageLayout /OneColumn\n/Pages %d 0 R\n/Type /Catalog\n>>" % self.RAIZ)
+        xref, total = self._pos, self._siguiente
+        self._escribir(b"xref\n0 %d\n0000000000 65535 f \n" % total)
+        self._escribir(b"".join(b"%010d 00000 n \n" % self._inicios[n] for n in range(1, total)))
+        self._escribir(b"trailer\n<<\n/Size %d\n/Root %d 0 R\n>>\nstartxref\n%d\n%%%%EOF\n"
+                       % (total, self.CATALOGO, xref))
+
+def exportar_pdf_unico(logo: str, pedidos: Iterable[PedidoPdf], destino, total: int = 0,
+                       procesos: Optional[int] = None, progreso: Optional[Callable[[int, int], None]] = None,
+                       lote: int = EXPORTAR_LOTE) -> int:
+    """Todos los pedidos en un solo PDF, cada uno desde una página nueva, escrito en `destino`
+    (ruta o archivo binario). Devuelve cuántos pedidos.
+
+    Cada pedido se renderiza como en el ZIP (en el pool de procesos, ver _en_procesos) y sus
+    páginas se van anexando a `destino` en orden (PdfUnido): nunca está el documento entero
+    en memoria y el logo se incrusta una vez para todo el documento.
+    """
+    hechos = 0
+    docs = itertools.chain.from_iterable(_en_procesos(logo, pedidos, total, procesos, lote, en_orden=True))
+    primero = next(docs, None)
+    if primero is None:
+        return 0
+    propio = isinstance(destino, (str, os.PathLike))
+    f = open(destino, "wb") if propio else destino
+    try:
+        unido = PdfUnido(f)
+        for _, doc in itertools.chain([primero], docs):
+            unido.agregar(doc)
+            hechos += 1
+            if progreso and (hechos % lote == 0):
+                progreso(hechos, total)
+        unido.cerrar()
+    finally:
+        if propio:
+            f.close()
+    if progreso:
+        progreso(hechos, total)
+    return hechos
@@ -0,0 +1,191 @@
+# scheduler.py — H DECANTS (planificador de llamadas a Sheets: cuota, reintentos y coalescencia)
+# ========================================================================================
+#
+# Todas las llamadas a Spreadsheet/Worksheet pasan por un Scheduler compartido por el proceso
+# (todas las sesiones de Streamlit):
+#   - token bucket: ráfagas cortas se encolan unos instantes en vez de chocar con la cuota
+#     por minuto de Sheets (lecturas y escrituras tienen cubetas separadas, como la cuota);
+#   - lecturas idénticas simultáneas se hacen una sola vez y comparten el resultado (salvo
+#     dentro de sin_coalescer(): quien necesita ver su propia escritura no toma una lectura
+#     que empezó antes que ella);
+#   - 429 (y 5xx en lecturas) se reintentan con backoff exponencial con jitter.
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+LECTURAS = {
+    "get_values", "get", "get_all_values", "col_values", "row_values",
+    "values_batch_get", "worksheets", "worksheet", "fetch_sheet_metadata", "huellas",
+}
+ESCRITURAS = {
+    "update", "batch_update", "append_row", "append_rows", "clear",
+    "add_worksheet", "values_batch_update",
+}
+
+def _status(e: Exception) -> Optional[int]:
+    """Código HTTP de un error de gspread (APIError) o del backend local."""
+    code = getattr(e, "code", None)
+    if isinstance(code, int):
+        return code
+    resp = getattr(e, "response", None)
+    return getattr(resp, "status_code", None)
+
+class TokenBucket:
+    """Cubeta con `burst` fichas que se rellena para no pasar de `per_minute` en ninguna ventana
+    de 60 s. per_minute <= 0 desactiva el límite."""
+
+    def __init__(self, per_minute: float, burst: int = 5):
+        self.per_minute = float(per_minute)
+        self.burst = max(1, int(burst))
+        self._rate = max(self.per_minute - self.burst, 1.0) / 60.0
+        self._tokens = float(self.burst)
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Toma una ficha esperando lo necesario; devuelve los segundos esperados."""
+        if self.per_minute <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._t) * self._rate)
+                self._t = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                need = (1 - self._tokens) / self._rate
+            time.sleep(need)
+            waited += need
+
+_hilo = threading.local()
+
+@contextmanager
+def sin_coalescer():
+    """Las lecturas de este hilo dentro del bloque van a la API aunque haya una idéntica en
+    vuelo: ésa pudo empezar antes de una escritura que la lectura tiene que ver."""
+    previo = getattr(_hilo, "sin_coalescer", False)
+    _hilo.sin_coalescer = True
+    try:
+        yield
+    finally:
+        _hilo.sin_coalescer = previo
+
+class _Vuelo:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class Scheduler:
+    def __init__(self, per_minute: float = 60, burst: int = 5, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 32.0):
+        self.buckets = {"read": TokenBucket(per_minute, burst), "write": TokenBucket(per_minute, burst)}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._vuelos: Dict[Tuple, _Vuelo] = {}
+        self._m = {"calls": 0, "reads": 0, "writes": 0, "coalesced": 0, "retries": 0,
+                   "errors": 0, "wait_s": 0.0, "backoff_s": 0.0}
+
+    # ---- métricas ----
+    def _sum(self, key: str, v=1):
+        with self._lock:
+            self._m[key] += v
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            m = dict(self._m)
+        m["wait_s"] = round(m["wait_s"], 3)
+        m["backoff_s"] = round(m["backoff_s"], 3)
+        return m
+
+    # ---- ejecución ----
+    def _con_reintentos(self, escritura: bool, fn: Callable[[], Any]) -> Any:
+        bucket = self.buckets["write" if escritura else "read"]
+        for intento in range(self.max_retries + 1):
+            self._sum("wait_s", bucket.acquire())
+            self._sum("calls")
+            self._sum("writes" if escritura else "reads")
+            try:
+                return fn()
+            except Exception as e:
+                code = _status(e)
+                # Un 5xx en escritura pudo haberse aplicado: no se repite (evita appends dobles)
+                reintentable = code == 429 or (not escritura and code is not None and code >= 500)
+                if not reintentable or intento >= self.max_retries:
+                    self._sum("errors")
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * (2 ** intento)) * random.uniform(0.5, 1.0)
+                self._sum("retries")
+                self._sum("backoff_s", delay)
+                time.sleep(delay)
+
+    def run(self, escritura: bool, key: Tuple, fn: Callable[[], Any]) -> Any:
+        if escritura or getattr(_hilo, "sin_coalescer", False):
+            return self._con_reintentos(escritura, fn)
+        with self._lock:
+            vuelo = self._vuelos.get(key)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[key] = _Vuelo()
+        if not lider:
+            vuelo.event.wait()
+            self._sum("coalesced")
+            if vuelo.error is not None:
+                raise vuelo.error
+            return _copia(vuelo.result)
+        try:
+            vuelo.result = self._con_reintentos(False, fn)
+            return vuelo.result
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                self._vuelos.pop(key, None)
+            vuelo.event.set()
+
+def _copia(res: Any) -> Any:
+    # Cada quien recibe sus propias filas (los llamadores pueden modificar las listas)
+    if isinstance(res, list):
+        return [list(r) if isinstance(r, list) else r for r in res]
+    return res
+
+# =====================
+# PROXIES
+# =====================
+class Programado:
+    """Envuelve un Spreadsheet o Worksheet: sus llamadas a la API pasan por el Scheduler."""
+
+    def __init__(self, target: Any, scheduler: Scheduler):
+        self._target = target
+        self._scheduler = scheduler
+
+    def __repr__(self):
+        return f"<Programado {self._target!r}>"
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr) or name not in LECTURAS | ESCRITURAS:
+            return attr
+        escritura = name in ESCRITURAS
+
+        def call(*args, **kwargs):
+            key = (id(self._target), name, repr(args), repr(sorted(kwargs.items())))
+            res = self._scheduler.run(escritura, key, lambda: attr(*args, **kwargs))
+            return self._envolver(res)
+        return call
+
+    def _envolver(self, res: Any) -> Any:
+        # worksheet()/worksheets()/add_worksheet() devuelven hojas: también se programan
+        if hasattr(res, "get_values") and not isinstance(res, Programado):
+            return Programado(res, self._scheduler)
+        if isinstance(res, list) and res and all(hasattr(r, "get_values") for r in res):
+            return [Programado(r, self._scheduler) for r in res]
+        return res
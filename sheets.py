@@ -0,0 +1,2289 @@
+# sheets.py — H DECANTS (capa de datos: conexión, cargas por rango y escrituras parciales)
+# ========================================================================================
+#
+# Todo acceso a la hoja pasa por get_ws(); el backend (Google Sheets o local simulado)
+# se elige por configuración: variable de entorno HD_STORAGE_BACKEND o secret STORAGE_BACKEND.
+# Cada lectura y escritura se copia al espejo local (mirror.py): sin conexión, o si Sheets no
+# responde, los loaders leen del espejo y pedidos/compras esperan en la bandeja de salida.
+
+import os
+import random
+import threading
+import uuid
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import streamlit as st
+import pandas as pd
+
+from mirror import Espejo
+from outbox import Outbox
+from scheduler import Programado, Scheduler, sin_coalescer
+from busqueda import IndiceNgramas, normalizar
+from esquema import Columna, Esquema, Problema
+from snapshot import Snapshots
+from storage import GspreadBackend, LocalBackend, StorageBackend, a1_bounds
+
+# Los frames cacheados se comparten entre sesiones sin copiarse: con Copy-on-Write (por
+# defecto desde pandas 3) lo que se derive de ellos nunca los modifica
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+SHEET_URL            = "https://docs.google.com/spreadsheets/d/1bjV4EaDNNbJfN4huzbNpTFmj-vfCr7A2474jhO81-bE/edit?gid=1318862509#gid=1318862509"
+SHEET_TAB_PRODUCTOS  = "Productos"
+SHEET_TAB_PEDIDOS    = "Pedidos"
+SHEET_TAB_ENVIOS     = "Envios"
+SHEET_TAB_COMPRAS    = "Compras"
+SHEET_TAB_META       = "Meta"
+SHEET_TAB_MOVIMIENTOS = "Movimientos"
+SHEET_TAB_FOLIOS     = "Folios"
+
+# Lecturas grandes se parten en páginas de este número de filas
+PAGINA_FILAS = 50_000
+
+PRODUCTOS_COLS = ["Producto", "Costo x ml", "Stock disponible"]
+PEDIDOS_COLS = ["# Pedido","Nombre Cliente","Fecha","Producto","Mililitros","Costo x ml","Total","Estatus"]
+MOVIMIENTOS_COLS = ["Fecha", "Producto", "ML", "Tipo", "Referencia", "Lote"]
+FOLIOS_COLS = ["Token", "Base", "Fecha"]
+COMPRAS_COLS = [
+    "Producto", "Pzs", "Costo", "Status", "Mes", "Fecha", "Año",
+    "De quien", "Status de Pago", "Decants", "Vendedor"
+]
+
+# Pestañas que la app necesita y el contenido inicial de cada una (None = sin encabezado).
+# Meta sólo guarda las celdas de control de la sonda; los # Pedido salen de Folios.
+HOJAS_INICIALES = {
+    SHEET_TAB_PRODUCTOS: [PRODUCTOS_COLS],
+    SHEET_TAB_PEDIDOS:   [PEDIDOS_COLS],
+    SHEET_TAB_ENVIOS:    None,
+    SHEET_TAB_COMPRAS:   [COMPRAS_COLS],
+    SHEET_TAB_META:      [["Clave","Valor"]],
+    SHEET_TAB_MOVIMIENTOS: [MOVIMIENTOS_COLS],
+    SHEET_TAB_FOLIOS:    [FOLIOS_COLS],
+}
+
+# Columnas de las pestañas que se cargan como DataFrame (esquema.py): tipo compacto, defecto
+# y validación. Los textos repetidos van como categoría (un código por fila); Total en
+# float64 porque se suma.
+ESQUEMAS = {
+    SHEET_TAB_PRODUCTOS: Esquema(SHEET_TAB_PRODUCTOS, [
+        Columna("Producto", "texto", requerida=True),
+        Columna("Costo x ml", "float64", minimo=0),
+        Columna("Stock disponible", "float64"),
+    ]),
+    SHEET_TAB_PEDIDOS: Esquema(SHEET_TAB_PEDIDOS, [
+        Columna("# Pedido", "int32", requerida=True, minimo=1),
+        Columna("Nombre Cliente", "categoria"),
+        Columna("Fecha", "fecha"),
+        Columna("Producto", "categoria", requerida=True),
+        Columna("Mililitros", "float32", minimo=0),
+        Columna("Costo x ml", "float32", minimo=0),
+        Columna("Total", "float64"),
+        Columna("Estatus", "categoria"),
+    ]),
+    SHEET_TAB_COMPRAS: Esquema(SHEET_TAB_COMPRAS, [
+        Columna("Producto", "categoria", requerida=True),
+        Columna("Pzs", "int32", minimo=0),
+        Columna("Costo", "float32", minimo=0),
+        Columna("Status", "categoria"),
+        Columna("Mes", "categoria"),
+        Columna("Fecha", "fecha"),
+        Columna("Año", "int16"),
+        Columna("De quien", "categoria"),
+        Columna("Status de Pago", "categoria"),
+        Columna("Decants", "categoria"),
+        Columna("Vendedor", "categoria"),
+    ]),
+}
+
+# =====================
+# CONFIG DEL BACKEND
+# =====================
+def _config(key: str, default=None):
+    """Lee HD_<key> del entorno y, si no existe, st.secrets[key]."""
+    env = os.environ.get(f"HD_{key}")
+    if env not in (None, ""):
+        return env
+    try:
+        return st.secrets.get(key, default)
+    except Exception:
+        return default
+
+@st.cache_resource(show_spinner=False)
+def get_backend() -> StorageBackend:
+    """Backend compartido por proceso: 'gsheets' (por defecto) o 'local' (simulado en memoria)."""
+    kind = str(_config("STORAGE_BACKEND", "gsheets")).strip().lower()
+    if kind == "local":
+        latency_ms = float(_config("LOCAL_LATENCY_MS", 0) or 0)
+        quota = int(_config("LOCAL_QUOTA_RPM", 0) or 0)
+        return LocalBackend(latency=latency_ms / 1000.0, quota_per_minute=quota)
+    return GspreadBackend(st.secrets["GOOGLE_SERVICE_ACCOUNT"], SHEET_URL)
+
+@st.cache_resource(show_spinner=False)
+def get_scheduler() -> Scheduler:
+    """Cuota compartida por todas las sesiones del proceso (SHEETS_RPM; 0 = sin límite).
+
+    Por defecto 60/min contra Google Sheets y sin límite contra el backend local.
+    """
+    default = 0 if get_backend().name == "local" else 60
+    return Scheduler(per_minute=float(_config("SHEETS_RPM", default) or 0))
+
+def metricas_cuota() -> Dict[str, object]:
+    return get_scheduler().metrics()
+
+@st.cache_resource(show_spinner=False)
+def get_espejo() -> Espejo:
+    """Espejo local de las pestañas (MIRROR_PATH); persiste entre reinicios."""
+    return Espejo(str(_config("MIRROR_PATH", ".hdecants_mirror.sqlite")))
+
+@st.cache_resource(show_spinner=False)
+def get_snapshots() -> Snapshots:
+    """Snapshots Arrow de los DataFrames grandes (SNAPSHOT_DIR) para arrancar en caliente."""
+    return Snapshots(str(_config("SNAPSHOT_DIR", ".hdecants_cache")))
+
+# =====================
+# CLIENTE GSHEETS (lazy)
+# =====================
+def _get_or_create_ws(sheet, title: str, rows: int = 200, cols: int = 20):
+    try:
+        return sheet.worksheet(title)
+    except Exception:
+        return sheet.add_worksheet(title=title, rows=rows, cols=cols)
+
+def _asegurar_hojas(sheet) -> Dict[str, object]:
+    """Pestañas y encabezados con el mínimo de llamadas: una lectura de metadatos y una de
+    encabezados por lote; sólo si falta algo, un addSheet por lote y un values_batch_update."""
+    hojas = {ws.title: ws for ws in sheet.worksheets()}
+    faltantes = [t for t in HOJAS_INICIALES if t not in hojas]
+    if faltantes:
+        sheet.batch_update({"requests": [
+            {"addSheet": {"properties": {"title": t, "gridProperties": {"rowCount": 200, "columnCount": 20}}}}
+            for t in faltantes
+        ]})
+        hojas = {ws.title: ws for ws in sheet.worksheets()}
+
+    # Asegura encabezados básicos
+    try:
+        con_encabezado = [t for t, v in HOJAS_INICIALES.items() if v]
+        resp = sheet.values_batch_get([f"'{t}'!1:1" for t in con_encabezado])
+        vacias = [t for t, vr in zip(con_encabezado, resp.get("valueRanges", [])) if not vr.get("values")]
+        if vacias:
+            sheet.values_batch_update({
+                "valueInputOption": "RAW",
+                "data": [{"range": f"'{t}'!A1", "values": HOJAS_INICIALES[t]} for t in vacias],
+            })
+    except Exception:
+        pass
+    return hojas
+
+@st.cache_resource(show_spinner=False)
+def get_client_and_ws():
+    """Crea cliente y devuelve worksheets. Cachea el recurso."""
+    client, sheet = get_backend().open()
+    sheet = Programado(sheet, get_scheduler())
+    hojas = _asegurar_hojas(sheet)
+
+    productos_ws = hojas[SHEET_TAB_PRODUCTOS]
+    pedidos_ws   = hojas[SHEET_TAB_PEDIDOS]
+    envios_ws    = hojas[SHEET_TAB_ENVIOS]
+    compras_ws   = hojas[SHEET_TAB_COMPRAS]
+
+    return client, sheet, productos_ws, pedidos_ws, envios_ws, compras_ws
+
+# --- Modo seguro: no hacemos st.stop() cuando no hay conexión ---
+class NotConnected(Exception):
+    pass
+
+class SinConexion(NotConnected):
+    """Conectado, pero Sheets no responde (red o cuota): se trabaja con el espejo local."""
+
+def _falla_de_red(e: Exception) -> bool:
+    """Errores que significan 'Sheets no está disponible' (y no un error de la app)."""
+    if isinstance(e, OSError):  # incluye ConnectionError/Timeout de requests
+        return True
+    code = getattr(e, "code", None)
+    if not isinstance(code, int):
+        code = getattr(getattr(e, "response", None), "status_code", None)
+    return code == 429 or (isinstance(code, int) and code >= 500)
+
+class EstadoRed:
+    """Si Sheets está respondiendo, compartido por todas las sesiones.
+
+    Tras una falla de red o de cuota get_ws() no lo vuelve a intentar durante `pausa` segundos
+    (la UI lee del espejo sin esperar timeouts). El hilo de la bandeja de salida sirve de sonda:
+    cuando vuelve a escribir, el estado se restablece y se descartan los datos del espejo en caché.
+    """
+
+    def __init__(self, pausa: float = 60):
+        self.pausa = pausa
+        self._lock = threading.Lock()
+        self.fuera_desde: Optional[float] = None
+        self.ultimo_error: Optional[str] = None
+        self._hasta = 0.0
+
+    def marcar_error(self, e: Exception):
+        with self._lock:
+            if self.fuera_desde is None:
+                self.fuera_desde = time.time()
+            self.ultimo_error = f"{type(e).__name__}: {e}"[:300]
+            self._hasta = time.monotonic() + self.pausa
+
+    def marcar_ok(self):
+        with self._lock:
+            volvio = self.fuera_desde is not None
+            self.fuera_desde, self.ultimo_error, self._hasta = None, None, 0.0
+        if volvio:
+            versiones().bump()
+
+    def fuera(self) -> bool:
+        return self.fuera_desde is not None
+
+    def en_pausa(self) -> bool:
+        with self._lock:
+            return self.fuera_desde is not None and time.monotonic() < self._hasta
+
+@st.cache_resource(show_spinner=False)
+def estado_red() -> EstadoRed:
+    return EstadoRed(pausa=float(_config("OFFLINE_PAUSA_S", 60) or 0))
+
+def get_ws():
+    """Devuelve worksheets si hay conexión; si no, levanta NotConnected (no detiene el render).
+
+    Si Sheets acaba de fallar por red o cuota levanta SinConexion (subclase) sin intentarlo.
+    """
+    if not st.session_state.get("connected", False):
+        raise NotConnected("Aún no conectado a Google Sheets.")
+    if estado_red().en_pausa():
+        raise SinConexion(estado_red().ultimo_error or "Sheets no responde.")
+    try:
+        return get_client_and_ws()
+    except Exception as e:
+        if _falla_de_red(e):
+            estado_red().marcar_error(e)
+            raise SinConexion(str(e)) from e
+        st.error(f"No hay conexión con Google Sheets: {e}")
+        raise
+
+def en_linea() -> bool:
+    return bool(st.session_state.get("connected", False)) and not estado_red().fuera()
+
+
+def limpiar_caches():
+    """Olvida conexión, índices y datos cacheados (Reconectar / Desconectar)."""
+    get_client_and_ws.clear(); get_meta_ws.clear(); get_folios_ws.clear()
+    productos_index.clear(); pedidos_index.clear(); pedido_id_allocator.clear(); pedidos_cache.clear(); precarga.clear(); conteo_filas.clear()
+    estado_red.clear(); versiones.clear(); libro_stock.clear(); get_movimientos_ws.clear()
+    _load_productos_df.clear(); _productos_con_libro.clear(); _load_pedidos_df.clear(); _load_compras_df.clear()
+    _historial_vista.clear()
+    problemas_datos.clear()
+    _buscador_productos.clear()
+
+# =====================
+# SONDA DE CAMBIOS Y VERSIONES POR PESTAÑA
+# =====================
+def _col(tab: str, col: str) -> str:
+    return f"'{tab}'!{col}:{col}"
+
+# Resumen de cada pestaña que Sheets recalcula solo (celdas de control en Meta, filas 3..6):
+# filas con dato y, por columna, una suma de control del contenido. Cada carácter cuenta por
+# su código y su posición, y cada fila por su número (mod 997), así que cambiar "Pendiente"
+# por "Entregado" o mover un valor de fila cambia la huella aunque el largo sea el mismo. De
+# cada celda entran los primeros `largo` caracteres: el costo de recalcular es filas × largo.
+HUELLA_COLUMNAS = {
+    SHEET_TAB_PRODUCTOS:   {"A": 60, "B": 12, "C": 12},
+    SHEET_TAB_PEDIDOS:     {"A": 10, "B": 40, "C": 12, "D": 60, "E": 10, "F": 12, "G": 12, "H": 12},
+    SHEET_TAB_COMPRAS:     {"A": 60, "B": 6, "C": 12, "D": 12, "E": 12, "F": 12, "G": 6, "H": 30,
+                            "I": 12, "J": 6, "K": 30},
+    SHEET_TAB_MOVIMIENTOS: {"A": 20, "B": 60, "C": 12, "D": 10, "E": 12, "F": 16},
+}
+
+def _suma_columna(tab: str, col: str, largo: int) -> str:
+    rango, pos = f"'{tab}'!{col}2:{col}", f"SEQUENCE(1,{largo})"
+    return f"SUMPRODUCT((MOD(ROW({rango}),997)+1)*IFERROR(CODE(MID({rango},{pos},1)),0)*{pos})"
+
+def _formula_huella(tab: str) -> str:
+    partes = [f"COUNTA({_col(tab, 'A')})"] + [_suma_columna(tab, c, n) for c, n in HUELLA_COLUMNAS[tab].items()]
+    return "=" + '&"|"&'.join(partes)
+
+HUELLAS = {t: _formula_huella(t) for t in HUELLA_COLUMNAS}
+
+def _filas_huella(huella: Optional[str]) -> Optional[int]:
+    """Filas con dato según la huella (su primer campo, en ambas sondas)."""
+    try:
+        return int(float(str(huella).split("|")[0]))
+    except (TypeError, ValueError):
+        return None
+
+class Versiones:
+    """Número de versión por pestaña, compartido por todas las sesiones.
+
+    Los loaders cachean por (pestaña, versión): mientras la versión no cambie, cada rerun y
+    cada autorefresh sale de la caché sin tocar Sheets. La versión sube cuando
+      - escribimos nosotros en esa pestaña (bump), o
+      - la sonda (una sola llamada para las tres pestañas, a lo más cada `cada` segundos)
+        ve que cambió su huella, es decir, escribió otro vendedor o alguien a mano.
+    Así una escritura sólo recarga la pestaña que tocó, y sólo una vez para todas las sesiones.
+
+    PedidosCache sólo lee la cola: si la huella de Pedidos cambia sin que crezcan sus filas
+    alguien editó (o borró) filas existentes, y la siguiente lectura es completa.
+    """
+
+    def __init__(self, cada: float = 30):
+        self.cada = cada
+        self._lock = threading.Lock()
+        self._version: Dict[str, int] = {t: 0 for t in HUELLAS}
+        self._huella: Dict[str, Optional[str]] = {}
+        self._sondeo = 0.0
+
+    def bump(self, *tabs: str):
+        """Sin pestañas, todas. La huella se olvida: el siguiente sondeo la registra sin contarla
+        como cambio (ya vamos a recargar)."""
+        with self._lock:
+            for t in tabs or list(self._version):
+                self._version[t] += 1
+                self._huella[t] = None
+
+    def actual(self, tab: str) -> int:
+        self.sondear()
+        with self._lock:
+            return self._version[tab]
+
+    def huella(self, tab: str, sondear: bool = False) -> Optional[str]:
+        """Última huella conocida de `tab` (None si no se conoce: sin sondeo o tras un bump)."""
+        if sondear:
+            self.sondear()
+        with self._lock:
+            return self._huella.get(tab)
+
+    def sondear(self, forzar: bool = False):
+        with self._lock:
+            if not forzar and time.monotonic() - self._sondeo < self.cada:
+                return
+            self._sondeo = time.monotonic()
+        if not st.session_state.get("connected", False) or estado_red().en_pausa():
+            return
+        try:
+            _, sheet, *_ = get_client_and_ws()
+            huellas = get_backend().sonda(sheet, SHEET_TAB_META, HUELLAS).huellas(list(HUELLAS))
+        except Exception as e:
+            if _falla_de_red(e):
+                estado_red().marcar_error(e)
+            return
+        editada = False
+        with self._lock:
+            for t, h in huellas.items():
+                previa = self._huella.get(t)
+                if previa is not None and previa != h:
+                    self._version[t] += 1
+                    if t == SHEET_TAB_PEDIDOS:
+                        antes, ahora = _filas_huella(previa), _filas_huella(h)
+                        editada = antes is None or ahora is None or ahora <= antes
+                self._huella[t] = h
+        if editada:
+            pedidos_cache().invalidate()
+
+@st.cache_resource(show_spinner=False)
+def versiones() -> Versiones:
+    return Versiones(cada=float(_config("SONDA_S", 30) or 0))
+
+# =====================
+# LECTURAS POR RANGO USADO (sin límites fijos de filas)
+# =====================
+class ConteoFilas:
+    """Última fila que puede tener datos en cada pestaña.
+
+    Parte del rowCount de los metadatos (leídos al conectar) y sube con nuestros propios
+    appends. Si otra sesión hace crecer la hoja, la lectura lo nota porque la última página
+    llega llena, y sigue leyendo: nunca se corta en silencio.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filas: Dict[str, int] = {}
+
+    def limite(self, ws) -> int:
+        with self._lock:
+            return max(int(getattr(ws, "row_count", 0) or 0), self._filas.get(ws.title, 0), 1)
+
+    def registrar(self, ws, ultima_fila: Optional[int]):
+        if not ultima_fila:
+            return
+        with self._lock:
+            self._filas[ws.title] = max(self._filas.get(ws.title, 0), int(ultima_fila))
+
+@st.cache_resource(show_spinner=False)
+def conteo_filas() -> ConteoFilas:
+    return ConteoFilas()
+
+def _rect(values: List[List]) -> List[List]:
+    """Rellena filas cortas con "" como hace gspread.get_values sobre la respuesta cruda."""
+    width = max((len(r) for r in values), default=0)
+    return [list(r) + [""] * (width - len(r)) for r in values]
+
+def _paginas(desde: int, hasta: int) -> List[Tuple[int, int]]:
+    return [(i, min(hasta, i + PAGINA_FILAS - 1)) for i in range(desde, hasta + 1, PAGINA_FILAS)]
+
+def _juntar(paginas: List[Tuple[int, int]], grids: List[List[List]]) -> List[List]:
+    """Une páginas manteniendo la alineación de filas (la API recorta las filas vacías del
+    final de cada página)."""
+    out: List[List] = []
+    for (a, b), vals in zip(paginas, grids):
+        out.extend(vals)
+        if (a, b) != paginas[-1]:
+            out.extend([[] for _ in range(b - a + 1 - len(vals))])
+    return out
+
+def _sin_vacias_al_final(vals: List[List]) -> List[List]:
+    n = len(vals)
+    while n and not any(str(c).strip() for c in vals[n - 1]):
+        n -= 1
+    return _rect(vals[:n])
+
+def _paginas_con_centinela(desde: int, hasta: int) -> List[Tuple[int, int]]:
+    # Una fila de más al final: si trae datos, la hoja creció desde los metadatos que tenemos
+    return _paginas(desde, hasta + 1)
+
+def _leer_filas(ws, col_fin: str, desde: int = 1,
+                precargado: Optional[Tuple[List[Tuple[int, int]], List[List[List]]]] = None) -> List[List]:
+    """Lee A{desde}:{col_fin}{última fila usada} por páginas.
+
+    `precargado` = (páginas, rejillas) ya leídas por lote con _paginas_con_centinela.
+    """
+    inicio = desde
+    hasta = max(conteo_filas().limite(ws), desde)
+    out: List[List] = []
+    while True:
+        if precargado:
+            paginas, grids = precargado
+            hasta, precargado = paginas[-1][1] - 1, None
+        else:
+            paginas = _paginas_con_centinela(desde, hasta)
+            grids = [_rect(ws.get_values(f"A{a}:{col_fin}{b}")) for a, b in paginas]
+        parte = _juntar(paginas, grids)
+        out.extend(parte)
+        if desde + len(parte) - 1 <= hasta:
+            break
+        # La centinela traía datos: seguir con otra página completa
+        desde, hasta = hasta + 2, hasta + 1 + PAGINA_FILAS
+    out = _sin_vacias_al_final(out)
+    conteo_filas().registrar(ws, inicio + len(out) - 1)
+    return out
+
+# =====================
+# PRECARGA (una sola lectura para las tres pestañas)
+# =====================
+class Precarga:
+    """Rejillas leídas por adelantado; cada loader consume la suya una sola vez.
+
+    `desde` es la primera fila leída (1 = pestaña completa; > 1 = sólo la cola de Pedidos).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vals: Dict[str, Tuple[List[List], int]] = {}
+        self.hecha = False
+
+    def put(self, title: str, vals: List[List], desde: int = 1):
+        with self._lock:
+            self._vals[title] = (vals, desde)
+
+    def pop(self, title: str, desde: int = 1) -> Optional[List[List]]:
+        with self._lock:
+            vals, inicio = self._vals.pop(title, (None, desde))
+            return vals if inicio == desde else None
+
+    def clear(self):
+        with self._lock:
+            self._vals.clear()
+
+@st.cache_resource(show_spinner=False)
+def precarga() -> Precarga:
+    return Precarga()
+
+def _leer_tabla(ws, col_fin: str) -> List[List]:
+    """Toda la pestaña (encabezado incluido) hasta `col_fin`; usa la precarga si la hay."""
+    vals = precarga().pop(ws.title)
+    if vals is None:
+        vals = _leer_filas(ws, col_fin)
+    get_espejo().reemplazar(ws.title, vals)
+    return vals
+
+def _leer_o_espejo(hoja: str, leer):
+    """`leer(worksheets)` contra Sheets; sin conexión, o si Sheets falla por red o cuota, la
+    rejilla de `hoja` en el espejo local."""
+    try:
+        res = leer(get_ws())
+    except NotConnected:
+        return get_espejo().leer(hoja)
+    except Exception as e:
+        if not _falla_de_red(e):
+            raise
+        estado_red().marcar_error(e)
+        return get_espejo().leer(hoja)
+    estado_red().marcar_ok()
+    return res
+
+def precargar_datos():
+    """Primera carga: Productos, Pedidos y Compras en un solo values_batch_get.
+
+    Llena las tres caches juntas (una ida y vuelta en vez de tres en serie). Si el backend no
+    tiene lecturas por lote, hace las tres lecturas en paralelo con un pool de hilos. Sólo corre
+    una vez por conexión; los refrescos siguientes los hace cada loader por su cuenta. Si Pedidos
+    arrancó desde su snapshot en disco, sólo se leen las filas nuevas desde la última sincronizada.
+    """
+    pre = precarga()
+    if pre.hecha:
+        return
+    try:
+        _, sheet, productos_ws, pedidos_ws, _, compras_ws = get_ws()
+    except NotConnected:
+        return
+    objetivos = [(productos_ws, "E", 1), (pedidos_ws, "H", pedidos_cache().desde_delta()), (compras_ws, "K", 1)]
+    try:
+        if hasattr(sheet, "values_batch_get"):
+            paginas = [_paginas_con_centinela(desde, max(conteo_filas().limite(ws), desde)) for ws, _, desde in objetivos]
+            rangos = [f"'{ws.title}'!A{a}:{col}{b}" for (ws, col, _), pags in zip(objetivos, paginas) for a, b in pags]
+            resp = iter(sheet.values_batch_get(rangos).get("valueRanges", []))
+            for (ws, col, desde), pags in zip(objetivos, paginas):
+                grids = [_rect(next(resp, {}).get("values", [])) for _ in pags]
+                pre.put(ws.title, _leer_filas(ws, col, desde=desde, precargado=(pags, grids)), desde)
+        else:
+            with ThreadPoolExecutor(max_workers=len(objetivos)) as pool:
+                tablas = list(pool.map(lambda o: _leer_filas(o[0], o[1], desde=o[2]), objetivos))
+            for (ws, _, desde), vals in zip(objetivos, tablas):
+                pre.put(ws.title, vals, desde)
+        load_productos_df(); load_pedidos_df(); load_compras_df()
+    finally:
+        pre.clear()
+        pre.hecha = True
+
+def load_productos_df() -> pd.DataFrame:
+    v = versiones()
+    return _productos_con_libro(v.actual(SHEET_TAB_PRODUCTOS), v.actual(SHEET_TAB_MOVIMIENTOS))
+
+def _cola_libro(hasta: int) -> Dict[str, float]:
+    """Movimientos sin compactar por producto; sin conexión, los del espejo del libro."""
+    res = _leer_o_espejo(SHEET_TAB_MOVIMIENTOS, lambda ws: libro_stock().refrescar(get_movimientos_ws(), hasta))
+    if isinstance(res, dict):
+        return res
+    cola: Dict[str, float] = {}
+    for r in res[hasta:]:
+        prod, ml, _ = _movimiento(r)
+        if prod:
+            cola[prod] = cola.get(prod, 0.0) + ml
+    return cola
+
+# ttl largo sólo como red de seguridad: lo normal es que cambie la versión. cache_resource
+# (no cache_data): todas las sesiones reciben el mismo frame, sin copiarlo en cada rerun
+@st.cache_resource(ttl=3600, max_entries=2, show_spinner=False)
+def _load_productos_df(version: int) -> pd.DataFrame:
+    """Productos tal como está en la hoja (stock compactado), sólo por versión de Productos:
+    una venta anexa al libro y no vuelve a leer esta pestaña."""
+    # Hasta E: la fila 1 trae también el puntero del libro de stock (E1)
+    vals = _leer_o_espejo(SHEET_TAB_PRODUCTOS, lambda ws: _leer_tabla(ws[2], "E"))
+    if not vals:
+        df = ESQUEMAS[SHEET_TAB_PRODUCTOS].vacio().reset_index(drop=True)
+        df.attrs["libro_hasta"] = 1
+        return df
+    df = _parsear(SHEET_TAB_PRODUCTOS, vals[1:], 2, vals[0])
+    filas = df.index.tolist()
+    df = df.reset_index(drop=True)
+    # Fila real en la hoja de cada renglón (save_productos_df guarda por diferencia contra esto)
+    df.attrs["filas"] = filas
+    df.attrs["libro_hasta"] = _libro_hasta(vals[0])
+    return df
+
+@st.cache_resource(ttl=3600, max_entries=2, show_spinner=False)
+def _productos_con_libro(version: int, version_libro: int) -> pd.DataFrame:
+    """El frame de _load_productos_df más los movimientos sin compactar: la cola del libro se
+    lee de forma incremental (LibroStock), así que tras una venta sólo se piden sus filas."""
+    base = _load_productos_df(version)
+    cola = _cola_libro(base.attrs.get("libro_hasta", 1))
+    if not cola:
+        return base
+    df = base.copy()
+    df["Stock disponible"] = (df["Stock disponible"] + df["Producto"].map(cola).fillna(0.0)).round(3)
+    return df
+
+# =====================
+# PARSEO CON ESQUEMA (celdas inválidas a la vista, no convertidas a 0 en silencio)
+# =====================
+class ProblemasDatos:
+    """Celdas que el esquema no pudo interpretar, por pestaña, para mostrarlas en la barra lateral.
+
+    Una carga completa reemplaza las de su pestaña; un refresco de cola (sólo filas nuevas)
+    las agrega. Se guardan hasta `maximo` por pestaña, pero se cuentan todas.
+    """
+
+    def __init__(self, maximo: int = 200):
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._por_hoja: Dict[str, Tuple[int, List[Problema]]] = {}
+
+    def registrar(self, hoja: str, problemas: List[Problema], reemplazar: bool = True):
+        with self._lock:
+            n, previos = (0, []) if reemplazar else self._por_hoja.get(hoja, (0, []))
+            self._por_hoja[hoja] = (n + len(problemas), (previos + problemas)[:self.maximo])
+
+    def resumen(self) -> Dict[str, Tuple[int, List[Problema]]]:
+        """{pestaña: (total de celdas con problema, primeras `maximo`)}, sólo las que tienen."""
+        with self._lock:
+            return {h: v for h, v in self._por_hoja.items() if v[0]}
+
+@st.cache_resource(show_spinner=False)
+def problemas_datos() -> ProblemasDatos:
+    return ProblemasDatos()
+
+def celdas_invalidas() -> Dict[str, Tuple[int, List[Problema]]]:
+    return problemas_datos().resumen()
+
+def _parsear(hoja: str, vals: List[List], primera_fila: int, encabezado: Optional[List] = None) -> pd.DataFrame:
+    """Rejilla de `hoja` desde `primera_fila` -> DataFrame tipado según ESQUEMAS (índice = fila real)."""
+    df, problemas = ESQUEMAS[hoja].parsear(vals, primera_fila, encabezado)
+    problemas_datos().registrar(hoja, problemas, reemplazar=primera_fila <= 2)
+    return df
+
+def _concat_compacto(a: pd.DataFrame, b: pd.DataFrame) -> pd.DataFrame:
+    """pd.concat que conserva las categorías (si difieren, pandas las volvería object)."""
+    out = pd.concat([a, b])
+    for c in a.columns:
+        if isinstance(a[c].dtype, pd.CategoricalDtype) and not isinstance(out[c].dtype, pd.CategoricalDtype):
+            out[c] = pd.api.types.union_categoricals([a[c], b[c]], ignore_order=True)
+    return out
+
+def _f64(serie: pd.Series) -> pd.Series:
+    """float32 -> float64 por su repr corto: 16.35 sigue siendo 16.35 (no 16.350000381...)."""
+    return serie.astype(str).astype(float) if serie.dtype == np.float32 else serie.astype(float)
+
+def _pedidos_frame(vals: List[List], first_row: int, headers: Optional[List[str]] = None) -> pd.DataFrame:
+    """Filas crudas de Pedidos (desde `first_row`) -> DataFrame indexado por fila de la hoja.
+
+    El índice es la fila real en la hoja (lo usa PedidosIndex para escrituras parciales).
+    """
+    return _parsear(SHEET_TAB_PEDIDOS, vals, first_row, headers)
+
+class PedidosCache:
+    """Copia local de Pedidos que se refresca sólo con las filas nuevas del final.
+
+    Pedidos casi sólo crece por abajo: en cada refresco se lee desde la última fila ya
+    sincronizada (incluida, como traslape) hasta el final. Si esa fila ya no coincide en
+    A:D (# Pedido, Cliente, Fecha, Producto) la hoja se encogió o alguien la editó a mano, y
+    se recarga completa. Las celdas que cambia pedidos_update_parcial (E, G, H) se parchan
+    aquí mismo. Como red de seguridad se recarga completa cada `full_every` segundos.
+
+    Cada cambio se guarda también como snapshot en disco con su revisión (fila sincronizada, su
+    clave y la huella de la sonda previa a la última lectura): tras reiniciar el proceso se
+    parte de ahí y el primer refresco ya es de cola, sin importar el tamaño del historial. Sólo
+    si la huella actual de Pedidos es la del snapshot: si no (o no se conoce), mientras el
+    proceso dormía alguien escribió y la cola no vería una fila editada, así que se lee completa.
+    `origen` evita usar el snapshot de otra hoja.
+    """
+
+    def __init__(self, full_every: float = 3600, snapshots: Optional[Snapshots] = None, origen: str = ""):
+        self.full_every = full_every
+        self.snapshots = snapshots
+        self.origen = origen
+        self._lock = threading.RLock()
+        self._df: Optional[pd.DataFrame] = None
+        self._headers: List[str] = PEDIDOS_COLS
+        self._synced_row = 0          # última fila leída de la hoja (1 = encabezado)
+        self._last_key: List[str] = []
+        self._full_at = 0.0
+        self._completa = False        # invalidate(): la siguiente lectura no parte de la cola
+        self._huella: Optional[str] = None  # huella de la sonda previa a la última lectura
+
+    @staticmethod
+    def _key(r: List) -> List[str]:
+        return [str(c).strip() for c in (list(r) + [""]*4)[:4]]
+
+    # ---- snapshot en disco ----
+    def _guardar(self):
+        if self.snapshots is not None and self._df is not None:
+            self.snapshots.guardar("pedidos", self._df, {
+                "origen": self.origen, "synced_row": self._synced_row,
+                "last_key": self._last_key, "headers": self._headers, "huella": self._huella,
+            })
+
+    def calentar(self) -> bool:
+        """Sin datos en memoria, toma el snapshot en disco (si es de esta hoja y la hoja no cambió
+        desde entonces). True si quedó listo."""
+        with self._lock:
+            if self._df is not None:
+                return True
+            if self._completa:
+                return False
+            snap = self.snapshots.cargar("pedidos") if self.snapshots is not None else None
+            if snap is None or snap[1].get("origen") != self.origen or int(snap[1].get("synced_row", 0)) < 2:
+                return False
+            huella = snap[1].get("huella")
+            if huella is None or huella != versiones().huella(SHEET_TAB_PEDIDOS, sondear=True):
+                return False
+            df, rev = snap
+            self._huella = huella
+            self._df, self._headers = df, list(rev["headers"])
+            self._synced_row, self._last_key = int(rev["synced_row"]), list(rev["last_key"])
+            # Cuenta como carga completa: el refresco de cola y su traslape validan el snapshot
+            self._full_at = time.time()
+            return True
+
+    def desde_delta(self) -> int:
+        """Primera fila que hay que leer de la hoja: la última sincronizada (traslape) o 1."""
+        with self._lock:
+            self.calentar()
+            return self._synced_row if self._df is not None and self._synced_row >= 2 and not self._completa else 1
+
+    # ---- lecturas ----
+    def _full(self, pedidos_ws):
+        self._huella = versiones().huella(SHEET_TAB_PEDIDOS)
+        vals = _leer_tabla(pedidos_ws, "H")
+        self._full_at, self._completa = time.time(), False
+        if not vals:
+            self._df, self._synced_row, self._last_key = ESQUEMAS[SHEET_TAB_PEDIDOS].vacio(), 0, []
+            return
+        self._headers = (vals[0] + [""]*8)[:8]
+        self._df = _pedidos_frame(vals[1:], 2, self._headers)
+        self._synced_row = len(vals)
+        self._last_key = self._key(vals[-1])
+        self._guardar()
+
+    def refresh(self, pedidos_ws) -> pd.DataFrame:
+        with self._lock:
+            self.calentar()
+            if (self._df is None or self._synced_row < 2 or self._completa
+                    or (time.time() - self._full_at) > self.full_every):
+                self._full(pedidos_ws)
+                return self._df
+            huella = versiones().huella(SHEET_TAB_PEDIDOS)
+            tail = precarga().pop(pedidos_ws.title, desde=self._synced_row)
+            if tail is None:
+                tail = _leer_filas(pedidos_ws, "H", desde=self._synced_row)
+            if not tail or self._key(tail[0]) != self._last_key:
+                self._full(pedidos_ws)
+                return self._df
+            get_espejo().desde_fila(pedidos_ws.title, self._synced_row, tail)
+            nuevos = tail[1:]
+            if huella is not None and huella != self._huella:
+                self._huella = huella
+                if not nuevos:
+                    self._guardar()
+            if nuevos:
+                extra = _pedidos_frame(nuevos, self._synced_row + 1, self._headers)
+                if not extra.empty:
+                    self._df = extra if self._df.empty else _concat_compacto(self._df, extra)
+                self._synced_row += len(nuevos)
+                self._last_key = self._key(nuevos[-1])
+                self._guardar()
+            return self._df
+
+    def patch(self, row: int, valores: Dict[str, object]):
+        """Aplica lo que acabamos de escribir en la fila `row` (columnas E..H).
+
+        Copia y reemplaza el frame en vez de mutarlo: quien ya tiene el anterior no lo ve cambiar.
+        """
+        with self._lock:
+            if self._df is None or row not in self._df.index:
+                return
+            df = self._df.copy()
+            for col, v in valores.items():
+                if isinstance(v, float) and df[col].dtype.kind == "i":
+                    df[col] = df[col].astype(float)
+                if isinstance(df[col].dtype, pd.CategoricalDtype) and v not in df[col].cat.categories:
+                    df[col] = df[col].cat.add_categories([v])
+                df.loc[row, col] = v
+            self._df = df
+            self._guardar()
+
+    def invalidate(self):
+        """La siguiente lectura es completa: ni de la cola ni del snapshot (se editaron filas)."""
+        with self._lock:
+            self._completa = True
+
+@st.cache_resource(show_spinner=False)
+def pedidos_cache() -> PedidosCache:
+    return PedidosCache(snapshots=get_snapshots(), origen=f"{get_backend().name}:{SHEET_URL}")
+
+def load_pedidos_df() -> pd.DataFrame:
+    return _load_pedidos_df(versiones().actual(SHEET_TAB_PEDIDOS))
+
+@st.cache_resource(ttl=3600, max_entries=2, show_spinner=False)
+def _load_pedidos_df(version: int) -> pd.DataFrame:
+    res = _leer_o_espejo(SHEET_TAB_PEDIDOS, lambda ws: pedidos_cache().refresh(ws[3]))
+    if isinstance(res, pd.DataFrame):
+        return res
+    if not res:
+        return ESQUEMAS[SHEET_TAB_PEDIDOS].vacio()
+    # Si se arrancó del snapshot, el espejo puede tener sólo la cola: sin encabezado, el
+    # esquema toma las columnas por posición
+    return _pedidos_frame(res[1:], 2, res[0])
+
+def load_compras_df() -> pd.DataFrame:
+    return _load_compras_df(versiones().actual(SHEET_TAB_COMPRAS))
+
+@st.cache_resource(ttl=3600, max_entries=2, show_spinner=False)
+def _load_compras_df(version: int) -> pd.DataFrame:
+    raw = _leer_o_espejo(SHEET_TAB_COMPRAS, lambda ws: _leer_tabla(ws[5], "K"))
+    if not raw:
+        return ESQUEMAS[SHEET_TAB_COMPRAS].vacio().reset_index(drop=True)
+    return _parsear(SHEET_TAB_COMPRAS, raw[1:], 2, raw[0]).reset_index(drop=True)
+
+# =====================
+# BÚSQUEDA DE PRODUCTOS (selector de Nuevo Pedido)
+# =====================
+BUSQUEDA_MAX_OPCIONES = 50
+
+class BuscadorProductos:
+    """Nombres de Productos indexados para el buscador, armado una vez por versión de Productos.
+
+    La consulta se normaliza (sin acentos ni mayúsculas). El orden es: primero los nombres que
+    empiezan con ella o con una palabra que empieza con ella, luego los que la contienen, y al
+    final los parecidos por trigramas (tolera "suavage" por "sauvage"), del más parecido al
+    menos. datos() da costo y stock de un nombre con un diccionario, sin recorrer el frame.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.nombres: List[str] = df["Producto"].astype(str).tolist()
+        self._norm = [normalizar(n) for n in self.nombres]
+        self._indice = IndiceNgramas(self._norm)
+        self._datos: Dict[str, Tuple[float, float]] = {}
+        for n, c, s in zip(self.nombres, df["Costo x ml"], df["Stock disponible"]):
+            # Si un nombre se repite gana el primero, igual que .iloc[0] sobre el frame
+            self._datos.setdefault(n, (float(c), float(s)))
+
+    def buscar(self, consulta: str, limite: int = BUSQUEDA_MAX_OPCIONES) -> Tuple[List[str], int]:
+        """(hasta `limite` nombres en orden de relevancia, total de coincidencias)."""
+        q = normalizar(consulta or "")
+        if not q:
+            return self.nombres[:limite], len(self.nombres)
+        contiene = self._indice.buscar(q)
+        similares, puntaje = self._indice.similares(q)
+        puntos = dict(zip(similares.tolist(), puntaje.tolist()))
+        for i in contiene.tolist():
+            t = self._norm[i]
+            puntos[i] = 3.0 if t.startswith(q) else 2.0 if f" {q}" in t else 1.0 + puntos.get(i, 0.0) / 10
+        orden = sorted(puntos, key=lambda i: (-puntos[i], len(self._norm[i]), i))
+        return [self.nombres[i] for i in orden[:limite]], len(orden)
+
+    def datos(self, nombre: str) -> Optional[Tuple[float, float]]:
+        """(costo x ml, stock disponible) del producto, o None si no existe."""
+        return self._datos.get(nombre)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _buscador_productos(version: int, version_libro: int) -> BuscadorProductos:
+    return BuscadorProductos(load_productos_df())
+
+def buscador_productos() -> BuscadorProductos:
+    v = versiones()
+    return _buscador_productos(v.actual(SHEET_TAB_PRODUCTOS), v.actual(SHEET_TAB_MOVIMIENTOS))
+
+# =====================
+# HISTORIAL (consulta paginada)
+# =====================
+HISTORIAL_POR_PAGINA = 25
+
+class HistorialVista:
+    """Pedidos preparados para el historial, armados una vez por versión de Pedidos y compartidos.
+
+    Fecha llega ya como datetime64 (esquema de Pedidos) y los renglones se ordenan por fecha
+    descendente, luego # Pedido descendente y fila: un rango de fechas es un tramo que se
+    encuentra con búsqueda binaria. Los clientes se guardan como
+    código de su nombre normalizado (sin acentos ni mayúsculas) y el filtro por cliente busca
+    en un índice de trigramas sobre los nombres distintos y el de estatus compara códigos de
+    categoría. Los últimos filtros se recuerdan, así el autorefresco o cambiar de página no
+    vuelven a filtrar.
+    """
+
+    def __init__(self, df: pd.DataFrame, recordar: int = 16):
+        ids = pd.to_numeric(df["# Pedido"], errors="coerce").fillna(0).astype(np.int64).to_numpy()
+        ns = df["Fecha"].to_numpy("datetime64[ns]").view(np.int64)
+        # Clave ascendente = fecha descendente; sin fecha válida (NaT) al final
+        fkey = np.where(ns == np.iinfo(np.int64).min, np.iinfo(np.int64).max, -ns)
+        orden = np.lexsort((df.index.to_numpy(), -ids, fkey))
+        self._df = df.iloc[orden]
+        self._fkey = fkey[orden]
+        self._ids = ids[orden]
+        # Cada nombre distinto se normaliza una vez; "José" y "jose" quedan con el mismo código
+        cod_c, crudos = pd.factorize(df["Nombre Cliente"], use_na_sentinel=False)
+        cod_n, nombres = pd.factorize(np.array([normalizar(c) for c in crudos], dtype=object), use_na_sentinel=False)
+        self._cod_cli = cod_n[cod_c][orden]
+        self._clientes = IndiceNgramas(list(nombres))
+        self._totales = pd.to_numeric(self._df["Total"], errors="coerce").fillna(0.0).to_numpy()
+        estatus = pd.Categorical(self._df["Estatus"].astype(str))
+        self._cod_est = estatus.codes
+        self.estatus: List[str] = list(estatus.categories)
+        # Para encontrar un pedido por # sin recorrer la vista
+        self._por_id = np.argsort(self._ids, kind="stable")
+        self._ids_ord = self._ids[self._por_id]
+        self._filas = self._df.index.to_numpy()
+        self._lock = threading.Lock()
+        self._filtros: "OrderedDict[Tuple, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._recordar = recordar
+
+    def _tramo(self, desde: date, hasta: date) -> Tuple[int, int]:
+        """[lo, hi) de los renglones con desde <= Fecha <= hasta."""
+        lo = np.searchsorted(self._fkey, -pd.Timestamp(hasta).value, "left")
+        hi = np.searchsorted(self._fkey, -pd.Timestamp(desde).value, "right")
+        return int(lo), int(hi)
+
+    def filtrar(self, cliente: str, desde: date, hasta: date,
+                estatus: Sequence[str] = ()) -> Tuple[np.ndarray, np.ndarray]:
+        """(posiciones de los renglones que pasan el filtro, # Pedido únicos en orden de la vista).
+
+        `estatus` vacío = todos.
+        """
+        clave = (normalizar(cliente or ""), desde, hasta, tuple(sorted(estatus or ())))
+        with self._lock:
+            if clave in self._filtros:
+                self._filtros.move_to_end(clave)
+                return self._filtros[clave]
+        lo, hi = self._tramo(desde, hasta)
+        if clave[0]:
+            pos = lo + np.flatnonzero(np.isin(self._cod_cli[lo:hi], self._clientes.buscar(clave[0])))
+        else:
+            pos = np.arange(lo, hi)
+        if clave[3]:
+            codigos = [self.estatus.index(e) for e in clave[3] if e in self.estatus]
+            pos = pos[np.isin(self._cod_est[pos], codigos)]
+        res = (pos, pd.unique(self._ids[pos]))
+        with self._lock:
+            self._filtros[clave] = res
+            if len(self._filtros) > self._recordar:
+                self._filtros.popitem(last=False)
+        return res
+
+    def pagina(self, cliente: str, desde: date, hasta: date, pagina: int, por_pagina: int,
+               estatus: Sequence[str] = ()) -> Dict[str, object]:
+        pos, ids = self.filtrar(cliente, desde, hasta, estatus)
+        paginas = max(1, -(-len(ids) // por_pagina))
+        pagina = min(max(1, int(pagina)), paginas)
+        ids_pag = ids[(pagina - 1) * por_pagina:pagina * por_pagina]
+        filas = self._df.iloc[pos[np.isin(self._ids[pos], ids_pag)]]
+        return {
+            "filas": filas, "ids": [int(i) for i in ids_pag], "pagina": pagina, "paginas": paginas,
+            "pedidos": len(ids), "renglones": len(pos), "total": float(self._totales[pos].sum()),
+        }
+
+    def _renglones(self, pedido_id: int) -> np.ndarray:
+        """Posiciones en la vista de todos los renglones de un pedido, en el orden de la hoja."""
+        lo = np.searchsorted(self._ids_ord, int(pedido_id), "left")
+        hi = np.searchsorted(self._ids_ord, int(pedido_id), "right")
+        r = self._por_id[lo:hi]
+        return r[np.argsort(self._filas[r], kind="stable")]
+
+    def pedido(self, pedido_id: int) -> pd.DataFrame:
+        """Todos los renglones de un pedido (sin filtros), en el orden de la hoja.
+
+        Es un frame aparte y con tipos de trabajo (texto y float64), listo para editarse.
+        """
+        df = self._df.iloc[self._renglones(pedido_id)]
+        for c in df.columns:
+            if isinstance(df[c].dtype, pd.CategoricalDtype):
+                df[c] = df[c].astype(str)
+        for c in ["Mililitros", "Costo x ml", "Total"]:
+            df[c] = _f64(df[c])
+        df["# Pedido"] = df["# Pedido"].astype(int)
+        return df
+
+    def pedidos_pdf(self, cliente: str, desde: date, hasta: date, estatus: Sequence[str] = (),
+                    bloque: int = 256) -> Tuple[int, Iterator[Tuple]]:
+        """(número de pedidos, generador de (# Pedido, cliente, fecha, estatus, productos)) de
+        todo el filtro, para exportar PDFs. Cada pedido lleva todos sus renglones y los mismos
+        datos que el PDF individual (cliente y fecha del primero, estatus del último). Se
+        convierten por bloques de pedidos, no todo el historial de golpe.
+        """
+        _, ids = self.filtrar(cliente, desde, hasta, estatus)
+
+        def generar():
+            for b in range(0, len(ids), bloque):
+                ids_b = ids[b:b + bloque]
+                tramos = [self._renglones(pid) for pid in ids_b]
+                df = self._df.iloc[np.concatenate(tramos)]
+                clientes = df["Nombre Cliente"].astype(str).to_numpy()
+                fechas = df["Fecha"].dt.strftime("%Y-%m-%d").fillna("").to_numpy()
+                estatus_ = df["Estatus"].astype(str).to_numpy()
+                productos = df["Producto"].astype(str).to_numpy()
+                ml, costo, total = (_f64(df[c]).to_numpy() for c in ["Mililitros", "Costo x ml", "Total"])
+                i = 0
+                for pid, t in zip(ids_b, tramos):
+                    j = i + len(t)
+                    yield (int(pid), clientes[i], fechas[i], estatus_[j - 1],
+                           [(productos[k], float(ml[k]), float(costo[k]), float(total[k])) for k in range(i, j)])
+                    i = j
+
+        return len(ids), generar()
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _historial_vista(version: int) -> HistorialVista:
+    return HistorialVista(load_pedidos_df())
+
+def historial_pagina(cliente: str, desde: date, hasta: date, pagina: int = 1,
+                     por_pagina: int = HISTORIAL_POR_PAGINA, estatus: Sequence[str] = ()) -> Dict[str, object]:
+    """Una página del historial filtrado: sus renglones, sus # Pedido y los totales del filtro completo."""
+    vista = _historial_vista(versiones().actual(SHEET_TAB_PEDIDOS))
+    return vista.pagina(cliente, desde, hasta, pagina, por_pagina, estatus)
+
+def historial_pedido(pedido_id: int) -> pd.DataFrame:
+    return _historial_vista(versiones().actual(SHEET_TAB_PEDIDOS)).pedido(pedido_id)
+
+def historial_estatus() -> List[str]:
+    """Estatus presentes en Pedidos (para el filtro del historial)."""
+    return _historial_vista(versiones().actual(SHEET_TAB_PEDIDOS)).estatus
+
+def historial_pedidos_pdf(cliente: str, desde: date, hasta: date,
+                          estatus: Sequence[str] = ()) -> Tuple[int, Iterator[Tuple]]:
+    """Los pedidos del filtro del historial listos para pdfs.exportar_zip / exportar_pdf_unico."""
+    return _historial_vista(versiones().actual(SHEET_TAB_PEDIDOS)).pedidos_pdf(cliente, desde, hasta, estatus)
+
+# =====================
+# GUARDADOS (con manejo NotConnected)
+# =====================
+def _diferir(tipo: str, hoja: str, fila: List):
+    """Sin conexión: la fila queda en el espejo (visible ya) y en la bandeja hasta que vuelva Sheets."""
+    get_espejo().anexar_local(hoja, [fila])
+    get_outbox().encolar(None, {tipo: fila}, offline=True)
+
+def _producto(r) -> Tuple[str, float, float]:
+    """Renglón de Productos normalizado para comparar: (nombre, costo x ml, stock)."""
+    r = (list(r) + ["", "", ""])[:3]
+    num = lambda v: 0.0 if v is None or pd.isna(v) else round(_to_float(v), 3)
+    return str(r[0] if r[0] is not None else "").strip(), num(r[1]), num(r[2])
+
+def save_productos_df(df: pd.DataFrame, original: Optional[pd.DataFrame] = None) -> Optional[Dict[str, object]]:
+    """Guarda la tabla editada mandando sólo la diferencia contra `original` (lo que se cargó en
+    el editor; por defecto load_productos_df()) en un solo batch_update:
+      - celdas cambiadas en su fila,
+      - filas nuevas al final,
+      - si se borraron filas, el tramo desde la primera borrada hasta el final, recorrido.
+    Antes relee sólo esas filas: si ya no son los mismos productos (otra sesión movió la hoja)
+    no escribe nada. El stock no se escribe en Productos: cada cambio de stock es un movimiento
+    "ajuste" en el libro, salvo que el stock haya cambiado en la hoja mientras se editaba
+    (entonces se deja como está y se reporta). Las altas llevan su stock inicial en la fila.
+
+    Devuelve {"celdas", "altas", "bajas", "ajustes", "conflictos"} o None si no se guardó.
+    """
+    try:
+        _, sheet, productos_ws, *_ = get_ws()
+    except SinConexion:
+        st.error("Sin conexión con Google Sheets: los cambios a Productos no se guardaron; intenta cuando vuelva.")
+        return None
+    except NotConnected:
+        st.error("Conéctate a Google Sheets para guardar Productos.")
+        return None
+    if original is None:
+        original = load_productos_df()
+    filas = original.attrs.get("filas") or list(range(2, len(original) + 2))
+    fila_de = dict(zip(original.index, filas))
+    antes = {f: _producto(r) for f, r in zip(filas, original[PRODUCTOS_COLS].values.tolist())}
+    editadas = [(k, _producto(r)) for k, r in zip(df.index, df[PRODUCTOS_COLS].values.tolist())]
+    despues = {fila_de[k]: r for k, r in editadas if k in fila_de and r[0]}
+    altas = [r for k, r in editadas if k not in fila_de and r[0]]
+    bajas = sorted(f for f in antes if f not in despues)
+    ultima = max(filas, default=1)
+    # Desde r0 se reescribe todo (recorrido si hubo bajas; si no, sólo las altas al final)
+    r0 = bajas[0] if bajas else ultima + 1
+    fin = max(ultima, r0 + len(altas) - 1)
+    sueltas = [f for f in sorted(despues) if f < r0 and despues[f] != antes[f]]
+    if not sueltas and r0 > fin:
+        return {"celdas": 0, "altas": 0, "bajas": 0, "ajustes": 0, "conflictos": []}
+    con_stock = [despues[f][0] for f in despues if despues[f][2] != antes[f][2]]
+    with _candados_stock.tomar(con_stock):
+        return _guardar_productos(sheet, productos_ws, antes, despues, altas, bajas, sueltas, r0, fin)
+
+def _guardar_productos(sheet, productos_ws, antes, despues, altas, bajas, sueltas, r0, fin):
+    if not bajas:
+        return _reescribir_productos(sheet, productos_ws, antes, despues, altas, bajas, sueltas, r0, fin)
+    # Con bajas el tramo sube las filas de abajo y reescribe también su stock (C): mientras
+    # tanto no compacta nadie, ni este proceso ni otro (la misma marca en F1 que compactar_libro)
+    if not _compactando.acquire(timeout=_LIBRO_LEASE_S):
+        st.error("El libro de stock se está compactando; no se guardó nada, inténtalo de nuevo.")
+        return None
+    try:
+        if not _marcar_libro(productos_ws, ((productos_ws.get_values("F1") or [[]])[0] + [""])[0]):
+            st.error("Otra sesión está compactando el libro de stock; no se guardó nada, "
+                     "inténtalo en un momento.")
+            return None
+        try:
+            return _reescribir_productos(sheet, productos_ws, antes, despues, altas, bajas, sueltas, r0, fin)
+        finally:
+            productos_ws.update([[""]], "F1")
+    finally:
+        _compactando.release()
+
+def _reescribir_productos(sheet, productos_ws, antes, despues, altas, bajas, sueltas, r0, fin):
+    titulo = productos_ws.title
+    rangos = [f"'{titulo}'!D1:E1"] + [f"'{titulo}'!A{f}:C{f}" for f in sueltas]
+    rangos += [f"'{titulo}'!A{r0}:C{fin}"] if r0 <= fin else []
+    resp = sheet.values_batch_get(rangos).get("valueRanges", [])
+    hasta = _libro_hasta([""] * 3 + ((resp[0].get("values") or [[]])[0] if resp else []))
+    resp = resp[1:]
+    hoja: Dict[int, Tuple[str, float, float]] = {}
+    for f, vr in zip(sueltas, resp):
+        hoja[f] = _producto((vr.get("values") or [[]])[0])
+    if r0 <= fin:
+        tramo = (resp[len(sueltas)] if len(resp) > len(sueltas) else {}).get("values", [])
+        for i in range(fin - r0 + 1):
+            hoja[r0 + i] = _producto(tramo[i] if i < len(tramo) else [])
+    movida = [f for f in hoja if hoja[f][0] != (antes[f][0] if f in antes else "")]
+    if movida:
+        st.error("Productos cambió en la hoja mientras editabas (otra sesión agregó o movió filas). "
+                 "No se guardó nada: recarga e inténtalo de nuevo.")
+        versiones().bump(SHEET_TAB_PRODUCTOS)
+        return None
+
+    cola = libro_stock().refrescar(get_movimientos_ws(), hasta)
+    conflictos: List[str] = []
+    ajustes: List[Tuple[str, float, str, object]] = []
+    def fusionar(f: int) -> Tuple[str, float, float]:
+        # La celda de stock queda como está en la hoja; lo editado va al libro como ajuste
+        nombre, costo, stk = despues[f]
+        if stk != antes[f][2]:
+            vivo = round(hoja[f][2] + cola.get(nombre, 0.0), 3)
+            if vivo == antes[f][2]:
+                ajustes.append((nombre, stk - vivo, "ajuste", titulo))
+            else:
+                conflictos.append(f"{nombre}: el stock pasó de {antes[f][2]:g} a {vivo:g} mientras "
+                                  f"editabas; se dejó {vivo:g} en vez de {stk:g}.")
+        return nombre, costo, hoja[f][2]
+
+    data, celdas = [], {}
+    for f in sueltas:
+        nuevo = fusionar(f)
+        for c, (v, previo) in enumerate(zip(nuevo, hoja[f])):
+            if v != previo:
+                data.append({"range": f"{'ABC'[c]}{f}", "values": [[v]]})
+                celdas.setdefault(f, {})[c] = v
+    tramo = []
+    if r0 <= fin:
+        tramo = [list(fusionar(f)) for f in sorted(despues) if f >= r0] + [list(r) for r in altas]
+        tramo += [["", "", ""]] * (fin - r0 + 1 - len(tramo))
+        data.append({"range": f"A{r0}:C{fin}", "values": tramo})
+    if data:
+        productos_ws.batch_update(data, value_input_option="RAW")
+        get_espejo().celdas(titulo, celdas)
+        if tramo:
+            get_espejo().desde_fila(titulo, r0, tramo)
+            conteo_filas().registrar(productos_ws, fin)
+        productos_index().invalidate()
+        versiones().bump(SHEET_TAB_PRODUCTOS)
+    _anotar_movimientos(ajustes)
+    return {"celdas": sum(len(c) for c in celdas.values()), "altas": len(altas), "bajas": len(bajas),
+            "ajustes": len(ajustes), "conflictos": conflictos}
+
+def append_envio_row(data: List):
+    try:
+        _, _, _, _, envios_ws, _ = get_ws()
+    except NotConnected:
+        st.error("Conéctate a Google Sheets para guardar el envío.")
+        return
+    resp = envios_ws.append_row(data)
+    get_espejo().desde_fila(envios_ws.title, _appended_row(resp), [data])
+
+def append_compra_row(row: List[str]):
+    try:
+        _, _, _, _, _, compras_ws = get_ws()
+        resp = compras_ws.append_row(row, value_input_option="USER_ENTERED")
+    except SinConexion:
+        _diferir("compra", SHEET_TAB_COMPRAS, row)
+        versiones().bump(SHEET_TAB_COMPRAS)
+        return
+    except NotConnected:
+        st.error("Conéctate a Google Sheets para guardar la compra.")
+        return
+    except Exception as e:
+        if not _falla_de_red(e):
+            raise
+        estado_red().marcar_error(e)
+        _diferir("compra", SHEET_TAB_COMPRAS, row)
+        versiones().bump(SHEET_TAB_COMPRAS)
+        return
+    conteo_filas().registrar(compras_ws, _appended_row(resp))
+    get_espejo().desde_fila(compras_ws.title, _appended_row(resp), [row])
+    versiones().bump(SHEET_TAB_COMPRAS)
+
+def productos_append_row(nombre: str, costo_ml: float = 0.0, stock: float = 0.0):
+    fila = [nombre, float(costo_ml), float(stock)]
+    try:
+        _, _, productos_ws, *_ = get_ws()
+        resp = productos_ws.append_row(fila, value_input_option="USER_ENTERED")
+    except SinConexion:
+        _diferir("producto", SHEET_TAB_PRODUCTOS, fila)
+        versiones().bump(SHEET_TAB_PRODUCTOS)
+        return
+    except NotConnected:
+        st.error("Conéctate a Google Sheets para agregar productos.")
+        return
+    except Exception as e:
+        if not _falla_de_red(e):
+            raise
+        estado_red().marcar_error(e)
+        _diferir("producto", SHEET_TAB_PRODUCTOS, fila)
+        versiones().bump(SHEET_TAB_PRODUCTOS)
+        return
+    conteo_filas().registrar(productos_ws, _appended_row(resp))
+    get_espejo().desde_fila(productos_ws.title, _appended_row(resp), [[nombre, float(costo_ml), float(stock)]])
+    productos_index().add(nombre, float(costo_ml), float(stock), _appended_row(resp))
+    versiones().bump(SHEET_TAB_PRODUCTOS)
+
+# =====================
+# HELPERS GSHEETS (parciales)
+# =====================
+def _to_float(v) -> float:
+    try:
+        return float(v) if str(v).strip() else 0.0
+    except Exception:
+        return 0.0
+
+def _appended_row(resp) -> Optional[int]:
+    """Primera fila escrita según la respuesta de append_row(s) ('Tab!A12:C14' -> 12)."""
+    try:
+        return a1_bounds(resp["updates"]["updatedRange"])[0]
+    except Exception:
+        return None
+
+class ProductosIndex:
+    """Índice nombre -> (fila, costo x ml, stock) de Productos, compartido entre sesiones.
+
+    Se construye con una sola lectura (A:C) y después se mantiene en sitio con nuestras propias
+    escrituras (alta, ajuste de stock, guardado completo). Sólo se reconstruye si detecta un
+    cambio externo: un producto que no conoce, un append que no cae en la fila esperada, o si
+    pasa `ttl` segundos sin reconstruirse (red de seguridad para ediciones a mano en la hoja).
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._mapa: Optional[Dict[str, Tuple[int, float, float]]] = None
+        self._last_row = 1
+        self._built_at = 0.0
+
+    def _build(self, productos_ws):
+        vals = _leer_filas(productos_ws, "C", desde=2)
+        mapa = {}
+        for i, r in enumerate(vals):
+            nom = (r[0] if r else "").strip()
+            if not nom:
+                continue
+            costo = _to_float(r[1]) if len(r) > 1 else 0.0
+            stk   = _to_float(r[2]) if len(r) > 2 else 0.0
+            mapa[nom] = (i+2, costo, stk)  # +2 por header
+        self._mapa = mapa
+        self._last_row = len(vals) + 1
+        self._built_at = time.time()
+
+    def get(self, refresh_missing: Optional[str] = None, productos_ws=None) -> Dict[str, Tuple[int, float, float]]:
+        """Mapa actual; reconstruye si está vencido o si `refresh_missing` no aparece en él."""
+        if productos_ws is None:
+            _, _, productos_ws, *_ = get_ws()
+        with self._lock:
+            vencido = self._mapa is None or (time.time() - self._built_at) > self.ttl
+            if vencido or (refresh_missing and refresh_missing not in self._mapa):
+                self._build(productos_ws)
+            return self._mapa
+
+    def invalidate(self):
+        with self._lock:
+            self._mapa = None
+
+    def set_stock(self, nuevos: Dict[str, float]):
+        with self._lock:
+            if self._mapa is None:
+                return
+            for prod, stk in nuevos.items():
+                if prod in self._mapa:
+                    row, costo, _ = self._mapa[prod]
+                    self._mapa[prod] = (row, costo, float(stk))
+
+    def add(self, nombre: str, costo: float, stock: float, row: Optional[int]):
+        with self._lock:
+            if self._mapa is None:
+                return
+            if row is None or row != self._last_row + 1:
+                # Alguien más agregó filas: ya no sabemos dónde está cada producto
+                self._mapa = None
+                return
+            self._mapa[nombre] = (row, float(costo), float(stock))
+            self._last_row = row
+
+    def replace(self, df: pd.DataFrame):
+        """Tras reescribir la hoja completa desde `df` (filas 2..n+1 en el mismo orden)."""
+        with self._lock:
+            mapa = {}
+            for i, (nom, costo, stk) in enumerate(df[["Producto","Costo x ml","Stock disponible"]].values.tolist()):
+                nom = str(nom if nom is not None else "").strip()
+                if nom:
+                    mapa[nom] = (i+2, _to_float(costo), _to_float(stk))
+            self._mapa = mapa
+            self._last_row = len(df) + 1
+            self._built_at = time.time()
+
+@st.cache_resource(show_spinner=False)
+def productos_index() -> ProductosIndex:
+    return ProductosIndex()
+
+def _productos_index_map(refresh_missing: Optional[str] = None):
+    try:
+        return productos_index().get(refresh_missing)
+    except NotConnected:
+        return {}
+
+def productos_update_stock(nombre: str, nuevo_stock: float):
+    """Fija el stock de un producto: anota en el libro la diferencia contra el stock actual."""
+    try:
+        _, _, productos_ws, *_ = get_ws()
+        with _candados_stock.tomar([nombre]):
+            actual, faltantes = _stock_fresco(productos_ws, [nombre])
+            if faltantes:
+                st.warning(f"'{nombre}' no existe en Productos.")
+                return
+            delta = round(max(0.0, float(nuevo_stock)) - actual[nombre][1], 3)
+            _anotar_movimientos([(nombre, delta, "ajuste", SHEET_TAB_PRODUCTOS)])
+    except NotConnected:
+        return
+    except Exception as e:
+        st.warning(f"No se pudo actualizar stock de '{nombre}': {e}")
+
+# =====================
+# LIBRO DE MOVIMIENTOS DE STOCK
+# =====================
+# Stock de un producto = columna C de Productos (foto compactada hasta la fila E1 del libro)
+# + la suma de los movimientos posteriores de la pestaña Movimientos. Ventas, ediciones,
+# compras y ajustes sólo anexan filas (sin pelear por la misma celda); compactar_libro()
+# pasa de vez en cuando lo acumulado a Productos con una sola escritura.
+def _libro_hasta(encabezado: List) -> int:
+    """Última fila del libro ya sumada a Productos (Productos!E1; 1 = sólo el encabezado)."""
+    try:
+        return max(1, int(float((list(encabezado) + [""] * 5)[4] or 1)))
+    except (TypeError, ValueError):
+        return 1
+
+def _movimiento(r: List) -> Tuple[str, float, str]:
+    """Fila del libro -> (producto, ml, lote)."""
+    r = (list(r) + [""] * 6)[:6]
+    return str(r[1]).strip(), _to_float(r[2]), str(r[5])
+
+class LibroStock:
+    """Suma por producto de los movimientos aún no compactados (filas hasta+1 .. final).
+
+    Se lee de forma incremental: cada refresco pide sólo las filas que se anexaron desde el
+    anterior. Si cambia el puntero de compactación (compactamos nosotros u otro proceso) se
+    arma de nuevo desde ahí. Guarda también (producto, ml) de cada fila de la cola para sumar
+    sólo hasta una fila (la verificación de una reserva, ver _reservar_stock).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._hasta: Optional[int] = None
+        self._leida = 1
+        self._cola: Dict[str, float] = {}
+        self._filas: List[Tuple[str, float]] = []
+        self._lotes: set = set()
+
+    def _sumar(self, filas: List[List]):
+        for r in filas:
+            prod, ml, lote = _movimiento(r)
+            self._filas.append((prod, ml))
+            if prod:
+                self._cola[prod] = round(self._cola.get(prod, 0.0) + ml, 3)
+            if lote:
+                self._lotes.add(lote)
+
+    def refrescar(self, movimientos_ws, hasta: int, hasta_fila: Optional[int] = None) -> Dict[str, float]:
+        """Cola por producto; con `hasta_fila`, sólo los movimientos hasta esa fila del libro."""
+        with self._lock:
+            if self._hasta != hasta:
+                self._hasta, self._leida, self._cola, self._filas, self._lotes = hasta, hasta, {}, [], set()
+            # Nuestras propias filas ya las sumó anotar(): verificar hasta ellas no relee el libro
+            ya = hasta_fila is not None and hasta_fila <= self._leida
+            nuevas = [] if ya else _sin_vacias_al_final(_leer_filas(movimientos_ws, "F", desde=self._leida + 1))
+            if nuevas:
+                get_espejo().desde_fila(movimientos_ws.title, self._leida + 1, nuevas)
+                self._sumar(nuevas)
+                self._leida += len(nuevas)
+            if hasta_fila is None or hasta_fila >= self._leida:
+                return dict(self._cola)
+            cola: Dict[str, float] = {}
+            for prod, ml in self._filas[:max(0, hasta_fila - hasta)]:
+                if prod:
+                    cola[prod] = round(cola.get(prod, 0.0) + ml, 3)
+            return cola
+
+    def anotar(self, primera: Optional[int], filas: List[List]):
+        """Tras anexar nosotros: si cayeron justo después de lo leído se suman sin releer."""
+        with self._lock:
+            if primera is not None and primera == self._leida + 1:
+                self._sumar(filas)
+                self._leida += len(filas)
+
+    def lotes(self) -> set:
+        """Lotes de los movimientos sin compactar."""
+        with self._lock:
+            return set(self._lotes)
+
+    def sin_compactar(self) -> int:
+        with self._lock:
+            return self._leida - (self._hasta or 1)
+
+@st.cache_resource(show_spinner=False)
+def libro_stock() -> LibroStock:
+    return LibroStock()
+
+@st.cache_resource(show_spinner=False)
+def get_movimientos_ws():
+    """Pestaña Movimientos (libro de stock); get_client_and_ws ya la creó."""
+    _, sheet, *_ = get_client_and_ws()
+    return _get_or_create_ws(sheet, SHEET_TAB_MOVIMIENTOS, rows=1000, cols=len(MOVIMIENTOS_COLS))
+
+def _anotar_movimientos(movs: List[Tuple], lote: str = "") -> Tuple[Optional[int], int]:
+    """Anexa al libro [(producto, ml, tipo, referencia[, lote])] (ml negativo = salida) en un
+    solo append. `tipo`: venta, edicion, compra, ajuste o anulacion; el lote de cada
+    movimiento, o `lote` si no trae. Devuelve (primera fila escrita o None, cuántos se anotaron)."""
+    fecha = datetime.now().isoformat(timespec="seconds")
+    filas = [[fecha, m[0], round(float(m[1]), 3), m[2], "" if m[3] is None else m[3], m[4] if len(m) > 4 else lote]
+             for m in movs if float(m[1]) != 0.0]
+    if not filas:
+        return None, 0
+    movimientos_ws = get_movimientos_ws()
+    resp = movimientos_ws.append_rows(filas, value_input_option="RAW")
+    primera = _appended_row(resp)
+    conteo_filas().registrar(movimientos_ws, primera and primera + len(filas) - 1)
+    get_espejo().desde_fila(movimientos_ws.title, primera, filas)
+    libro_stock().anotar(primera, filas)
+    versiones().bump(SHEET_TAB_MOVIMIENTOS)
+    return primera, len(filas)
+
+# Movimientos sin compactar a partir de los cuales el hilo de la bandeja compacta
+LIBRO_COMPACTAR_CADA = 500
+# Una compactación de otro proceso se respeta este tiempo antes de darla por abandonada
+_LIBRO_LEASE_S = 120
+_compactando = threading.Lock()
+
+def _lotes_en_libro() -> set:
+    """Lotes de todo el libro, también los ya compactados (compactar no borra filas): una
+    lectura de la columna F."""
+    return {str(v) for v in get_movimientos_ws().col_values(6)[1:] if v}
+
+def _marcar_libro(productos_ws, previa) -> bool:
+    """Deja nuestra marca en Productos!F1 y la verifica, salvo que `previa` (lo que había en
+    F1) sea la de otro proceso todavía vigente. Mientras esté, sólo quien la puso reescribe la
+    columna de stock; se suelta dejando F1 vacío."""
+    marca_previa, _, desde_ts = str(previa).partition("|")
+    if marca_previa and time.time() - _to_float(desde_ts) < _LIBRO_LEASE_S:
+        return False
+    marca = f"{uuid.uuid4().hex[:12]}|{time.time():.0f}"
+    productos_ws.update([[marca]], "F1")
+    return (productos_ws.get_values("F1") or [[""]])[0][0] == marca
+
+def compactar_libro() -> int:
+    """Suma a Productos!C los movimientos sin compactar y mueve el puntero E1, todo en un solo
+    batch_update (Sheets lo aplica completo o nada). Devuelve cuántos movimientos se compactaron.
+
+    Dos procesos no compactan a la vez: quien empieza deja su marca en F1 y la verifica
+    (_marcar_libro). Los movimientos de productos que ya no están en
+    Productos se registran como conflicto de stock.
+    """
+    if not _compactando.acquire(blocking=False):
+        return 0
+    try:
+        _, _, productos_ws, *_ = get_client_and_ws()
+        movimientos_ws = get_movimientos_ws()
+        vals = _leer_filas(productos_ws, "F")
+        encabezado = (list(vals[0]) if vals else []) + [""] * 6
+        hasta = _libro_hasta(encabezado)
+        if not _marcar_libro(productos_ws, encabezado[5]):
+            return 0
+        cola = _sin_vacias_al_final(_leer_filas(movimientos_ws, "F", desde=hasta + 1))
+        sumas: Dict[str, float] = {}
+        pedidos_por_prod: Dict[str, List] = {}
+        for r in cola:
+            prod, ml, _ = _movimiento(r)
+            if prod:
+                sumas[prod] = sumas.get(prod, 0.0) + ml
+                pedidos_por_prod.setdefault(prod, []).append((list(r) + [""] * 5)[4])
+        filas = {str(r[0]).strip(): (i + 1, _to_float((list(r) + [""] * 3)[2]))
+                 for i, r in enumerate(vals) if i and r and str(r[0]).strip()}
+        nuevos = {p: round(filas[p][1] + s, 3) for p, s in sumas.items() if p in filas}
+        data = [{"range": f"C{filas[p][0]}", "values": [[v]]} for p, v in nuevos.items()]
+        data.append({"range": "D1:F1", "values": [["Libro hasta", hasta + len(cola), ""]]})
+        productos_ws.batch_update(data, value_input_option="RAW")
+
+        get_espejo().celdas(productos_ws.title, {filas[p][0]: {2: v} for p, v in nuevos.items()})
+        get_espejo().celdas(productos_ws.title, {1: {3: "Libro hasta", 4: hasta + len(cola), 5: ""}})
+        productos_index().set_stock(nuevos)
+        huerfanos = [p for p in sumas if p not in filas]
+        if huerfanos:
+            get_outbox().registrar_conflictos([
+                {"producto": p, "pedidos": [x for x in pedidos_por_prod[p] if str(x).isdigit()] or None,
+                 "detalle": f"Movimientos por {sumas[p]:g} ml de un producto que ya no está en Productos."}
+                for p in huerfanos
+            ])
+        versiones().bump(SHEET_TAB_PRODUCTOS)
+        return len(cola)
+    finally:
+        _compactando.release()
+
+def stock_en(momento: datetime) -> Dict[str, float]:
+    """Stock de cada producto en `momento`, reconstruido del libro: el stock actual menos los
+    movimientos posteriores. (Lo que se cambió a mano en Productos sin pasar por la app no
+    está en el libro.)"""
+    _, _, productos_ws, *_ = get_ws()
+    vals = _leer_filas(productos_ws, "E")
+    hasta = _libro_hasta(vals[0]) if vals else 1
+    stock = {str(r[0]).strip(): _to_float((list(r) + [""] * 3)[2]) for r in vals[1:] if r and str(r[0]).strip()}
+    corte = momento.isoformat(timespec="seconds")
+    for i, r in enumerate(_sin_vacias_al_final(_leer_filas(get_movimientos_ws(), "F", desde=2))):
+        prod, ml, _ = _movimiento(r)
+        if not prod:
+            continue
+        if i + 2 > hasta:
+            stock[prod] = stock.get(prod, 0.0) + ml
+        if str(r[0]) > corte:
+            stock[prod] = stock.get(prod, 0.0) - ml
+    return {p: round(v, 3) for p, v in stock.items()}
+
+# =====================
+# RESERVA DE STOCK (candado por producto + reserva verificada en el libro)
+# =====================
+class StockInsuficiente(ValueError):
+    """El carrito pide más de lo que hay: {producto: ml disponibles}."""
+
+    def __init__(self, faltantes: Dict[str, float]):
+        self.faltantes = faltantes
+        super().__init__("; ".join(f"{p}: disponible {v:g} ml" for p, v in faltantes.items()))
+
+class CandadosStock:
+    """Un candado por producto, compartido por las sesiones y el hilo de la bandeja.
+
+    tomar() los adquiere en orden alfabético (dos carritos con los mismos productos no se
+    bloquean mutuamente); carritos sin productos en común avanzan en paralelo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._candados: Dict[str, threading.RLock] = {}
+
+    @contextmanager
+    def tomar(self, productos):
+        with self._lock:
+            candados = [self._candados.setdefault(p, threading.RLock()) for p in sorted(set(productos))]
+        for c in candados:
+            c.acquire()
+        try:
+            yield
+        finally:
+            for c in reversed(candados):
+                c.release()
+
+_candados_stock = CandadosStock()
+
+def _stock_fresco(productos_ws, productos: List[str], mapa: Optional[Dict] = None,
+                  hasta_fila: Optional[int] = None) -> Tuple[Dict[str, Tuple[int, float]], List[str]]:
+    """Stock actual de `productos`: sus filas de Productos y el puntero del libro en un
+    values_batch_get, más los movimientos sin compactar (sólo las filas nuevas del libro).
+    Con `hasta_fila`, sólo los movimientos del libro hasta esa fila.
+
+    Devuelve ({producto: (fila, stock)}, [productos que no están]). Si un producto no está en
+    la fila que dice el índice (la hoja se movió) o el índice no lo conoce, lo reconstruye una
+    vez y vuelve a leer.
+    """
+    _, sheet, *_ = get_client_and_ws()
+    index = productos_index()
+    if mapa is None:
+        mapa = index.get(productos_ws=productos_ws)
+    foto: Dict[str, Tuple[int, float]] = {}
+    hasta = 1
+    for intento in range(2):
+        filas = {p: mapa[p][0] for p in productos if p in mapa}
+        rangos = [f"'{productos_ws.title}'!D1:E1"] + [f"'{productos_ws.title}'!A{r}:C{r}" for r in filas.values()]
+        resp = sheet.values_batch_get(rangos).get("valueRanges", [])
+        hasta = _libro_hasta([""] * 3 + ((resp[0].get("values") or [[]])[0] if resp else []))
+        foto = {}
+        for (p, r), vr in zip(filas.items(), resp[1:]):
+            fila = ((vr.get("values") or [[]])[0] + ["", "", ""])[:3]
+            if str(fila[0]).strip() == p:
+                foto[p] = (r, _to_float(fila[2]))
+        if len(foto) == len(productos) or intento:
+            break
+        index.invalidate()
+        mapa = index.get(productos_ws=productos_ws)
+    cola = libro_stock().refrescar(get_movimientos_ws(), hasta, hasta_fila) if foto else {}
+    actual = {p: (r, round(stk + cola.get(p, 0.0), 3)) for p, (r, stk) in foto.items()}
+    return actual, [p for p in productos if p not in actual]
+
+def _faltantes_stock(deltas: Dict[str, float], actual: Dict[str, Tuple[int, float]],
+                     comprometido: Dict[str, float]) -> Dict[str, float]:
+    """{producto: ml disponibles} de las salidas de `deltas` que no alcanzan."""
+    faltan = {}
+    for p, d in deltas.items():
+        if float(d) < 0 and p in actual:
+            disponible = max(0.0, actual[p][1] + comprometido.get(p, 0.0))
+            if -float(d) > disponible:
+                faltan[p] = disponible
+    return faltan
+
+# Reservas que chocaron con las de otro proceso se reintentan (con espera creciente)
+STOCK_RESERVA_INTENTOS = 3
+
+def _stock_en_cache(productos: List[str]) -> Optional[Dict[str, Tuple[int, float]]]:
+    """Stock de `productos` según el frame de Productos en memoria (con la cola del libro), sin
+    leer la hoja; None si alguno no está."""
+    df = load_productos_df()
+    filas = df.attrs.get("filas") or list(range(2, len(df) + 2))
+    foto = {p: (filas[i], float(s)) for i, (p, s) in enumerate(zip(df["Producto"], df["Stock disponible"]))}
+    if any(p not in foto for p in productos):
+        return None
+    return {p: foto[p] for p in productos}
+
+def _reservar_stock(deltas: Dict[str, float], tipo: str, referencia, lote: str) -> bool:
+    """Valida `deltas` ({producto: ml}, negativo = salida) contra el stock de la hoja y los
+    anota en el libro como una reserva verificada, también entre procesos.
+
+    Sheets no tiene escritura condicional; el compare-and-set es anotar y verificar: se
+    valida (stock + libro - lo comprometido en la bandeja; de entrada con el frame en memoria,
+    sin ir a la hoja salvo que no alcance), se anexan los movimientos con su `lote` y se vuelve
+    a calcular el stock contando el libro sólo hasta nuestra última fila. Sheets ordena los appends, así que lo que otro proceso reservó antes
+    ya está ahí y lo que reserve después se verifica contra lo nuestro. Si algún producto quedó
+    bajo cero se anula (movimientos contrarios, lote `<lote>-x`) y se reintenta; si sigue sin
+    alcanzar levanta StockInsuficiente.
+
+    True: los movimientos quedaron en el libro. False: sin conexión, o Sheets falló en medio
+    (el append pudo llegar o no); quien llama manda `deltas` a la bandeja con clave `lote`, y la
+    sincronización los salta si el libro ya trae ese lote.
+    """
+    deltas = {p: float(d) for p, d in deltas.items() if float(d) != 0.0}
+    if not deltas:
+        return True
+    if not en_linea():
+        return False
+    try:
+        _, _, productos_ws, *_ = get_ws()
+        for intento in range(STOCK_RESERVA_INTENTOS):
+            # Primer intento: validación previa con lo que ya está en memoria; la que cuenta es la
+            # verificación tras anotar. Si no alcanza (o falta algún producto) se confirma contra
+            # la hoja antes de rechazar, y los reintentos siempre leen la hoja
+            comprometido = stock_comprometido()
+            actual = _stock_en_cache(list(deltas)) if intento == 0 else None
+            if actual is None or _faltantes_stock(deltas, actual, comprometido):
+                actual, _ = _stock_fresco(productos_ws, list(deltas))
+            faltan = _faltantes_stock(deltas, actual, comprometido)
+            if faltan:
+                raise StockInsuficiente(faltan)
+            movs = [(p, d, tipo, referencia, lote) for p, d in deltas.items() if p in actual]
+            primera, n = _anotar_movimientos(movs)
+            if not n or primera is None:
+                return True
+            # La verificación tiene que ver nuestras filas: no se une a una lectura ya en vuelo
+            with sin_coalescer():
+                despues, _ = _stock_fresco(productos_ws, [m[0] for m in movs], hasta_fila=primera + n - 1)
+            negativos = {p: v for p, (_, v) in despues.items() if v < 0 and deltas[p] < 0}
+            if not negativos:
+                return True
+            _anular_reserva(movs, f"{lote}-x")
+            time.sleep(random.uniform(0.05, 0.2) * (2 ** intento))
+        raise StockInsuficiente({p: max(0.0, v - deltas[p]) for p, v in negativos.items()})
+    except NotConnected:
+        return False
+    except Exception as e:
+        if not _falla_de_red(e):
+            raise
+        estado_red().marcar_error(e)
+        return False
+
+def _anular_reserva(movs: List[Tuple], lote: str):
+    """Movimientos contrarios a una reserva rechazada. Si Sheets no responde van a la bandeja
+    con clave `lote` (idempotente) y no se pierde el stock apartado."""
+    try:
+        _anotar_movimientos([(p, -d, "anulacion", ref, lote) for p, d, _, ref, _ in movs])
+    except Exception as e:
+        if not _falla_de_red(e):
+            raise
+        estado_red().marcar_error(e)
+        get_outbox().encolar(movs[0][3], {"stock": {p: -d for p, d, *_ in movs}},
+                             offline=True, claves={"stock": lote})
+
+def productos_ajustar_stock(deltas: Dict[str, float], tipo: str = "ajuste", referencia=None,
+                            mapa: Optional[Dict] = None) -> Dict[str, float]:
+    """Anota cada delta ({producto: ml}, negativo = salida) en el libro con un solo append.
+
+    Ninguna salida deja el stock bajo cero. Devuelve {producto: stock nuevo}; los productos que
+    no existen se avisan y se omiten.
+    """
+    deltas = {p: float(d) for p, d in (deltas or {}).items() if float(d) != 0.0}
+    if not deltas:
+        return {}
+    try:
+        _, _, productos_ws, *_ = get_ws()
+    except NotConnected:
+        return {}
+    try:
+        with _candados_stock.tomar(deltas):
+            actual, faltantes = _stock_fresco(productos_ws, list(deltas), mapa)
+            movs = [(p, max(d, -actual[p][1]), tipo, referencia) for p, d in deltas.items() if p in actual]
+            _anotar_movimientos(movs)
+    except Exception as e:
+        st.warning(f"No se pudo actualizar el stock: {e}")
+        return {}
+    for prod in faltantes:
+        st.warning(f"'{prod}' no existe en Productos (no se ajustó stock).")
+    return {p: round(actual[p][1] + ml, 3) for p, ml, *_ in movs}
+
+def _pedidos_max_id(pedidos_ws) -> int:
+    col = pedidos_ws.col_values(1)  # incluye header
+    nums = []
+    for v in col[1:]:
+        try: nums.append(int(float(v)))
+        except: pass
+    return max(nums) if nums else 0
+
+@st.cache_resource(show_spinner=False)
+def get_meta_ws():
+    """Hoja Meta (clave/valor): celdas de control de la sonda; get_client_and_ws ya la creó.
+    En libros anteriores a Folios, B2 trae el contador viejo next_pedido_id, que sólo se lee
+    para sembrar la base de la bitácora."""
+    _, sheet, *_ = get_client_and_ws()
+    return _get_or_create_ws(sheet, SHEET_TAB_META, rows=20, cols=5)
+
+@st.cache_resource(show_spinner=False)
+def get_folios_ws():
+    """Bitácora de # Pedido repartidos (sólo se le agregan filas); get_client_and_ws ya la creó."""
+    _, sheet, *_ = get_client_and_ws()
+    return _get_or_create_ws(sheet, SHEET_TAB_FOLIOS, rows=1000, cols=len(FOLIOS_COLS))
+
+class PedidoIdAllocator:
+    """Reparte # Pedido agregando filas a la bitácora Folios en vez de leer toda la columna A.
+
+    Un append lo ordena Sheets del lado del servidor: dos appends simultáneos nunca caen en
+    la misma fila, así que el # sale de la fila que nos tocó: base + (fila - 2). Leer el
+    contador, escribirlo y releerlo no bastaba (otro proceso podía escribir entre nuestra
+    lectura y nuestra escritura y ambos releían su propio token).
+
+    La base es la que propuso quien escribió la primera fila de la bitácora (columna B de la
+    fila 2, que ya no cambia): el máximo entre el contador viejo Meta!B2 (sólo en libros
+    anteriores a Folios; los nuevos ya no lo crean) y el mayor # de Pedidos + 1. Cada proceso
+    la lee una vez. Con `block` > 1 se agregan varias filas de un solo append y los # se
+    reparten sin llamadas; los que no se usen quedan como huecos.
+    Las filas de Folios no se deben borrar.
+    """
+
+    def __init__(self, block: int = 1, libro=None):
+        self.block = max(1, int(block))
+        # Libro propio (pruebas: un "proceso" aparte, sin la conexión ni el scheduler compartidos)
+        self.libro = libro
+        self._lock = threading.Lock()
+        self._base: Optional[int] = None
+        self._next = 0
+        self._end = 0
+
+    def _hojas(self):
+        if self.libro is None:
+            _, _, _, pedidos_ws, *_ = get_client_and_ws()
+            return get_folios_ws(), get_meta_ws(), pedidos_ws
+        return tuple(self.libro.worksheet(t) for t in (SHEET_TAB_FOLIOS, SHEET_TAB_META, SHEET_TAB_PEDIDOS))
+
+    def _propuesta(self, meta_ws, pedidos_ws) -> int:
+        """Base para una bitácora vacía: sigue la numeración que ya existe."""
+        try:
+            contador = int(float((meta_ws.get_values("B2") or [[""]])[0][0]))
+        except Exception:
+            contador = 0
+        return max(contador, _pedidos_max_id(pedidos_ws) + 1)
+
+    def _reserve(self, n: int) -> int:
+        folios_ws, meta_ws, pedidos_ws = self._hojas()
+        if self._base is None:
+            primera = (folios_ws.get_values("A2:B2") or [[]])[0]
+            propuesta = self._propuesta(meta_ws, pedidos_ws) if len(primera) < 2 else 0
+        else:
+            propuesta = self._base
+        token = uuid.uuid4().hex[:12]
+        hoy = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        resp = folios_ws.append_rows([[token, propuesta, hoy]] * n, value_input_option="RAW")
+        fila = _appended_row(resp)
+        if fila is None:
+            raise RuntimeError("No se pudo reservar un # Pedido (respuesta sin rango); intenta de nuevo.")
+        if self._base is None:
+            # La base la fija la fila 2, sea nuestra o de quien llegó antes
+            primera = [[token, propuesta]] if fila == 2 else folios_ws.get_values("A2:B2")
+            self._base = int(float(primera[0][1]))
+        return self._base + fila - 2
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self._reserve(self.block)
+                self._end = self._next + self.block
+            pid = self._next
+            self._next += 1
+            return pid
+
+@st.cache_resource(show_spinner=False)
+def pedido_id_allocator() -> PedidoIdAllocator:
+    return PedidoIdAllocator(block=int(_config("PEDIDO_ID_BLOCK", 1) or 1))
+
+def pedidos_next_id_fast() -> int:
+    """Siguiente # Pedido; levanta SinConexion si Sheets no responde (ver _id_provisional)."""
+    try:
+        get_ws()
+    except SinConexion:
+        raise
+    except NotConnected:
+        return 1
+    try:
+        return pedido_id_allocator().next_id()
+    except Exception as e:
+        if not _falla_de_red(e):
+            raise
+        estado_red().marcar_error(e)
+        raise SinConexion(str(e)) from e
+
+def _id_provisional() -> int:
+    """# para un pedido hecho sin conexión: el mayor conocido (espejo y bandeja) + 1.
+
+    Al sincronizar se pide el definitivo a la bitácora Folios; si otro equipo lo usó mientras
+    tanto, el pedido se renumera (la bandeja guarda el # original para mostrarlo).
+    """
+    ids = pd.to_numeric(load_pedidos_df()["# Pedido"], errors="coerce").dropna()
+    maximo = int(ids.max()) if len(ids) else 0
+    return max(maximo, get_outbox().max_pedido_id()) + 1
+
+class PedidosIndex:
+    """Índice # Pedido -> {producto: (fila, costo x ml)} de Pedidos, compartido entre sesiones.
+
+    Se arma una vez desde load_pedidos_df() (ya cacheado, sin llamadas extra) y se mantiene
+    con nuestros pedidos_append_rows; así una edición o cambio de estatus es un solo
+    batch_update sin leer columnas completas. Se rearma si un append no cae en la fila
+    esperada (otra sesión escribió) o tras `ttl` segundos, igual que ProductosIndex.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._mapa: Optional[Dict[int, Dict[str, Tuple[int, float]]]] = None
+        self._last_row = 1
+        self._built_at = 0.0
+
+    def _add(self, fila: int, pid, producto, cml):
+        try:
+            pid = int(float(pid))
+        except Exception:
+            return
+        if pid <= 0:
+            return
+        self._mapa.setdefault(pid, {})[str(producto).strip()] = (int(fila), _to_float(cml))
+
+    def _build(self):
+        df = load_pedidos_df()
+        self._mapa = {}
+        for fila, pid, pro, cml in zip(df.index, df["# Pedido"], df["Producto"], df["Costo x ml"]):
+            self._add(fila, pid, pro, cml)
+        self._last_row = int(df.index.max()) if len(df) else 1
+        self._built_at = time.time()
+
+    def get(self, pedido_id: int) -> Dict[str, Tuple[int, float]]:
+        with self._lock:
+            if self._mapa is None or (time.time() - self._built_at) > self.ttl:
+                self._build()
+            return dict(self._mapa.get(int(pedido_id), {}))
+
+    def invalidate(self):
+        with self._lock:
+            self._mapa = None
+
+    def add_rows(self, first_row: Optional[int], rows: List[List]):
+        with self._lock:
+            if self._mapa is None:
+                return
+            if first_row is None or first_row != self._last_row + 1:
+                self._mapa = None
+                return
+            for i, r in enumerate(rows):
+                self._add(first_row + i, r[0], r[3], r[5])
+            self._last_row = first_row + len(rows) - 1
+
+@st.cache_resource(show_spinner=False)
+def pedidos_index() -> PedidosIndex:
+    return PedidosIndex()
+
+def _pedidos_append(pedidos_ws, rows: List[List]):
+    resp = pedidos_ws.append_rows(rows, value_input_option="USER_ENTERED")
+    primera = _appended_row(resp)
+    conteo_filas().registrar(pedidos_ws, primera and primera + len(rows) - 1)
+    get_espejo().desde_fila(pedidos_ws.title, primera, rows)
+    pedidos_index().add_rows(primera, rows)
+    versiones().bump(SHEET_TAB_PEDIDOS)
+
+def pedidos_append_rows(rows: List[List]):
+    try:
+        _, _, _, pedidos_ws, *_ = get_ws()
+    except NotConnected:
+        st.error("Conéctate a Google Sheets para guardar pedidos.")
+        return
+    _pedidos_append(pedidos_ws, rows)
+
+def pedidos_update_parcial(pedido_id: int, cambios_ml_por_producto: List[Tuple[str, float]], nuevo_estatus: str = None):
+    """Actualiza ML/Total por producto y estatus del pedido sin reescribir toda la hoja."""
+    if not cambios_ml_por_producto and not nuevo_estatus:
+        return
+    try:
+        _, _, _, pedidos_ws, *_ = get_ws()
+    except NotConnected:
+        st.error("Conéctate a Google Sheets para actualizar pedidos.")
+        return
+
+    mapa = pedidos_index().get(pedido_id)
+
+    data_ranges, parches = [], {}
+    for pro, ml_new in (cambios_ml_por_producto or []):
+        if pro not in mapa:
+            st.warning(f"Producto '{pro}' no aparece en pedido #{pedido_id} (omite).")
+            continue
+        row, cml = mapa[pro]
+        total = round(float(ml_new) * float(cml), 2)
+        data_ranges.append({"range": f"E{row}:E{row}", "values": [[float(ml_new)]]})
+        data_ranges.append({"range": f"G{row}:G{row}", "values": [[total]]})
+        parches.setdefault(row, {}).update({"Mililitros": float(ml_new), "Total": total})
+
+    if nuevo_estatus:
+        for _, (row, _) in mapa.items():
+            data_ranges.append({"range": f"H{row}:H{row}", "values": [[nuevo_estatus]]})
+            parches.setdefault(row, {})["Estatus"] = nuevo_estatus
+
+    if data_ranges:
+        try:
+            pedidos_ws.batch_update(data_ranges, value_input_option="USER_ENTERED")
+            col = {c: i for i, c in enumerate(PEDIDOS_COLS)}
+            for row, valores in parches.items():
+                pedidos_cache().patch(row, valores)
+            get_espejo().celdas(pedidos_ws.title, {r: {col[c]: v for c, v in vs.items()} for r, vs in parches.items()})
+            versiones().bump(SHEET_TAB_PEDIDOS)
+        except Exception as e:
+            st.warning(f"No se pudo actualizar el pedido #{pedido_id}: {e}")
+
+# =====================
+# BANDEJA DE SALIDA (pedidos guardados en local y escritos a Sheets en segundo plano)
+# =====================
+# Los manejadores corren en el hilo de la bandeja: sin st.* de UI ni session_state, y
+# cualquier excepción deja las entradas pendientes para la siguiente vuelta.
+def _sync_pedidos(entradas: List[Dict]):
+    _, _, _, pedidos_ws, *_ = get_client_and_ws()
+    outbox = get_outbox()
+    for e in entradas:
+        if not e["confirmado"]:
+            # Pedido hecho sin conexión: su # definitivo sale de la bitácora Folios
+            nuevo = pedido_id_allocator().next_id()
+            outbox.renumerar(e["pedido_id"], nuevo)
+            e["payload"] = [[nuevo] + list(f[1:]) for f in e["payload"]]
+            e["pedido_id"], e["confirmado"] = nuevo, True
+    if any(e["intentos"] for e in entradas):
+        # Un intento anterior pudo quedar escrito aunque no llegó la respuesta: no duplicar
+        ya = set(pd.to_numeric(pedidos_cache().refresh(pedidos_ws)["# Pedido"], errors="coerce").dropna().astype(int))
+        entradas = [e for e in entradas if e["pedido_id"] not in ya]
+    filas = [f for e in entradas for f in e["payload"]]
+    if filas:
+        _pedidos_append(pedidos_ws, filas)
+
+def _sync_stock(entradas: List[Dict]):
+    # Cada venta es un movimiento del libro con su # Pedido y, en la columna Lote, la clave de
+    # su entrada en la bandeja. Un append que llegó aunque se perdió la respuesta deja esas
+    # claves en el libro: al reintentar se saltan las entradas que ya están, aunque el lote
+    # del reintento traiga otras entradas nuevas o el libro se haya compactado en medio. Las
+    # entradas offline pueden traer la clave de una reserva directa que no se sabe si llegó
+    _, _, productos_ws, *_ = get_client_and_ws()
+    productos = sorted({p for e in entradas for p in e["payload"]})
+    with _candados_stock.tomar(productos):
+        actual, faltantes = _stock_fresco(productos_ws, productos)
+        ya = libro_stock().lotes()
+        if any(e["intentos"] or e["offline"] for e in entradas):
+            ya |= _lotes_en_libro()
+        entradas = [e for e in entradas if e["clave"] not in ya]
+        if not entradas:
+            return
+        pedidos_por_prod: Dict[str, List[int]] = {}
+        for e in entradas:
+            for prod in e["payload"]:
+                if e["pedido_id"] is not None:
+                    pedidos_por_prod.setdefault(prod, []).append(e["pedido_id"])
+        stock = {p: v for p, (_, v) in actual.items()}
+        movs, vendido = [], {}
+        for e in entradas:
+            for prod, d in e["payload"].items():
+                if prod not in stock:
+                    continue
+                ml = max(float(d), -stock[prod])  # el stock no baja de cero
+                stock[prod] += ml
+                vendido[prod] = vendido.get(prod, 0.0) + float(d)
+                # Sin # Pedido sólo llegan las compras registradas sin conexión
+                if e["pedido_id"] is None:
+                    movs.append((prod, ml, "compra", "Compras", e["clave"]))
+                else:
+                    movs.append((prod, ml, "venta", e["pedido_id"], e["clave"]))
+        _anotar_movimientos(movs)
+    conflictos = [
+        {"producto": p, "pedidos": pedidos_por_prod.get(p),
+         "detalle": f"Stock en hoja {actual[p][1]:g} ml, se vendieron {-d:g} ml: quedó en 0."}
+        for p, d in vendido.items() if actual[p][1] + d < 0
+    ]
+    conflictos += [{"producto": p, "pedidos": pedidos_por_prod.get(p),
+                    "detalle": "No existe en Productos: no se descontó stock."} for p in faltantes]
+    get_outbox().registrar_conflictos(conflictos)
+    if libro_stock().sin_compactar() >= LIBRO_COMPACTAR_CADA:
+        compactar_libro()
+
+def _sync_envios(entradas: List[Dict]):
+    _, _, _, _, envios_ws, _ = get_client_and_ws()
+    filas = [e["payload"] for e in entradas]
+    resp = envios_ws.append_rows(filas)
+    get_espejo().desde_fila(envios_ws.title, _appended_row(resp), filas)
+
+def _sync_productos(entradas: List[Dict]):
+    # Altas hechas sin conexión; si entretanto alguien dio de alta el mismo nombre, se omite
+    _, _, productos_ws, *_ = get_client_and_ws()
+    index = productos_index()
+    index.invalidate()
+    existentes = index.get(productos_ws=productos_ws)
+    filas, vistos = [], set()
+    for e in entradas:
+        nombre = str(e["payload"][0]).strip()
+        if nombre and nombre not in existentes and nombre not in vistos:
+            vistos.add(nombre)
+            filas.append([nombre, float(e["payload"][1]), float(e["payload"][2])])
+    if not filas:
+        return
+    resp = productos_ws.append_rows(filas, value_input_option="USER_ENTERED")
+    primera = _appended_row(resp)
+    conteo_filas().registrar(productos_ws, primera and primera + len(filas) - 1)
+    get_espejo().desde_fila(productos_ws.title, primera, filas)
+    for i, (nombre, costo, stock) in enumerate(filas):
+        index.add(nombre, costo, stock, primera and primera + i)
+    versiones().bump(SHEET_TAB_PRODUCTOS)
+
+def _sync_compras(entradas: List[Dict]):
+    _, _, _, _, _, compras_ws = get_client_and_ws()
+    filas = [e["payload"] for e in entradas]
+    resp = compras_ws.append_rows(filas, value_input_option="USER_ENTERED")
+    primera = _appended_row(resp)
+    conteo_filas().registrar(compras_ws, primera and primera + len(filas) - 1)
+    get_espejo().desde_fila(compras_ws.title, primera, filas)
+    versiones().bump(SHEET_TAB_COMPRAS)
+
+def _vigilado(manejador):
+    """El hilo de la bandeja también sondea la red: éxito o falla actualizan estado_red()."""
+    def wrapper(entradas: List[Dict]):
+        try:
+            manejador(entradas)
+        except Exception as e:
+            if _falla_de_red(e):
+                estado_red().marcar_error(e)
+            raise
+        estado_red().marcar_ok()
+    return wrapper
+
+@st.cache_resource(show_spinner=False)
+def get_outbox() -> Outbox:
+    """Bandeja SQLite (OUTBOX_PATH); su hilo se arranca salvo OUTBOX_WORKER=0 (bench.py).
+
+    Orden de vaciado: altas de productos antes que pedidos (para que exista su stock), y las
+    filas de cada pedido antes que su stock y su envío.
+    """
+    manejadores = {
+        "producto": _sync_productos, "pedido": _sync_pedidos, "stock": _sync_stock,
+        "envio": _sync_envios, "compra": _sync_compras,
+    }
+    outbox = Outbox(
+        str(_config("OUTBOX_PATH", ".hdecants_outbox.sqlite")),
+        {tipo: _vigilado(fn) for tipo, fn in manejadores.items()},
+        espera=float(_config("OUTBOX_ESPERA_S", 1.0) or 0),
+    )
+    if str(_config("OUTBOX_WORKER", "1")).strip() != "0":
+        outbox.iniciar()
+    return outbox
+
+def estado_sync(pedido_id: int) -> Optional[str]:
+    return get_outbox().estado(pedido_id)
+
+def resumen_sync() -> Dict[str, object]:
+    return get_outbox().resumen()
+
+def pedidos_sync_recientes(limite: int = 10) -> List[Dict]:
+    return get_outbox().pedidos_recientes(limite)
+
+def stock_comprometido() -> Dict[str, float]:
+    """Ajustes de stock de pedidos aún no sincronizados ({producto: ml}, negativo = vendido)."""
+    return get_outbox().stock_pendiente()
+
+def conflictos_stock() -> List[Dict]:
+    return get_outbox().conflictos()
+
+def marcar_conflictos_revisados():
+    get_outbox().marcar_conflictos_revisados()
+
+def sincronizar_ahora() -> int:
+    return get_outbox().procesar()
+
+def estado_conexion() -> Dict[str, object]:
+    """Para la barra lateral: si se trabaja con el espejo y desde cuándo."""
+    red = estado_red()
+    return {"offline": red.fuera(), "desde": red.fuera_desde, "error": red.ultimo_error}
+
+def reintentar_conexion():
+    """Olvida la falla de red y vuelve a leer de Sheets en el siguiente render."""
+    estado_red.clear()
+    versiones().bump()
+
+# =====================
+# ACCIONES (flujos completos de la UI; también los ejecuta bench.py)
+# =====================
+def _encolar_pedido(filas: List[List], deltas: Dict[str, float], envio: Optional[List] = None,
+                    provisional: bool = False, lote: Optional[str] = None) -> int:
+    """Manda a la bandeja las filas (con el # en la primera columna), el stock y el envío.
+
+    `lote`: el de una reserva directa que no se confirmó (ver _reservar_stock).
+    """
+    pedido_id = filas[0][0]
+    offline = provisional or not en_linea()
+    if offline:
+        # Que el Historial lo muestre mientras tanto (la sincronización reemplaza estas filas)
+        get_espejo().anexar_local(SHEET_TAB_PEDIDOS, filas)
+        versiones().bump(SHEET_TAB_PEDIDOS)
+    get_outbox().encolar(pedido_id, {"pedido": filas, "stock": deltas, "envio": envio},
+                         offline=offline, provisional=provisional, claves={"stock": lote} if lote else None)
+    return pedido_id
+
+def guardar_pedido(cliente: str, fecha: str, estatus: str,
+                   cart_items: List[Tuple[str, float, float, float]],
+                   envio: Optional[List] = None) -> int:
+    """Registra el pedido en la bandeja de salida y devuelve su # Pedido.
+
+    Las filas (una por producto), el descuento de stock y el envío se escriben en Sheets
+    desde el hilo de la bandeja, juntando los pedidos que se acumulen mientras tanto. Sin
+    conexión el # es provisional y se confirma (o renumera) al sincronizar.
+
+    Con conexión, antes reserva el stock del carrito en el libro (_reservar_stock: validado y
+    verificado también contra otros procesos) y levanta StockInsuficiente si no alcanza; la
+    bandeja ya no lleva ese descuento. Ese es el costo de no sobrevender entre equipos: en
+    línea se espera el folio y la reserva; sin conexión vuelve al instante. Un # asignado a un carrito rechazado queda como hueco.
+    Reservar y encolar ocurren bajo el candado de cada producto.
+    """
+    deltas: Dict[str, float] = {}
+    for prod, ml_val, *_ in cart_items:
+        deltas[prod] = deltas.get(prod, 0.0) - float(ml_val)
+    with _candados_stock.tomar(deltas):
+        try:
+            pedido_id, provisional = pedidos_next_id_fast(), False
+        except SinConexion:
+            pedido_id, provisional = _id_provisional(), True
+        lote = f"r{uuid.uuid4().hex[:12]}"
+        if not provisional and _reservar_stock(deltas, "venta", pedido_id, lote):
+            deltas = {}
+        return _registrar_pedido(pedido_id, provisional, cliente, fecha, estatus, cart_items, deltas, envio, lote)
+
+def _registrar_pedido(pedido_id: int, provisional: bool, cliente: str, fecha: str, estatus: str,
+                      cart_items: List[Tuple[str, float, float, float]], deltas: Dict[str, float],
+                      envio: Optional[List], lote: Optional[str] = None) -> int:
+    filas_pedidos = []
+    for prod, ml_val, costo_val, total_val in cart_items:
+        filas_pedidos.append([
+            pedido_id,
+            cliente,
+            fecha,
+            prod,
+            float(ml_val),
+            float(costo_val),
+            round(float(total_val), 2),
+            estatus
+        ])
+    if envio:
+        envio = [pedido_id, cliente] + list(envio[2:])
+    return _encolar_pedido(filas_pedidos, deltas, envio, provisional=provisional, lote=lote)
+
+def editar_pedido(pedido_id: int, pedido_rows: pd.DataFrame, edited: pd.DataFrame,
+                  nuevo_estatus: str) -> bool:
+    """Aplica ML editados (ajustando stock) y estatus. Devuelve False si faltó stock."""
+    if not en_linea():
+        st.warning("Sin conexión con Google Sheets: la edición de pedidos espera a que vuelva.")
+        return False
+    if estado_sync(pedido_id) in ("pendiente", "error"):
+        st.warning(f"El pedido #{pedido_id} aún no se sincroniza con Sheets; intenta en unos segundos.")
+        return False
+    cambios = edited.merge(
+        pedido_rows[["Producto","Mililitros"]],
+        on="Producto",
+        how="left",
+        suffixes=("_new","_old")
+    )
+
+    cambios_ml = []
+    deltas: Dict[str, float] = {}
+    mapa_prod = _productos_index_map()
+    for _, r in cambios.iterrows():
+        ml_old = float(r["Mililitros_old"])
+        ml_new = float(r["Mililitros_new"])
+        if ml_new == ml_old:
+            continue
+        pro = r["Producto"]
+        if pro not in mapa_prod:
+            st.warning(f"⚠️ '{pro}' no existe en Productos. No se ajustó stock.")
+        else:
+            deltas[pro] = deltas.get(pro, 0.0) - (ml_new - ml_old)
+        cambios_ml.append((pro, ml_new))
+
+    # Un solo ajuste de stock para todo el pedido, reservado y verificado en el libro antes
+    # de tocar sus filas, bajo el candado de esos productos
+    lote = f"e{uuid.uuid4().hex[:12]}"
+    with _candados_stock.tomar(deltas):
+        try:
+            reservado = _reservar_stock(deltas, "edicion", pedido_id, lote)
+        except StockInsuficiente as e:
+            for pro, disponible in e.faltantes.items():
+                st.error(f"Stock insuficiente para '{pro}'. Disponible: {disponible:g} ml")
+            return False
+    if not reservado:
+        st.warning("No se pudo confirmar el ajuste de stock con Sheets; se reintenta en segundo plano.")
+        get_outbox().encolar(pedido_id, {"stock": deltas}, offline=True, claves={"stock": lote})
+    pedidos_update_parcial(pedido_id, cambios_ml, nuevo_estatus)
+    return True
+
+def duplicar_pedido(pedido_rows: pd.DataFrame) -> int:
+    """Copia las filas de un pedido como cotización nueva con fecha de hoy; devuelve el nuevo #."""
+    base = pedido_rows.copy()
+    for c in ["Mililitros", "Costo x ml", "Total"]:
+        base[c] = _f64(base[c])
+    try:
+        new_id, provisional = pedidos_next_id_fast(), False
+    except SinConexion:
+        new_id, provisional = _id_provisional(), True
+    base["# Pedido"] = new_id
+    base["Fecha"] = datetime.today().strftime("%Y-%m-%d")
+    base["Estatus"] = "Cotizacion"
+    filas = base[["# Pedido","Nombre Cliente","Fecha","Producto","Mililitros","Costo x ml","Total","Estatus"]].values.tolist()
+    if provisional:
+        return _encolar_pedido(filas, {}, provisional=True)
+    try:
+        pedidos_append_rows(filas)
+    except Exception as e:
+        if not _falla_de_red(e):
+            raise
+        estado_red().marcar_error(e)
+        _encolar_pedido(filas, {})
+    return new_id
+
+def registrar_compra(fila: List, agregar_a_productos: bool = False, ml_stock: float = 0.0) -> bool:
+    """Guarda la compra y, si aplica, la da de alta en Productos y suma `ml_stock` a su stock
+    (movimiento "compra" en el libro). True si se agregó el producto."""
+    append_compra_row(fila)
+    if not agregar_a_productos:
+        return False
+    producto = str(fila[0]).strip()
+    prods_local = load_productos_df()
+    agregado = producto not in prods_local["Producto"].values
+    if agregado:
+        productos_append_row(producto, 0.0, 0.0)
+    if float(ml_stock or 0) > 0:
+        if en_linea():
+            productos_ajustar_stock({producto: float(ml_stock)}, "compra", "Compras")
+        else:
+            get_outbox().encolar(None, {"stock": {producto: float(ml_stock)}}, offline=True)
+    return agregado
@@ -0,0 +1,94 @@
+# snapshot.py — H DECANTS (copia columnar en disco de los DataFrames para arrancar en caliente)
+# ========================================================================================
+#
+# st.cache_data vive en la memoria del proceso: tras un redeploy o cuando el contenedor
+# despierta, Pedidos se descargaba completo. Aquí se guarda el último DataFrame en formato
+# Arrow IPC junto con su "revisión" (hasta qué fila de la hoja está sincronizado y la clave de
+# esa fila); al arrancar se carga en milisegundos y sólo se piden a Sheets las filas nuevas.
+#
+# pyarrow es opcional (viene con Streamlit): si no está, no hay snapshots y todo sigue igual.
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    _HAS_ARROW = True
+except Exception:
+    _HAS_ARROW = False
+
+# Cambia si cambia el formato (2: tipos compactos de Pedidos): los snapshots viejos se ignoran
+VERSION = 2
+
+class Snapshots:
+    """Un archivo `<nombre>.arrow` por DataFrame en `carpeta`, con su revisión en los metadatos.
+
+    guardar() no bloquea: un hilo escribe la versión más reciente de cada nombre (si llegan
+    varias mientras escribe, sólo se escribe la última).
+    """
+
+    def __init__(self, carpeta: str):
+        self.carpeta = carpeta
+        self.activo = _HAS_ARROW
+        self._lock = threading.Lock()
+        self._pendientes: Dict[str, Tuple[pd.DataFrame, Dict[str, Any]]] = {}
+        self._cola = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hd-snapshot")
+
+    def _ruta(self, nombre: str) -> str:
+        return os.path.join(self.carpeta, f"{nombre}.arrow")
+
+    def cargar(self, nombre: str) -> Optional[Tuple[pd.DataFrame, Dict[str, Any]]]:
+        """(DataFrame, revisión) del último snapshot, o None si no hay o no se puede leer."""
+        if not self.activo or not os.path.exists(self._ruta(nombre)):
+            return None
+        try:
+            with pa.memory_map(self._ruta(nombre)) as src:
+                tabla = pa.ipc.open_file(src).read_all()
+            meta = json.loads((tabla.schema.metadata or {}).get(b"hd_revision", b"{}"))
+            if meta.get("version") != VERSION:
+                return None
+            return tabla.to_pandas(), meta
+        except Exception:
+            # Un archivo a medio escribir o de otra versión de pyarrow: se ignora
+            return None
+
+    def guardar(self, nombre: str, df: pd.DataFrame, revision: Dict[str, Any]):
+        if not self.activo:
+            return
+        with self._lock:
+            nuevo = nombre not in self._pendientes
+            self._pendientes[nombre] = (df, dict(revision, version=VERSION))
+        if nuevo:
+            self._cola.submit(self._escribir, nombre)
+
+    def esperar(self):
+        """Bloquea hasta que se escriban los snapshots pendientes."""
+        self._cola.submit(lambda: None).result()
+
+    def _escribir(self, nombre: str):
+        with self._lock:
+            df, meta = self._pendientes.pop(nombre)
+        try:
+            os.makedirs(self.carpeta, exist_ok=True)
+            tabla = pa.Table.from_pandas(df, preserve_index=True)
+            tabla = tabla.replace_schema_metadata(
+                {**(tabla.schema.metadata or {}), b"hd_revision": json.dumps(meta).encode()}
+            )
+            tmp = self._ruta(nombre) + ".tmp"
+            with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, tabla.schema) as writer:
+                writer.write_table(tabla)
+            # Reemplazo atómico: quien lea ve el snapshot anterior o el nuevo, nunca uno a medias
+            os.replace(tmp, self._ruta(nombre))
+        except Exception:
+            pass
+
+    def borrar(self, nombre: str):
+        try:
+            os.remove(self._ruta(nombre))
+        except OSError:
+            pass
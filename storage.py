@@ -0,0 +1,517 @@
+# storage.py — H DECANTS (backends de almacenamiento: Google Sheets real o simulado en memoria)
+# ========================================================================================
+#
+# El resto de la app sólo usa una parte pequeña de la API de gspread (Spreadsheet/Worksheet).
+# Aquí vive esa superficie mínima con dos implementaciones:
+#   - "gsheets": gspread real (Google Sheets).
+#   - "local"  : hoja simulada en memoria, misma semántica de valores, cuenta llamadas y
+#                celdas transferidas, y puede simular latencia por llamada y cuota (429).
+
+import functools
+import re
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from numbers import Integral, Real
+from typing import Any, Dict, List, Optional, Tuple
+
+from gspread.exceptions import WorksheetNotFound
+
+BACKENDS = ("gsheets", "local")
+
+# =====================
+# A1 NOTATION
+# =====================
+_A1_RE = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+def col_to_num(col: str) -> int:
+    n = 0
+    for ch in col.upper():
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+def num_to_col(n: int) -> str:
+    s = ""
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        s = chr(65 + r) + s
+    return s
+
+def split_tab(rng: str) -> Tuple[Optional[str], str]:
+    """'Pedidos!A1:H5' -> ('Pedidos', 'A1:H5'); acepta nombres entre comillas simples."""
+    if "!" not in rng:
+        return None, rng
+    tab, cells = rng.rsplit("!", 1)
+    if len(tab) >= 2 and tab[0] == tab[-1] == "'":
+        tab = tab[1:-1].replace("''", "'")
+    return tab, cells
+
+def a1_bounds(rng: Optional[str]) -> Tuple[int, int, Optional[int], Optional[int]]:
+    """Devuelve (fila1, col1, fila2, col2) 1-based; None = abierto hasta el final."""
+    if not rng:
+        return 1, 1, None, None
+    _, rng = split_tab(rng)
+    a, _, b = rng.partition(":")
+    ma, mb = _A1_RE.match(a.strip()), _A1_RE.match((b or a).strip())
+    if not ma or not mb:
+        raise ValueError(f"Rango A1 inválido: {rng!r}")
+    c1 = col_to_num(ma.group(1)) if ma.group(1) else 1
+    r1 = int(ma.group(2)) if ma.group(2) else 1
+    c2 = col_to_num(mb.group(1)) if mb.group(1) else None
+    r2 = int(mb.group(2)) if mb.group(2) else None
+    return r1, c1, r2, c2
+
+# =====================
+# MÉTRICAS
+# =====================
+class Stats:
+    """Contadores compartidos por una hoja simulada (llamadas por método y celdas)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls: Counter = Counter()
+            self.cells_read = 0
+            self.cells_written = 0
+
+    def record(self, method: str, read: int = 0, written: int = 0):
+        with self._lock:
+            self.calls[method] += 1
+            self.cells_read += read
+            self.cells_written += written
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": sum(self.calls.values()),
+                "calls_by_method": dict(self.calls),
+                "cells_read": self.cells_read,
+                "cells_written": self.cells_written,
+            }
+
+# =====================
+# HOJA LOCAL (simulada)
+# =====================
+class QuotaExceeded(Exception):
+    """429 simulado: se pasó la cuota por minuto configurada en LocalSpreadsheet."""
+
+    code = 429
+
+def _api(fn):
+    """Marca un método como llamada a la API: antes de ejecutarlo se revisa la cuota simulada."""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        sp = self if isinstance(self, LocalSpreadsheet) else self.spreadsheet
+        sp._admit()
+        return fn(self, *args, **kwargs)
+    return wrapper
+
+def _as_cell(v) -> str:
+    """Normaliza un valor como lo devolvería Sheets en FORMATTED_VALUE (siempre str)."""
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        return "TRUE" if v else "FALSE"
+    if isinstance(v, Integral):
+        return str(int(v))
+    if isinstance(v, Real):
+        f = float(v)
+        if f != f:  # NaN
+            return ""
+        return str(int(f)) if f.is_integer() else repr(f)
+    return str(v)
+
+def _trim(grid: List[List[str]]) -> List[List[str]]:
+    """Quita filas/columnas vacías al final y rellena a rectángulo (como gspread.get_values)."""
+    last_row = 0
+    width = 0
+    for i, r in enumerate(grid):
+        w = len(r)
+        while w and r[w - 1] == "":
+            w -= 1
+        if w:
+            last_row = i + 1
+            width = max(width, w)
+    return [(r[:width] + [""] * (width - len(r[:width]))) for r in grid[:last_row]]
+
+def _cells(values) -> int:
+    return sum(len(r) for r in values)
+
+class LocalWorksheet:
+    """Implementa el subconjunto de gspread.Worksheet que usa la app, sobre una lista en memoria."""
+
+    def __init__(self, spreadsheet: "LocalSpreadsheet", title: str, sheet_id: int,
+                 rows: int = 1000, cols: int = 26):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.row_count = rows
+        self.col_count = cols
+        self._grid: List[List[str]] = []
+        self._rev = 0                  # sube con cada escritura (como la revisión de Drive)
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"<LocalWorksheet {self.title!r} id:{self.id}>"
+
+    # ---- infraestructura ----
+    def _call(self, method: str, read: int = 0, written: int = 0):
+        self.spreadsheet._call(method, read=read, written=written)
+
+    def _used_rows(self) -> int:
+        n = len(self._grid)
+        while n and not any(self._grid[n - 1]):
+            n -= 1
+        return n
+
+    def _read(self, rng: Optional[str]) -> List[List[str]]:
+        r1, c1, r2, c2 = a1_bounds(rng)
+        r2 = self._used_rows() if r2 is None else min(r2, len(self._grid))
+        out = []
+        for r in self._grid[r1 - 1:r2]:
+            out.append(r[c1 - 1:c2] if c2 is not None else r[c1 - 1:])
+        return _trim(out)
+
+    def _write(self, rng: Optional[str], values) -> int:
+        r1, c1, _, _ = a1_bounds(rng)
+        n = 0
+        self._rev += 1
+        for i, row in enumerate(values or []):
+            r = r1 - 1 + i
+            while len(self._grid) <= r:
+                self._grid.append([])
+            line = self._grid[r]
+            for j, v in enumerate(row):
+                c = c1 - 1 + j
+                if len(line) <= c:
+                    line.extend([""] * (c + 1 - len(line)))
+                line[c] = _as_cell(v)
+                n += 1
+            self.col_count = max(self.col_count, len(line))
+        self.row_count = max(self.row_count, len(self._grid))
+        return n
+
+    # ---- lecturas ----
+    @_api
+    def get_values(self, range_name: Optional[str] = None, **kwargs) -> List[List[str]]:
+        with self._lock:
+            vals = self._read(range_name)
+        self._call("get_values", read=_cells(vals))
+        return vals
+
+    get = get_values
+    get_all_values = get_values
+
+    @_api
+    def col_values(self, col: int, **kwargs) -> List[str]:
+        with self._lock:
+            vals = [r[col - 1] if len(r) >= col else "" for r in self._grid]
+        while vals and vals[-1] == "":
+            vals.pop()
+        self._call("col_values", read=len(vals))
+        return vals
+
+    @_api
+    def row_values(self, row: int, **kwargs) -> List[str]:
+        with self._lock:
+            vals = list(self._grid[row - 1]) if len(self._grid) >= row else []
+        while vals and vals[-1] == "":
+            vals.pop()
+        self._call("row_values", read=len(vals))
+        return vals
+
+    # ---- escrituras ----
+    @_api
+    def update(self, values=None, range_name=None, **kwargs):
+        # gspread acepta ambos órdenes de argumentos (update("A1", vals) es el estilo anterior)
+        if isinstance(values, str) and not isinstance(range_name, str):
+            values, range_name = range_name, values
+        with self._lock:
+            n = self._write(range_name or "A1", values)
+        self._call("update", written=n)
+        return {"updatedCells": n}
+
+    @_api
+    def batch_update(self, data, **kwargs):
+        n = 0
+        with self._lock:
+            for d in data or []:
+                n += self._write(d["range"], d.get("values") or [])
+        self._call("batch_update", written=n)
+        return {"totalUpdatedCells": n}
+
+    @_api
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        with self._lock:
+            start = self._used_rows() + 1
+            del self._grid[start - 1:]
+            n = self._write(f"A{start}", values)
+        self._call("append_rows", written=n)
+        return {"updates": {"updatedRange": f"{self.title}!A{start}", "updatedCells": n}}
+
+    @_api
+    def append_row(self, values, value_input_option=None, **kwargs):
+        with self._lock:
+            start = self._used_rows() + 1
+            del self._grid[start - 1:]
+            n = self._write(f"A{start}", [values])
+        self._call("append_row", written=n)
+        return {"updates": {"updatedRange": f"{self.title}!A{start}", "updatedCells": n}}
+
+    @_api
+    def clear(self):
+        with self._lock:
+            self._grid = []
+            self._rev += 1
+        self._call("clear")
+        return {}
+
+class LocalSpreadsheet:
+    """Libro simulado: contiene LocalWorksheet y acumula métricas/latencia de todas ellas."""
+
+    def __init__(self, title: str = "H DECANTS (local)", latency: float = 0.0, quota_per_minute: int = 0):
+        self.title = title
+        self.id = "local"
+        self.latency = float(latency)
+        self.quota_per_minute = int(quota_per_minute)
+        self._ventana: deque = deque()
+        self.sin_red = False          # True: toda llamada falla como si no hubiera red
+        self.stats = Stats()
+        self._sheets: Dict[str, LocalWorksheet] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        if self.sin_red:
+            self.stats.record("rejected_offline")
+            raise ConnectionError("Sin conexión con Google Sheets (simulado)")
+        if self.quota_per_minute <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            while self._ventana and now - self._ventana[0] > 60:
+                self._ventana.popleft()
+            if len(self._ventana) >= self.quota_per_minute:
+                self.stats.record("rejected_429")
+                raise QuotaExceeded("Quota exceeded for quota metric 'Requests per minute' (simulado)")
+            self._ventana.append(now)
+
+    def _call(self, method: str, read: int = 0, written: int = 0):
+        self.stats.record(method, read=read, written=written)
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    @_api
+    def worksheet(self, title: str) -> LocalWorksheet:
+        self._call("worksheet")
+        with self._lock:
+            ws = self._sheets.get(title)
+        if ws is None:
+            raise WorksheetNotFound(title)
+        return ws
+
+    @_api
+    def worksheets(self) -> List[LocalWorksheet]:
+        self._call("worksheets")
+        with self._lock:
+            return list(self._sheets.values())
+
+    @_api
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, **kwargs) -> LocalWorksheet:
+        self._call("add_worksheet")
+        with self._lock:
+            if title in self._sheets:
+                raise ValueError(f"Ya existe la hoja {title!r}")
+            ws = LocalWorksheet(self, title, self._next_id, rows=rows, cols=cols)
+            self._next_id += 1
+            self._sheets[title] = ws
+            return ws
+
+    @_api
+    def values_batch_get(self, ranges: List[str], params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Varias lecturas 'Tab!A1:B2' en una sola llamada (como spreadsheets.values.batchGet)."""
+        out = []
+        for rng in ranges:
+            tab, cells = split_tab(rng)
+            with self._lock:
+                ws = self._sheets.get(tab)
+            if ws is None:
+                raise WorksheetNotFound(tab)
+            with ws._lock:
+                vals = ws._read(cells)
+            # La API no rellena: cada fila llega sin sus celdas vacías del final
+            vals = [r[:len(r) - next((i for i, c in enumerate(reversed(r)) if c != ""), len(r))] for r in vals]
+            item = {"range": rng, "majorDimension": "ROWS"}
+            if vals:
+                item["values"] = vals
+            out.append(item)
+        self._call("values_batch_get", read=sum(_cells(v.get("values", [])) for v in out))
+        return {"spreadsheetId": self.id, "valueRanges": out}
+
+    @_api
+    def batch_update(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """spreadsheets.batchUpdate: sólo se simula addSheet (lo único que usa la app)."""
+        replies = []
+        with self._lock:
+            for req in body.get("requests", []):
+                if "addSheet" not in req:
+                    raise NotImplementedError(f"Petición no soportada en backend local: {list(req)}")
+                props = req["addSheet"].get("properties", {})
+                title = props["title"]
+                if title in self._sheets:
+                    raise ValueError(f"Ya existe la hoja {title!r}")
+                grid = props.get("gridProperties", {})
+                ws = LocalWorksheet(self, title, self._next_id,
+                                    rows=grid.get("rowCount", 1000), cols=grid.get("columnCount", 26))
+                self._next_id += 1
+                self._sheets[title] = ws
+                replies.append({"addSheet": {"properties": {"sheetId": ws.id, "title": title}}})
+        self._call("batch_update")
+        return {"spreadsheetId": self.id, "replies": replies}
+
+    @_api
+    def values_batch_update(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        n = 0
+        for d in body.get("data", []):
+            tab, cells = split_tab(d["range"])
+            with self._lock:
+                ws = self._sheets.get(tab)
+            if ws is None:
+                raise WorksheetNotFound(tab)
+            with ws._lock:
+                n += ws._write(cells, d.get("values") or [])
+        self._call("values_batch_update", written=n)
+        return {"spreadsheetId": self.id, "totalUpdatedCells": n}
+
+    @_api
+    def huellas(self, titles: List[str]) -> Dict[str, str]:
+        """Filas usadas y revisión de cada pestaña en una sola llamada (lo que SondaFormulas
+        obtiene de Meta: el conteo de filas va primero, igual que allá)."""
+        with self._lock:
+            hojas = {t: self._sheets[t] for t in titles if t in self._sheets}
+        out = {}
+        for t, ws in hojas.items():
+            with ws._lock:
+                out[t] = f"{ws._used_rows()}|{ws._rev}"
+        self._call("huellas", read=len(out))
+        return out
+
+    def seed(self, title: str, values: List[List[Any]]) -> LocalWorksheet:
+        """Carga datos directamente (sin contar llamadas); útil para benchmarks y pruebas."""
+        with self._lock:
+            ws = self._sheets.get(title)
+            if ws is None:
+                ws = LocalWorksheet(self, title, self._next_id)
+                self._next_id += 1
+                self._sheets[title] = ws
+        with ws._lock:
+            ws._grid = []
+            ws._write("A1", values)
+        return ws
+
+# =====================
+# SONDAS DE CAMBIOS
+# =====================
+class Sonda:
+    """Huella barata de cada pestaña: si no cambió desde la última vez, no hace falta releerla.
+
+    huellas() hace una sola llamada para todas; una pestaña que falte en la respuesta se
+    considera desconocida (quien pregunta no debe tomarla como cambio).
+    """
+
+    def huellas(self, titles: List[str]) -> Dict[str, str]:
+        raise NotImplementedError
+
+class SondaLocal(Sonda):
+    """Backend local: la revisión que cada LocalWorksheet sube en cada escritura."""
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def huellas(self, titles: List[str]) -> Dict[str, str]:
+        return self.spreadsheet.huellas(titles)
+
+class SondaFormulas(Sonda):
+    """Google Sheets: celdas de control en `hoja` (A = clave, B = fórmula que resume la pestaña).
+
+    Las fórmulas (conteo de filas y sumas de control) las recalcula Sheets con cada
+    cambio, así que leer esas pocas celdas con un values_batch_get basta para saber qué
+    pestañas cambiaron. Si las celdas no existen todavía (o son de otra versión de las
+    fórmulas), la primera llamada las escribe.
+    """
+
+    def __init__(self, spreadsheet, hoja: str, formulas: Dict[str, str], fila: int = 3):
+        self.spreadsheet = spreadsheet
+        self.hoja = hoja
+        self.formulas = formulas
+        self.fila = fila
+
+    def _claves(self) -> List[str]:
+        # La clave lleva un crc de la fórmula: si la fórmula cambia, las celdas se reescriben
+        return [f"huella_{t}:{zlib.crc32(f.encode('utf-8')):08x}" for t, f in self.formulas.items()]
+
+    def huellas(self, titles: List[str]) -> Dict[str, str]:
+        fin = self.fila + len(self.formulas) - 1
+        rango = f"'{self.hoja}'!A{self.fila}:B{fin}"
+        resp = self.spreadsheet.values_batch_get([rango])
+        vals = (resp.get("valueRanges") or [{}])[0].get("values", [])
+        if [(r + [""])[0] for r in vals] != self._claves():
+            self.spreadsheet.values_batch_update({
+                "valueInputOption": "USER_ENTERED",
+                "data": [{"range": rango, "values": [[k, f] for k, f in zip(self._claves(), self.formulas.values())]}],
+            })
+            return {}
+        por_tab = {t: (r + ["", ""])[1] for t, r in zip(self.formulas, vals)}
+        return {t: por_tab[t] for t in titles if t in por_tab}
+
+# =====================
+# BACKENDS
+# =====================
+class StorageBackend:
+    """Interfaz: open() devuelve (client, spreadsheet) con la API de gspread que usa la app;
+    sonda() la forma barata de saber qué pestañas cambiaron."""
+
+    name = ""
+
+    def open(self) -> Tuple[Any, Any]:
+        raise NotImplementedError
+
+    def sonda(self, spreadsheet, hoja_meta: str, formulas: Dict[str, str]) -> Sonda:
+        return SondaFormulas(spreadsheet, hoja_meta, formulas)
+
+class GspreadBackend(StorageBackend):
+    name = "gsheets"
+
+    def __init__(self, service_account_info: Dict[str, Any], sheet_url: str):
+        self.service_account_info = service_account_info
+        self.sheet_url = sheet_url
+
+    def open(self):
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        scope = ["https://www.googleapis.com/auth/spreadsheets"]
+        creds = Credentials.from_service_account_info(self.service_account_info, scopes=scope)
+        client = gspread.authorize(creds)
+        return client, client.open_by_url(self.sheet_url)
+
+class LocalBackend(StorageBackend):
+    name = "local"
+
+    def __init__(self, latency: float = 0.0, quota_per_minute: int = 0,
+                 spreadsheet: Optional[LocalSpreadsheet] = None):
+        self.spreadsheet = spreadsheet or LocalSpreadsheet(latency=latency, quota_per_minute=quota_per_minute)
+
+    def open(self):
+        return None, self.spreadsheet
+
+    def sonda(self, spreadsheet, hoja_meta: str, formulas: Dict[str, str]) -> Sonda:
+        return SondaLocal(spreadsheet)
@@ -0,0 +1,13 @@
+# conftest.py — H DECANTS (pruebas: backend local simulado y módulos de la raíz importables)
+
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("HD_STORAGE_BACKEND", "local")
+os.environ.setdefault("HD_OUTBOX_WORKER", "0")
+os.environ.setdefault("HD_OUTBOX_PATH", os.path.join(tempfile.gettempdir(), "hd_tests_outbox.sqlite"))
+os.environ.setdefault("HD_MIRROR_PATH", os.path.join(tempfile.gettempdir(), "hd_tests_mirror.sqlite"))
+os.environ.setdefault("HD_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "hd_tests_snapshots"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,56 @@
+import pandas as pd
+
+import sheets
+
+NOMBRES = [
+    "Dior Sauvage Elixir",
+    "Sauvage Dior",
+    "Ysauvagex",
+    "Eau Sauvage",
+    "Suavage Imitación",
+    "Sauvage",
+    "Jean Paul Gaultier",
+    "Éclat d'Arpège",
+]
+
+def _buscador(nombres=NOMBRES):
+    df = pd.DataFrame({"Producto": nombres, "Costo x ml": [float(i) for i in range(len(nombres))],
+                       "Stock disponible": [10.0 * i for i in range(len(nombres))]})
+    return sheets.BuscadorProductos(df)
+
+def test_orden_prefijo_palabra_contiene_parecido():
+    nombres, total = _buscador().buscar("sauvage")
+    assert nombres == [
+        "Sauvage", "Sauvage Dior",                  # empiezan con la consulta (el más corto primero)
+        "Eau Sauvage", "Dior Sauvage Elixir",       # una palabra empieza con ella
+        "Ysauvagex",                                # la contiene
+        "Suavage Imitación",                        # parecido por trigramas
+    ]
+    assert total == 6
+
+def test_sin_acentos_ni_mayusculas():
+    b = _buscador()
+    assert b.buscar("SAÚVAGE") == b.buscar("sauvage")
+    assert b.buscar("eclat")[0] == ["Éclat d'Arpège"]
+    assert b.buscar("  arpege ")[0] == ["Éclat d'Arpège"]
+
+def test_limite_y_total():
+    b = _buscador()
+    nombres, total = b.buscar("sauvage", limite=2)
+    assert nombres == ["Sauvage", "Sauvage Dior"] and total == 6
+    assert b.buscar("", limite=3) == (NOMBRES[:3], len(NOMBRES))
+    assert b.buscar("xyzxyz") == ([], 0)
+
+def test_contiene_igual_que_el_filtro_ingenuo():
+    nombres = [f"Perfume {i:05d} {'Intense' if i % 3 else 'Eau de Toilette'}" for i in range(500)]
+    b = _buscador(nombres)
+    for q in ["00012", "intense", "toilette 0", "e 001", "ume 004"]:
+        encontrados, _ = b.buscar(q, limite=len(nombres))
+        contienen = {n for n in nombres if q in n.lower()}
+        # Todo lo que contiene la consulta sale, y antes que lo que sólo se parece
+        assert set(encontrados[:len(contienen)]) == contienen
+
+def test_datos_del_primero_si_el_nombre_se_repite():
+    b = _buscador(["Sauvage", "Sauvage"])
+    assert b.datos("Sauvage") == (0.0, 0.0)
+    assert b.datos("No existe") is None
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import esquema
+from sheets import ESQUEMAS, SHEET_TAB_PEDIDOS
+
+PEDIDOS = ESQUEMAS[SHEET_TAB_PEDIDOS]
+
+def _motivos(problemas):
+    return {(p.fila, p.columna): (p.valor, p.motivo) for p in problemas}
+
+@pytest.fixture(params=[True, False], ids=["arrow", "pandas"])
+def con_arrow(request, monkeypatch):
+    if request.param and not esquema._HAS_ARROW:
+        pytest.skip("sin pyarrow")
+    monkeypatch.setattr(esquema, "_HAS_ARROW", request.param)
+
+def test_celdas_malformadas_se_reportan_con_su_fila(con_arrow):
+    vals = [
+        ["1", "Ana", "2026-10-01", "Perfume A", "5 ml", "10", "50", "Pagado"],
+        [],                                                   # fila 3: vacía, se descarta
+        ["2", "Bruno", "ayer", "Perfume B", " 3 ", "x", "36", "Pendiente"],
+    ]
+    df, problemas = PEDIDOS.parsear(vals, 2)
+
+    assert df.index.tolist() == [2, 4]
+    assert _motivos(problemas) == {
+        (2, "Mililitros"): ("5 ml", "no es un número"),
+        (4, "Fecha"): ("ayer", "no es una fecha"),
+        (4, "Costo x ml"): ("x", "no es un número"),
+    }
+    # Las celdas inválidas toman el valor por defecto; los espacios alrededor no son error
+    assert df["Mililitros"].tolist() == [0.0, 3.0]
+    assert df["Costo x ml"].tolist() == [10.0, 0.0]
+    assert pd.isna(df.loc[4, "Fecha"]) and df.loc[2, "Fecha"] == pd.Timestamp("2026-10-01")
+
+def test_int32_fuera_de_rango_se_reporta(con_arrow):
+    vals = [[str(n), "Ana", "2026-10-01", "Perfume A", "1", "1", "1", "Pagado"]
+            for n in ("2147483647", "2147483648", "-3000000000", "0", "2.5")]
+    df, problemas = PEDIDOS.parsear(vals, 2)
+
+    assert df["# Pedido"].dtype == np.int32
+    assert df["# Pedido"].tolist() == [2147483647, 0, 0, 0, 2]
+    assert _motivos(problemas) == {
+        (3, "# Pedido"): ("2147483648", "fuera de rango para int32"),
+        (4, "# Pedido"): ("-3000000000", "fuera de rango para int32"),
+        (5, "# Pedido"): ("0", "menor que 1"),
+        (6, "# Pedido"): ("2.5", "tiene decimales"),
+    }
+
+def test_requeridas_vacias_se_reportan(con_arrow):
+    vals = [
+        ["", "Ana", "2026-10-01", "Perfume A", "1", "1", "1", "Pagado"],
+        ["7", "Bruno", "2026-10-02", "  ", "1", "1", "1"],    # sólo espacios y renglón corto
+        ["", "", "", "", "", "", "", ""],                       # sin datos: no se reporta
+    ]
+    df, problemas = PEDIDOS.parsear(vals, 10)
+
+    assert df.index.tolist() == [10, 11]
+    assert _motivos(problemas) == {
+        (10, "# Pedido"): ("", "vacía"),
+        (11, "Producto"): ("  ", "vacía"),
+    }
+    assert df.loc[11, "Estatus"] == ""
+
+def test_numeros_del_backend_local_se_leen_como_texto(con_arrow):
+    # El backend local y el espejo pueden entregar números y None tal cual
+    vals = [[3, None, "2026-10-01", "Perfume A", 5.0, 2, 10.0, "Pagado"]]
+    df, problemas = PEDIDOS.parsear(vals, 2)
+
+    assert problemas == []
+    assert df.loc[2, "# Pedido"] == 3 and df.loc[2, "Mililitros"] == 5.0
+    assert df.loc[2, "Nombre Cliente"] == ""
@@ -0,0 +1,128 @@
+import threading
+
+import pytest
+
+import bench
+import sheets
+
+PROD = "Perfume 00003"
+
+def _stock():
+    _, _, productos_ws, *_ = sheets.get_client_and_ws()
+    actual, _ = sheets._stock_fresco(productos_ws, [PROD])
+    return actual[PROD][1]
+
+def _otro_proceso_compacta(monkeypatch, ws, compactados):
+    """Justo antes de la siguiente escritura a Productos, otro proceso (su propio candado en
+    memoria; sólo comparte la hoja) compacta el libro."""
+    original = ws.batch_update
+
+    def batch_update(*args, **kwargs):
+        monkeypatch.setattr(ws, "batch_update", original)
+        propio = sheets._compactando
+        sheets._compactando = threading.Lock()
+        try:
+            compactados.append(sheets.compactar_libro())
+        finally:
+            sheets._compactando = propio
+        return original(*args, **kwargs)
+    monkeypatch.setattr(ws, "batch_update", batch_update)
+
+def test_bajas_no_pisan_una_compactacion(monkeypatch):
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    sheets.compactar_libro()
+    sheets._anotar_movimientos([(PROD, -5.0, "venta", 1)])
+    inicial = _stock()
+
+    original = sheets.load_productos_df()
+    df = original.drop(original.index[0])
+    compactados = []
+    _otro_proceso_compacta(monkeypatch, sp.worksheet(sheets.SHEET_TAB_PRODUCTOS), compactados)
+    res = sheets.save_productos_df(df, original)
+
+    assert res and res["bajas"] == 1
+    assert compactados == [0]
+    assert _stock() == pytest.approx(inicial)
+    assert sheets.compactar_libro() == 1
+    assert _stock() == pytest.approx(inicial)
+
+def _fila(sp, nombre):
+    filas = sp.worksheet(sheets.SHEET_TAB_PRODUCTOS).get_values()
+    i = next(i for i, r in enumerate(filas) if r[0] == nombre)
+    return i + 1, filas[i]
+
+def _editar(df, nombre, columna, valor):
+    df.loc[df["Producto"] == nombre, columna] = valor
+
+def test_solo_se_escribe_la_diferencia():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    original = sheets.load_productos_df()
+    antes = sp.worksheet(sheets.SHEET_TAB_PRODUCTOS).get_values()
+    df = original.copy()
+    _editar(df, PROD, "Costo x ml", 99.5)
+    df.loc[len(df)] = ["Perfume nuevo", 3.0, 40.0]
+
+    sp.stats.reset()
+    res = sheets.save_productos_df(df, original)
+
+    assert res == {"celdas": 1, "altas": 1, "bajas": 0, "ajustes": 0, "conflictos": []}
+    assert sp.stats.cells_written <= 4      # la celda de costo y la fila nueva
+    despues = sp.worksheet(sheets.SHEET_TAB_PRODUCTOS).get_values()
+    fila, valores = _fila(sp, PROD)
+    assert float(valores[1]) == 99.5
+    assert sheets._producto(despues[len(antes)]) == ("Perfume nuevo", 3.0, 40.0)
+    assert [r for i, r in enumerate(despues[:len(antes)]) if i != fila - 1] == \
+        [r for i, r in enumerate(antes) if i != fila - 1]
+
+def test_stock_editado_va_al_libro_como_ajuste():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    inicial = _stock()
+    celda = _fila(sp, PROD)[1][2]
+    original = sheets.load_productos_df()
+    df = original.copy()
+    _editar(df, PROD, "Stock disponible", inicial + 25.0)
+
+    res = sheets.save_productos_df(df, original)
+
+    assert res["ajustes"] == 1 and res["conflictos"] == []
+    assert _fila(sp, PROD)[1][2] == celda     # la celda compactada no se toca
+    movs = sp.worksheet(sheets.SHEET_TAB_MOVIMIENTOS).get_values()[1:]
+    assert [(r[1], float(r[2]), r[3]) for r in movs] == [(PROD, 25.0, "ajuste")]
+    assert _stock() == pytest.approx(inicial + 25.0)
+
+def test_stock_que_cambio_mientras_se_editaba_se_reporta():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    inicial = _stock()
+    original = sheets.load_productos_df()
+    df = original.copy()
+    _editar(df, PROD, "Stock disponible", inicial + 25.0)
+    _editar(df, PROD, "Costo x ml", 77.0)
+    # Mientras el editor estaba abierto se vendió de ese producto
+    sheets._anotar_movimientos([(PROD, -5.0, "venta", 1)])
+
+    res = sheets.save_productos_df(df, original)
+
+    assert res["ajustes"] == 0
+    assert len(res["conflictos"]) == 1 and res["conflictos"][0].startswith(PROD)
+    assert _stock() == pytest.approx(inicial - 5.0)
+    # El resto de la fila sí se guarda
+    assert float(_fila(sp, PROD)[1][1]) == 77.0
+
+def test_hoja_movida_no_escribe_nada():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    original = sheets.load_productos_df()
+    df = original.copy()
+    _editar(df, PROD, "Costo x ml", 99.5)
+    # Otra sesión puso otro producto en esa fila
+    fila, _ = _fila(sp, PROD)
+    ws = sp.worksheet(sheets.SHEET_TAB_PRODUCTOS)
+    ws.update([["Perfume movido"]], f"A{fila}")
+    antes = ws.get_values()
+
+    assert sheets.save_productos_df(df, original) is None
+    assert ws.get_values() == antes
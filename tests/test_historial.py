@@ -0,0 +1,98 @@
+import random
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import sheets
+from busqueda import normalizar
+
+CLIENTES = ["José Núñez", "jose nunez", "JOSÉ  NÚÑEZ", "Ana López", "Anabel Ruiz", "Luis", "Ñoño", ""]
+ESTATUS = ["Pendiente", "Pagado", "Entregado", "Cotizacion"]
+
+def _pedidos(n=600, semilla=3):
+    """Pedidos de varios renglones, fechas repetidas, algunas vacías o inválidas y # desordenados."""
+    r = random.Random(semilla)
+    vals, pid = [], 0
+    while len(vals) < n:
+        pid = pid + 1 if r.random() < 0.9 else r.randint(1, pid + 1)
+        fecha = (date(2026, 1, 1) + timedelta(days=r.randint(0, 120))).isoformat()
+        fecha = r.choice([fecha] * 8 + ["", "mañana"])
+        cliente = r.choice(CLIENTES)
+        for _ in range(r.randint(1, 2)):
+            vals.append([str(pid), cliente, fecha, f"Perfume {r.randint(1, 9)}", "5", "2",
+                         str(r.choice([10, 12.5, 7])), r.choice(ESTATUS)])
+    df, _ = sheets.ESQUEMAS[sheets.SHEET_TAB_PEDIDOS].parsear(vals, 2)
+    return df
+
+def _ingenuo(df, cliente, desde, hasta, estatus):
+    """El filtro de siempre, renglón por renglón sobre el frame."""
+    m = (df["Fecha"] >= pd.Timestamp(desde)) & (df["Fecha"] <= pd.Timestamp(hasta))
+    if normalizar(cliente):
+        m &= df["Nombre Cliente"].astype(str).map(normalizar).str.contains(normalizar(cliente), regex=False)
+    if estatus:
+        m &= df["Estatus"].astype(str).isin(estatus)
+    res = df[m].assign(_fila=df.index[m])
+    return res.sort_values(["Fecha", "# Pedido", "_fila"], ascending=[False, False, True]).drop(columns="_fila")
+
+FILTROS = [
+    ("", date(2026, 1, 1), date(2026, 5, 1), ()),
+    ("jose", date(2026, 1, 1), date(2026, 5, 1), ()),
+    ("NÚÑ", date(2026, 2, 1), date(2026, 3, 15), ()),
+    ("ana", date(2026, 1, 10), date(2026, 1, 31), ("Pagado",)),
+    ("an", date(2026, 1, 1), date(2026, 5, 1), ("Pagado", "Entregado")),
+    ("", date(2026, 3, 1), date(2026, 2, 1), ()),                   # rango al revés: nada
+    ("zzz", date(2026, 1, 1), date(2026, 5, 1), ()),
+    ("", date(2026, 1, 1), date(2026, 5, 1), ("No existe",)),
+]
+
+@pytest.mark.parametrize("cliente,desde,hasta,estatus", FILTROS)
+def test_filtro_igual_que_el_ingenuo(cliente, desde, hasta, estatus):
+    df = _pedidos()
+    vista = sheets.HistorialVista(df)
+    esperado = _ingenuo(df, cliente, desde, hasta, estatus)
+
+    pos, ids = vista.filtrar(cliente, desde, hasta, estatus)
+    assert vista._df.index[pos].tolist() == esperado.index.tolist()
+    assert [int(i) for i in ids] == [int(i) for i in pd.unique(esperado["# Pedido"])]
+
+@pytest.mark.parametrize("cliente,desde,hasta,estatus", FILTROS[:5])
+def test_paginas_cubren_el_filtro(cliente, desde, hasta, estatus):
+    df = _pedidos()
+    vista = sheets.HistorialVista(df)
+    esperado = _ingenuo(df, cliente, desde, hasta, estatus)
+    ids = [int(i) for i in pd.unique(esperado["# Pedido"])]
+
+    vistos, primera = [], vista.pagina(cliente, desde, hasta, 1, 7, estatus)
+    assert primera["paginas"] == max(1, -(-len(ids) // 7))
+    assert primera["pedidos"] == len(ids) and primera["renglones"] == len(esperado)
+    assert primera["total"] == pytest.approx(esperado["Total"].sum())
+    for p in range(1, primera["paginas"] + 1):
+        pag = vista.pagina(cliente, desde, hasta, p, 7, estatus)
+        assert pag["ids"] == ids[(p - 1) * 7:p * 7]
+        assert pag["filas"].index.tolist() == esperado[esperado["# Pedido"].isin(pag["ids"])].index.tolist()
+        vistos += pag["ids"]
+    assert vistos == ids
+    # Fuera de rango se ajusta a la última (o la primera) página
+    assert vista.pagina(cliente, desde, hasta, 10_000, 7, estatus)["pagina"] == primera["paginas"]
+    assert vista.pagina(cliente, desde, hasta, -3, 7, estatus)["pagina"] == 1
+
+def test_pedido_trae_todos_sus_renglones_en_orden_de_la_hoja():
+    df = _pedidos()
+    vista = sheets.HistorialVista(df)
+    for pid in pd.unique(df["# Pedido"])[:40]:
+        esperado = df[df["# Pedido"] == pid]
+        assert vista.pedido(int(pid)).index.tolist() == esperado.index.tolist()
+
+def test_pedidos_pdf_igual_que_el_filtro():
+    df = _pedidos()
+    vista = sheets.HistorialVista(df)
+    esperado = _ingenuo(df, "jose", date(2026, 1, 1), date(2026, 5, 1), ())
+    n, pedidos = vista.pedidos_pdf("jose", date(2026, 1, 1), date(2026, 5, 1), bloque=5)
+    pedidos = list(pedidos)
+    assert n == len(pedidos) == esperado["# Pedido"].nunique()
+    for pid, cliente, _, estatus, productos in pedidos:
+        todos = df[df["# Pedido"] == pid]             # el PDF lleva todo el pedido, no sólo lo filtrado
+        assert cliente == str(todos["Nombre Cliente"].iloc[0])
+        assert estatus == str(todos["Estatus"].iloc[-1])
+        assert [p[0] for p in productos] == todos["Producto"].astype(str).tolist()
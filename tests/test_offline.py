@@ -0,0 +1,98 @@
+import pytest
+
+import bench
+import sheets
+
+PROD = "Perfume 00003"
+
+def _stock():
+    _, _, productos_ws, *_ = sheets.get_client_and_ws()
+    actual, _ = sheets._stock_fresco(productos_ws, [PROD])
+    return actual[PROD][1]
+
+def _sin_red(sp):
+    """Sheets deja de responder; lo siguiente que lea la app sale del espejo."""
+    sp.sin_red = True
+    sheets.versiones().bump()
+
+def _vuelve_la_red(sp):
+    sp.sin_red = False
+    sheets.reintentar_conexion()
+
+def _vender(ml, prod=PROD):
+    return sheets.guardar_pedido("Cliente Offline", "2026-10-17", "Pendiente", [(prod, ml, 2.0, 2.0 * ml)])
+
+def test_sin_red_lee_del_espejo():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    productos, pedidos = sheets.load_productos_df(), sheets.load_pedidos_df()
+
+    _sin_red(sp)
+    assert sheets.load_productos_df().equals(productos)
+    assert sheets.load_pedidos_df()["# Pedido"].tolist() == pedidos["# Pedido"].tolist()
+    assert sheets.estado_conexion()["offline"]
+
+    # Con el espejo vacío (otro equipo, primera vez) no hay datos, pero tampoco error
+    sheets.get_espejo().reemplazar(sheets.SHEET_TAB_PRODUCTOS, [])
+    sheets.versiones().bump()
+    assert sheets.load_productos_df().empty
+
+def test_pedido_provisional_se_renumera_si_otro_equipo_uso_el_numero():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    maximo = int(sheets.load_pedidos_df()["# Pedido"].max())
+
+    # Otro equipo toma el siguiente # de la bitácora Folios; este no llega a verlo
+    otro = sheets.PedidoIdAllocator(libro=sp).next_id()
+    _sin_red(sp)
+    provisional = _vender(5.0)
+    assert provisional == otro == maximo + 1
+    assert sheets.estado_sync(provisional) == "pendiente"
+
+    _vuelve_la_red(sp)
+    sheets.sincronizar_ahora()
+    reciente = sheets.pedidos_sync_recientes(1)[0]
+    assert reciente["renumerado_de"] == provisional and reciente["offline"]
+    definitivo = reciente["pedido_id"]
+    assert definitivo > provisional and sheets.estado_sync(definitivo) == "sincronizado"
+
+    filas = [r for r in sp.worksheet(sheets.SHEET_TAB_PEDIDOS).get_values()[1:] if r[1] == "Cliente Offline"]
+    assert [int(float(r[0])) for r in filas] == [definitivo]
+
+def test_pedido_provisional_sin_choque_conserva_su_numero():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    sheets.load_pedidos_df()
+    inicial = _stock()
+
+    _sin_red(sp)
+    provisional = _vender(5.0)
+    _vuelve_la_red(sp)
+    sheets.sincronizar_ahora()
+
+    reciente = sheets.pedidos_sync_recientes(1)[0]
+    assert reciente["pedido_id"] == provisional and reciente["renumerado_de"] is None
+    assert _stock() == pytest.approx(inicial - 5.0)
+    assert sheets.conflictos_stock() == []
+
+def test_venta_offline_sin_stock_queda_como_conflicto():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    sheets.load_pedidos_df()
+    inicial = _stock()
+
+    _sin_red(sp)
+    # Sin conexión no se puede verificar contra la hoja: se acepta y se revisa al sincronizar
+    pedido = _vender(inicial + 10.0)
+    sin_producto = _vender(1.0, prod="Perfume que nadie dio de alta")
+    _vuelve_la_red(sp)
+    sheets.sincronizar_ahora()
+
+    assert _stock() == 0.0
+    conflictos = {c["producto"]: c for c in sheets.conflictos_stock()}
+    assert set(conflictos) == {PROD, "Perfume que nadie dio de alta"}
+    assert conflictos[PROD]["pedidos"] == [pedido] and "quedó en 0" in conflictos[PROD]["detalle"]
+    assert conflictos["Perfume que nadie dio de alta"]["pedidos"] == [sin_producto]
+
+    sheets.marcar_conflictos_revisados()
+    assert sheets.conflictos_stock() == []
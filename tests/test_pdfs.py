@@ -0,0 +1,123 @@
+import io
+import os
+import re
+import zipfile
+import zlib
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pdfs
+
+LOGO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hdecants_logo.jpg")
+
+def _pedidos(n):
+    return [(i, f"Cliente {i % 7}", "2026-10-17", "Pagado", [("Perfume", 5.0, 2.5, 12.5)]) for i in range(1, n + 1)]
+
+class FuturoRoto(Future):
+    """Termina en BrokenProcessPool; el pool se da por roto cuando alguien pide el resultado."""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.set_exception(BrokenProcessPool("roto"))
+
+    def result(self, timeout=None):
+        self.pool.roto = True
+        return super().result(timeout)
+
+class PoolQueSeRompe:
+    """ProcessPoolExecutor falso: corre cada lote aquí mismo y el envío número `rompe`
+    termina en BrokenProcessPool; una vez visto, submit() también falla (como el real)."""
+
+    def __init__(self, rompe, *args, **kwargs):
+        self.rompe = rompe
+        self.enviados = 0
+        self.roto = False
+        pdfs._iniciar_proceso(kwargs["initargs"][0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        if self.roto:
+            raise BrokenProcessPool("roto")
+        self.enviados += 1
+        if self.enviados == self.rompe:
+            return FuturoRoto(self)
+        f = Future()
+        f.set_result(fn(*args))
+        return f
+
+def _exportar(monkeypatch, rompe, n=100):
+    monkeypatch.setattr(pdfs, "ProcessPoolExecutor", lambda *a, **k: PoolQueSeRompe(rompe, *a, **k))
+    buf = io.BytesIO()
+    hechos = pdfs.exportar_zip(LOGO, iter(_pedidos(n)), buf, total=n, procesos=2)
+    return hechos, zipfile.ZipFile(io.BytesIO(buf.getvalue())).namelist()
+
+def test_zip_pool_roto_al_esperar_no_pierde_lotes(monkeypatch):
+    # Con 2 procesos caben 4 lotes en vuelo: el tercero se rompe dentro del wait del quinto
+    hechos, nombres = _exportar(monkeypatch, rompe=3)
+    assert hechos == 100
+    assert sorted(nombres) == sorted(pdfs.nombre_pdf(p[0], p[1]) for p in _pedidos(100))
+
+def test_zip_pool_roto_al_final_no_pierde_lotes(monkeypatch):
+    hechos, nombres = _exportar(monkeypatch, rompe=13)
+    assert hechos == 100 and len(set(nombres)) == 100
+
+def test_zip_pool_sano(monkeypatch):
+    hechos, nombres = _exportar(monkeypatch, rompe=0)
+    assert hechos == 100 and len(set(nombres)) == 100
+
+def _paginas(doc):
+    """Contenido (descomprimido) de cada página de `doc`, en orden, y cuántas imágenes trae."""
+    objetos = {int(m.group(1)): m.group(2) for m in re.finditer(rb"(\d+) 0 obj\n(.*?)\nendobj", doc, re.S)}
+    raiz = int(re.search(rb"/Root (\d+) 0 R", doc[doc.rindex(b"trailer"):]).group(1))
+    paginas = objetos[int(re.search(rb"/Pages (\d+) 0 R", objetos[raiz]).group(1))]
+    kids = re.search(rb"/Kids \[([^\]]*)\]", paginas).group(1)
+    contenidos = []
+    for n in re.findall(rb"(\d+) 0 R", kids):
+        stream = objetos[int(re.search(rb"/Contents (\d+) 0 R", objetos[int(n)]).group(1))]
+        datos = stream[stream.index(b"stream\n") + 7:stream.rindex(b"endstream")].rstrip(b"\n")
+        contenidos.append(zlib.decompress(datos))
+    return contenidos, sum(b"/Subtype /Image" in o for o in objetos.values())
+
+def test_zip_igual_que_pdf_individual():
+    p = _pedidos(1)[0]
+    buf = io.BytesIO()
+    assert pdfs.exportar_zip(LOGO, iter([p]), buf, total=1, procesos=1) == 1
+    doc = zipfile.ZipFile(io.BytesIO(buf.getvalue())).read(pdfs.nombre_pdf(p[0], p[1]))
+    # Misma maqueta; sólo cambia la fecha de creación del documento
+    assert _paginas(doc) == _paginas(pdfs.renderizar(pdfs.Plantilla(LOGO), *p))
+
+def _varios(n):
+    # Algunos pedidos ocupan más de una página
+    return [(i, f"Cliente {i}", "2026-10-17", "Pagado", [("Perfume", 5.0, 2.5, 12.5)] * (1 + i % 40))
+            for i in range(1, n + 1)]
+
+def _individuales(pedidos):
+    plantilla = pdfs.Plantilla(LOGO)
+    return [pag for p in pedidos for pag in _paginas(pdfs.renderizar(plantilla, *p))[0]]
+
+def test_pdf_unico_son_los_individuales_en_orden_con_un_logo(tmp_path):
+    pedidos = _varios(20)
+    ruta = tmp_path / "todos.pdf"
+    assert pdfs.exportar_pdf_unico(LOGO, iter(pedidos), str(ruta), total=20, procesos=1) == 20
+    paginas, imagenes = _paginas(ruta.read_bytes())
+    assert len(paginas) > 20
+    assert paginas == _individuales(pedidos)
+    assert imagenes == 1
+
+def test_pdf_unico_con_pool_roto_conserva_el_orden(monkeypatch):
+    monkeypatch.setattr(pdfs, "ProcessPoolExecutor", lambda *a, **k: PoolQueSeRompe(3, *a, **k))
+    pedidos = _varios(100)
+    buf = io.BytesIO()
+    assert pdfs.exportar_pdf_unico(LOGO, iter(pedidos), buf, total=100, procesos=2) == 100
+    assert _paginas(buf.getvalue())[0] == _individuales(pedidos)
+
+def test_pdf_unico_sin_pedidos_no_escribe(tmp_path):
+    ruta = tmp_path / "vacio.pdf"
+    assert pdfs.exportar_pdf_unico(LOGO, iter([]), str(ruta)) == 0
+    assert not ruta.exists()
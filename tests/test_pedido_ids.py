@@ -0,0 +1,70 @@
+import random
+import threading
+import time
+
+import sheets
+from storage import LocalSpreadsheet
+
+class ConRetardo:
+    """Libro u hoja con un retardo al azar antes de cada llamada: como procesos separados
+    en la red, las lecturas y escrituras de cada uno se intercalan en cualquier orden."""
+
+    def __init__(self, destino):
+        self._destino = destino
+
+    def __getattr__(self, nombre):
+        attr = getattr(self._destino, nombre)
+        if not callable(attr):
+            return attr
+
+        def llamada(*args, **kwargs):
+            time.sleep(random.uniform(0, 0.004))
+            res = attr(*args, **kwargs)
+            return ConRetardo(res) if nombre == "worksheet" else res
+        return llamada
+
+def _libro(max_id=41, contador=""):
+    sp = LocalSpreadsheet()
+    sp.seed(sheets.SHEET_TAB_PEDIDOS, [sheets.PEDIDOS_COLS] + [[i, "Ana", "2026-10-17", "P", 5, 1, 5, "Pagado"]
+                                                               for i in range(1, max_id + 1)])
+    # Libros nuevos: Meta sin contador; los anteriores a Folios traen next_pedido_id en B2
+    meta = sheets.HOJAS_INICIALES[sheets.SHEET_TAB_META] + ([["next_pedido_id", contador]] if contador else [])
+    sp.seed(sheets.SHEET_TAB_META, meta)
+    sp.seed(sheets.SHEET_TAB_FOLIOS, [sheets.FOLIOS_COLS])
+    return ConRetardo(sp)
+
+def _repartir(allocators, por_hilo):
+    ids, lock = [], threading.Lock()
+    arranque = threading.Barrier(len(allocators))
+
+    def trabajar(a):
+        arranque.wait()
+        for _ in range(por_hilo):
+            pid = a.next_id()
+            with lock:
+                ids.append(pid)
+
+    hilos = [threading.Thread(target=trabajar, args=(a,)) for a in allocators]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return ids
+
+def test_procesos_concurrentes_no_repiten_id():
+    sp = _libro()
+    ids = _repartir([sheets.PedidoIdAllocator(libro=sp) for _ in range(3)], 10)
+    assert len(ids) == 30 and len(set(ids)) == 30
+    # Sin bloques no quedan huecos: sigue la numeración de Pedidos
+    assert sorted(ids) == list(range(42, 72))
+
+def test_bloques_concurrentes_no_repiten_id():
+    sp = _libro()
+    allocators = [sheets.PedidoIdAllocator(block=4, libro=sp) for _ in range(3)] + [sheets.PedidoIdAllocator(libro=sp)]
+    ids = _repartir(allocators, 10)
+    assert len(set(ids)) == 40 and min(ids) >= 42
+
+def test_sigue_el_contador_viejo_de_meta():
+    sp = _libro(max_id=41, contador="100")
+    a, b = sheets.PedidoIdAllocator(libro=sp), sheets.PedidoIdAllocator(libro=sp)
+    assert [a.next_id(), b.next_id(), a.next_id()] == [100, 101, 102]
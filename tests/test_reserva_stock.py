@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+import bench
+import scheduler
+import sheets
+
+PROD = "Perfume 00003"
+
+def _stock():
+    _, _, productos_ws, *_ = sheets.get_client_and_ws()
+    actual, _ = sheets._stock_fresco(productos_ws, [PROD])
+    return actual[PROD][1]
+
+def _validan_a_la_vez(monkeypatch, procesos):
+    """La primera validación de cada proceso espera a las de los demás: todos ven el mismo
+    stock antes de que nadie anote (lo que el candado en memoria no evita entre procesos)."""
+    arranque = threading.Barrier(procesos, timeout=10)
+    original, primera = sheets._faltantes_stock, threading.local()
+
+    def faltantes(*args):
+        res = original(*args)
+        if not getattr(primera, "hecha", False):
+            primera.hecha = True
+            arranque.wait()
+        return res
+    monkeypatch.setattr(sheets, "_faltantes_stock", faltantes)
+
+def test_dos_procesos_no_sobrevenden(monkeypatch):
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    inicial = _stock()
+    pide = round(inicial * 0.6, 3)
+    _validan_a_la_vez(monkeypatch, 2)
+
+    resultados, lock = [], threading.Lock()
+
+    def vender(pedido_id):
+        # Sin _candados_stock: cada hilo hace de un proceso aparte
+        try:
+            res = sheets._reservar_stock({PROD: -pide}, "venta", pedido_id, f"r{pedido_id}")
+        except sheets.StockInsuficiente as e:
+            res = e
+        with lock:
+            resultados.append(res)
+
+    hilos = [threading.Thread(target=vender, args=(i,)) for i in (1, 2)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    assert sum(r is True for r in resultados) == 1
+    assert sum(isinstance(r, sheets.StockInsuficiente) for r in resultados) == 1
+    assert _stock() == pytest.approx(inicial - pide)
+
+    # La reserva rechazada quedó anulada en el libro con su propio lote
+    movs = sp.worksheet(sheets.SHEET_TAB_MOVIMIENTOS).get_values()[1:]
+    anuladas = [r for r in movs if r[3] == "anulacion"]
+    assert len(anuladas) == 1 and anuladas[0][5].endswith("-x")
+    assert float(anuladas[0][2]) == pytest.approx(pide)
+
+def test_verificacion_no_comparte_lecturas_en_vuelo(monkeypatch):
+    bench.preparar(1000)
+    sheets.get_client_and_ws()
+    original, vistas = sheets._stock_fresco, []
+
+    def stock_fresco(*args, hasta_fila=None, **kwargs):
+        vistas.append((hasta_fila is not None, getattr(scheduler._hilo, "sin_coalescer", False)))
+        return original(*args, hasta_fila=hasta_fila, **kwargs)
+    monkeypatch.setattr(sheets, "_stock_fresco", stock_fresco)
+
+    assert sheets._reservar_stock({PROD: -1.0}, "venta", 1, "r1") is True
+    # La validación previa sale del frame en memoria; sólo la verificación va a la hoja
+    assert vistas == [(True, True)]
+
+def test_validacion_previa_confirma_con_la_hoja_antes_de_rechazar():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    df = sheets.load_productos_df()
+    en_memoria = float(df.loc[df["Producto"] == PROD, "Stock disponible"].iloc[0])
+    fila = sheets.productos_index().get()[PROD][0]
+    # Otro equipo subió el stock; el frame en memoria todavía no lo sabe
+    sp.worksheet(sheets.SHEET_TAB_PRODUCTOS).update([[en_memoria + 100]], f"C{fila}")
+
+    assert sheets._reservar_stock({PROD: -(en_memoria + 50)}, "venta", 1, "r1") is True
+    assert _stock() == pytest.approx(50.0)
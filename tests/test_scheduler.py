@@ -0,0 +1,49 @@
+import threading
+
+from scheduler import Programado, Scheduler, sin_coalescer
+
+class HojaLenta:
+    """La primera lectura se queda en vuelo hasta `soltar`; cada lectura ve las filas de ese momento."""
+
+    def __init__(self):
+        self.filas = [["a"]]
+        self.en_vuelo = threading.Event()
+        self.soltar = threading.Event()
+        self.lecturas = 0
+
+    def get_values(self, rango=None):
+        self.lecturas += 1
+        vista = [list(r) for r in self.filas]
+        if self.lecturas == 1:
+            self.en_vuelo.set()
+            self.soltar.wait(5)
+        return vista
+
+def _lectura_vieja_y_otra(aislada):
+    hoja = HojaLenta()
+    ws = Programado(hoja, Scheduler(per_minute=0))
+    vieja = threading.Thread(target=ws.get_values, args=("A1:A",))
+    vieja.start()
+    hoja.en_vuelo.wait(5)
+    hoja.filas.append(["b"])                   # nuestra escritura, después de esa lectura
+
+    res = []
+    def leer():
+        if aislada:
+            with sin_coalescer():
+                res.append(ws.get_values("A1:A"))
+        else:
+            res.append(ws.get_values("A1:A"))
+    nuestra = threading.Thread(target=leer)
+    nuestra.start()
+    nuestra.join(0.5)
+    hoja.soltar.set()
+    nuestra.join(5)
+    vieja.join(5)
+    return res[0]
+
+def test_lecturas_identicas_comparten_la_que_esta_en_vuelo():
+    assert _lectura_vieja_y_otra(aislada=False) == [["a"]]
+
+def test_sin_coalescer_ve_la_escritura_previa():
+    assert _lectura_vieja_y_otra(aislada=True) == [["a"], ["b"]]
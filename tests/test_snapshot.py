@@ -0,0 +1,29 @@
+import bench
+import sheets
+
+def _reiniciar():
+    """Como un proceso nuevo: sin caches en memoria, con el snapshot en disco."""
+    sheets.get_snapshots().esperar()
+    sheets.limpiar_caches()
+    sheets.get_client_and_ws()
+
+def _arrancar(size=1000):
+    sp, _ = bench.preparar(size)
+    sheets.get_client_and_ws()
+    df = sheets.load_pedidos_df()
+    return sp, df
+
+def test_snapshot_con_hoja_sin_cambios_lee_solo_la_cola():
+    sp, df = _arrancar()
+    _reiniciar()
+    sp.stats.reset()
+    assert sheets.load_pedidos_df().equals(df)
+    assert sp.stats.cells_read < 100
+
+def test_snapshot_con_hoja_editada_en_medio_recarga_completa():
+    sp, df = _arrancar()
+    nuevo = "Entregado" if df.loc[50, "Estatus"] != "Entregado" else "Pendiente"
+    # Mientras el proceso dormía, alguien cambió un estatus (mismo número de filas)
+    sp.worksheet(sheets.SHEET_TAB_PEDIDOS).update([[nuevo]], "H50")
+    _reiniciar()
+    assert sheets.load_pedidos_df().loc[50, "Estatus"] == nuevo
@@ -0,0 +1,138 @@
+import re
+
+import bench
+import sheets
+from storage import SondaFormulas, col_to_num
+
+# Los únicos dos términos que puede llevar una huella; cualquier otra cosa no pasa el fullmatch
+CONTEO = re.compile(r"COUNTA\('(?P<tab>[^']+)'!A:A\)")
+SUMA = re.compile(r"SUMPRODUCT\(\(MOD\(ROW\('(?P<tab>[^']+)'!(?P<col>[A-Z])2:(?P=col)\),997\)\+1\)"
+                  r"\*IFERROR\(CODE\(MID\('(?P=tab)'!(?P=col)2:(?P=col),SEQUENCE\(1,(?P<largo>\d+)\),1\)\),0\)"
+                  r"\*SEQUENCE\(1,(?P=largo)\)\)")
+
+def _terminos(formula):
+    assert formula.startswith("=")
+    out = []
+    for parte in formula[1:].split('&"|"&'):
+        m = CONTEO.fullmatch(parte) or SUMA.fullmatch(parte)
+        assert m, parte
+        out.append(m)
+    return out
+
+def evaluar(formula, hojas):
+    """Lo que Sheets calcula para la fórmula de huella sobre `hojas` ({pestaña: filas})."""
+    valores = []
+    for m in _terminos(formula):
+        filas = hojas[m["tab"]]
+        if m.re is CONTEO:
+            valores.append(sum(1 for r in filas if r and str(r[0]) != ""))
+            continue
+        c, largo, total = col_to_num(m["col"]) - 1, int(m["largo"]), 0
+        for fila, r in enumerate(filas[1:], start=2):
+            texto = str(r[c]) if c < len(r) else ""
+            for k, ch in enumerate(texto[:largo], start=1):
+                total += (fila % 997 + 1) * ord(ch) * k
+        valores.append(total)
+    return "|".join(str(v) for v in valores)
+
+def _pedidos():
+    return [sheets.PEDIDOS_COLS,
+            [1, "Ana López", "2026-10-01", "Perfume A", 5, 10, 50, "Pendiente"],
+            [2, "Bruno Díaz", "2026-10-02", "Perfume B", 3, 12, 36, "Cotizacion"],
+            [3, "Carla Ruiz", "2026-10-03", "Perfume C", 8, 11, 88, "Pagado"]]
+
+def test_huella_cubre_todas_las_columnas():
+    columnas = {sheets.SHEET_TAB_PRODUCTOS: sheets.PRODUCTOS_COLS, sheets.SHEET_TAB_PEDIDOS: sheets.PEDIDOS_COLS,
+                sheets.SHEET_TAB_COMPRAS: sheets.COMPRAS_COLS, sheets.SHEET_TAB_MOVIMIENTOS: sheets.MOVIMIENTOS_COLS}
+    for tab, cols in columnas.items():
+        terminos = _terminos(sheets.HUELLAS[tab])
+        assert terminos[0].re is CONTEO
+        assert {m["tab"] for m in terminos} == {tab}
+        assert [col_to_num(m["col"]) for m in terminos[1:]] == list(range(1, len(cols) + 1))
+
+def test_huella_ve_ediciones_del_mismo_largo():
+    formula = sheets.HUELLAS[sheets.SHEET_TAB_PEDIDOS]
+    base = evaluar(formula, {sheets.SHEET_TAB_PEDIDOS: _pedidos()})
+    ediciones = [
+        lambda f: f[1].__setitem__(7, "Entregado"),      # Pendiente -> Entregado
+        lambda f: f[2].__setitem__(7, "En Proceso"),     # Cotizacion -> En Proceso
+        lambda f: f[1].__setitem__(1, "Ana Lopes"),      # cliente renombrado, mismo largo
+        lambda f: f[3].__setitem__(3, "Perfume D"),      # producto, mismo largo
+        lambda f: (f[1].__setitem__(6, 36), f[2].__setitem__(6, 50)),  # totales intercambiados
+    ]
+    for editar in ediciones:
+        filas = _pedidos()
+        editar(filas)
+        otra = evaluar(formula, {sheets.SHEET_TAB_PEDIDOS: filas})
+        assert otra != base
+        assert sheets._filas_huella(otra) == sheets._filas_huella(base) == 4
+
+class LibroConFormulas:
+    """values_batch_get / values_batch_update de Sheets sobre Meta, evaluando las huellas."""
+
+    def __init__(self, hojas):
+        self.hojas = hojas
+        self.meta = {}
+        self.escrituras = 0
+
+    def values_batch_update(self, body):
+        self.escrituras += 1
+        for d in body["data"]:
+            fila = int(re.search(r"!A(\d+):", d["range"]).group(1))
+            for i, r in enumerate(d["values"]):
+                self.meta[fila + i] = list(r)
+
+    def values_batch_get(self, rangos):
+        desde, hasta = map(int, re.search(r"!A(\d+):B(\d+)", rangos[0]).groups())
+        vals = []
+        for f in range(desde, hasta + 1):
+            if f in self.meta:
+                clave, formula = self.meta[f]
+                vals.append([clave, evaluar(formula, self.hojas)])
+        return {"valueRanges": [{"values": vals}]}
+
+def test_sonda_formulas_escribe_y_lee_huellas():
+    hojas = {sheets.SHEET_TAB_PRODUCTOS: [sheets.PRODUCTOS_COLS, ["Perfume A", 10, 100]],
+             sheets.SHEET_TAB_PEDIDOS: _pedidos(),
+             sheets.SHEET_TAB_COMPRAS: [sheets.COMPRAS_COLS],
+             sheets.SHEET_TAB_MOVIMIENTOS: [sheets.MOVIMIENTOS_COLS]}
+    libro = LibroConFormulas(hojas)
+    sonda = SondaFormulas(libro, sheets.SHEET_TAB_META, sheets.HUELLAS)
+    tabs = list(sheets.HUELLAS)
+
+    assert sonda.huellas(tabs) == {}           # primera vez: escribe las celdas de control
+    antes = sonda.huellas(tabs)
+    assert set(antes) == set(tabs) and libro.escrituras == 1
+
+    hojas[sheets.SHEET_TAB_PEDIDOS][1][7] = "Entregado"
+    despues = sonda.huellas(tabs)
+    assert despues[sheets.SHEET_TAB_PEDIDOS] != antes[sheets.SHEET_TAB_PEDIDOS]
+    assert {t: despues[t] for t in tabs if t != sheets.SHEET_TAB_PEDIDOS} == \
+           {t: antes[t] for t in tabs if t != sheets.SHEET_TAB_PEDIDOS}
+
+def _otro_estatus(actual):
+    return "Entregado" if actual != "Entregado" else "Pendiente"
+
+def test_edicion_en_medio_recarga_pedidos():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    v = sheets.versiones()
+    v.sondear(forzar=True)
+    nuevo = _otro_estatus(sheets.load_pedidos_df().loc[50, "Estatus"])
+
+    sp.worksheet(sheets.SHEET_TAB_PEDIDOS).update([[nuevo]], "H50")
+    v.sondear(forzar=True)
+    assert sheets.load_pedidos_df().loc[50, "Estatus"] == nuevo
+
+def test_filas_nuevas_de_otro_equipo_solo_leen_la_cola():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    v = sheets.versiones()
+    v.sondear(forzar=True)
+    n = len(sheets.load_pedidos_df())
+
+    sp.worksheet(sheets.SHEET_TAB_PEDIDOS).append_rows([[999_999, "Otro", "2026-10-17", "Perfume 00001", 5, 5, 25, "Pagado"]])
+    v.sondear(forzar=True)
+    sp.stats.reset()
+    assert len(sheets.load_pedidos_df()) == n + 1
+    assert sp.stats.cells_read < 100
@@ -0,0 +1,60 @@
+import bench
+import sheets
+
+PROD = "Perfume 00003"
+
+def _stock():
+    _, _, productos_ws, *_ = sheets.get_client_and_ws()
+    actual, _ = sheets._stock_fresco(productos_ws, [PROD])
+    return actual[PROD][1]
+
+def _respuesta_perdida(monkeypatch, sp):
+    """El siguiente append al libro sí se escribe, pero la respuesta no llega."""
+    ws = sp.worksheet(sheets.SHEET_TAB_MOVIMIENTOS)
+    original = ws.append_rows
+
+    def append_rows(*args, **kwargs):
+        monkeypatch.setattr(ws, "append_rows", original)
+        original(*args, **kwargs)
+        raise ConnectionError("respuesta perdida (simulado)")
+    monkeypatch.setattr(ws, "append_rows", append_rows)
+
+def _reintento_no_descuenta_dos_veces(monkeypatch, compactar):
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    outbox = sheets.get_outbox()
+    inicial = _stock()
+
+    outbox.encolar(1, {"stock": {PROD: -5.0}})
+    _respuesta_perdida(monkeypatch, sp)
+    outbox.procesar()
+    assert outbox.pendientes("stock")[0]["intentos"] == 1
+
+    # Antes del reintento llega otro pedido (el lote ya no es el mismo) y, quizá, se compacta
+    outbox.encolar(2, {"stock": {PROD: -3.0}})
+    if compactar:
+        assert sheets.compactar_libro() == 1
+    outbox.procesar()
+    assert not outbox.pendientes("stock")
+    assert _stock() == inicial - 8.0
+    lotes = [r[5] for r in sp.worksheet(sheets.SHEET_TAB_MOVIMIENTOS).get_values()[1:]]
+    assert len(lotes) == 2 and len(set(lotes)) == 2
+
+def test_reintento_con_otras_entradas(monkeypatch):
+    _reintento_no_descuenta_dos_veces(monkeypatch, compactar=False)
+
+def test_reintento_tras_compactar(monkeypatch):
+    _reintento_no_descuenta_dos_veces(monkeypatch, compactar=True)
+
+def test_venta_no_vuelve_a_leer_productos():
+    sp, _ = bench.preparar(1000)
+    sheets.get_client_and_ws()
+    antes = sheets.load_productos_df().set_index("Producto")["Stock disponible"]
+
+    # Venta de otro proceso: sólo el libro crece
+    sp.worksheet(sheets.SHEET_TAB_MOVIMIENTOS).append_rows([["2026-10-17", PROD, -5, "venta", 1, "x1"]])
+    sheets.versiones().sondear(forzar=True)
+    sp.stats.reset()
+    despues = sheets.load_productos_df().set_index("Producto")["Stock disponible"]
+    assert despues[PROD] == antes[PROD] - 5
+    assert sp.stats.cells_read < 50